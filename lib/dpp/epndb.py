@@ -0,0 +1,200 @@
+import os
+import json
+import logging
+import numpy as np
+from os.path import join, exists, expanduser, getmtime
+
+logger = logging.getLogger(__name__)
+
+EPNDB_CACHE_DIR = os.environ.get("DPP_EPNDB_CACHE", join(expanduser("~"), ".cache", "dpp", "epndb"))
+STOKES = ("I", "Q", "U", "V")
+
+
+def _scandirs(directory):
+    """The sub-directories of a directory, or nothing if it doesn't exist"""
+    try:
+        return [entry for entry in os.scandir(directory) if entry.is_dir()]
+    except FileNotFoundError:
+        return []
+
+
+def scan_epndb(epndb_loc):
+    """
+    Walks the EPNDB json tree (json/<author>/<pulsar>/<entry>.json) once without reading any files
+
+    Returns:
+    --------
+    pulsar_dirs: dictionary
+        pulsar: {directory: modification time} of each directory holding entries of the pulsar
+    """
+    pulsar_dirs = {}
+    for author in _scandirs(join(epndb_loc, "json")):
+        for psr_dir in _scandirs(author.path):
+            pulsar_dirs.setdefault(psr_dir.name, {})[psr_dir.path] = psr_dir.stat().st_mtime
+    return pulsar_dirs
+
+
+def tree_mtimes(epndb_loc):
+    """
+    The modification times of the json directory and its author directories. These change whenever a pulsar
+    directory is added or removed, so they tell whether a scan of the tree is still complete
+
+    Returns:
+    --------
+    tree: dictionary
+        {directory: modification time}
+    """
+    json_dir = join(epndb_loc, "json")
+    if not exists(json_dir):
+        return {}
+    tree = {json_dir: getmtime(json_dir)}
+    for author in _scandirs(json_dir):
+        tree[author.path] = author.stat().st_mtime
+    return tree
+
+
+def _write_atomic(path, write):
+    """Writes through a temporary file so that concurrent readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _pulsar_cache(cache_dir, pulsar):
+    return join(cache_dir, f"{pulsar}.npz")
+
+
+def build_pulsar(pulsar, directories, cache_dir=EPNDB_CACHE_DIR):
+    """
+    Converts the EPNDB json entries of a pulsar into one <pulsar>.npz of a float32 (npoints, 2) array of every series
+    and a json of the header values and the slice of each series. Both are in the one file, so a reader never pairs
+    the series of one build with the entries of another. Entries without a frequency are ignored and the rest are
+    sorted by frequency
+    """
+    entries = []
+    series_arrays = []
+    n_points = 0
+    for directory in directories:
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if not entry.name.endswith(".json"):
+                continue
+            with open(entry.path) as json_file:
+                data = json.load(json_file)
+            header = data["hdr"]
+            series = data["series"]
+            if "freq" not in header:
+                continue
+            meta = {"file": entry.path, "freq": float(header["freq"]), "dm": float(header["dm"]),
+                    "rm": float(header["rm"]), "site": header["site"], "series": {}}
+            for stokes in STOKES:
+                if stokes in series and len(series[stokes]):
+                    points = np.asarray(series[stokes], dtype=np.float32)[:, :2]
+                    meta["series"][stokes] = [n_points, n_points + len(points)]
+                    series_arrays.append(points)
+                    n_points += len(points)
+            entries.append(meta)
+    entries.sort(key=lambda meta: meta["freq"])
+    os.makedirs(cache_dir, exist_ok=True)
+    series = np.concatenate(series_arrays) if series_arrays else np.empty((0, 2), dtype=np.float32)
+    _write_atomic(_pulsar_cache(cache_dir, pulsar),
+                  lambda f: np.savez(f, series=series, entries=np.array(json.dumps(entries))))
+    logger.debug(f"Cached {len(entries)} EPNDB entries of {pulsar}")
+
+
+def _read_index(cache_dir):
+    """
+    Returns the cache's index: 'pulsars', the directories of each cached pulsar, and 'tree', the tree_mtimes() of the
+    EPNDB when it was last scanned
+    """
+    index_file = join(cache_dir, "index.json")
+    if exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+        if "pulsars" in index:
+            return index
+    return {"pulsars": {}, "tree": {}}
+
+
+def _write_index(index, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_atomic(join(cache_dir, "index.json"), lambda f: f.write(json.dumps(index).encode("utf-8")))
+
+
+def update_cache(epndb_loc, cache_dir=EPNDB_CACHE_DIR):
+    """
+    Brings the cache up to date with the EPNDB, rebuilding only the pulsars whose directories have changed
+
+    Returns:
+    --------
+    pulsar_dirs: dictionary
+        pulsar: {directory: modification time}
+    """
+    index = _read_index(cache_dir)
+    # Before the scan, so a pulsar added during it makes the next lookup scan again
+    tree = tree_mtimes(epndb_loc)
+    pulsar_dirs = scan_epndb(epndb_loc)
+    rebuilt = 0
+    for pulsar, directories in pulsar_dirs.items():
+        if index["pulsars"].get(pulsar) != directories or not exists(_pulsar_cache(cache_dir, pulsar)):
+            build_pulsar(pulsar, directories, cache_dir=cache_dir)
+            rebuilt += 1
+    _write_index({"pulsars": pulsar_dirs, "tree": tree}, cache_dir)
+    logger.debug(f"EPNDB cache: {len(pulsar_dirs)} pulsars, {rebuilt} rebuilt")
+    return pulsar_dirs
+
+
+def _is_current(directories):
+    """Checks that none of the directories have had anything added or removed since their times were recorded"""
+    if not directories:
+        return False
+    try:
+        return all(getmtime(directory) == mtime for directory, mtime in directories.items())
+    except FileNotFoundError:
+        return False
+
+
+def load_pulsar(pulsar, epndb_loc, cache_dir=EPNDB_CACHE_DIR):
+    """
+    Loads the cached EPNDB entries of a pulsar, updating the cache first if the pulsar's entries have changed or the
+    pulsar isn't in it yet. A pulsar that isn't on the EPNDB is only looked for again once a pulsar has been added to
+    the EPNDB. If epndb_loc is None, only the cache is read
+
+    Returns:
+    --------
+    entries: list
+        A dictionary of 'freq', 'dm', 'rm', 'site' and each Stokes series as a (npoints, 2) array for each entry,
+        sorted by frequency
+
+    Raises:
+    -------
+    KeyError
+        If the pulsar isn't on the EPNDB, or isn't cached and there is no epndb_loc
+    """
+    index = _read_index(cache_dir)
+    psr_cache = _pulsar_cache(cache_dir, pulsar)
+    if epndb_loc is None:
+        if pulsar not in index["pulsars"] or not exists(psr_cache):
+            raise KeyError(f"{pulsar} is not in the EPNDB cache and no EPNDB location was given")
+    elif pulsar not in index["pulsars"]:
+        # No need to look again if no pulsars have been added since the last scan
+        if _is_current(index["tree"]):
+            raise KeyError(pulsar)
+        if pulsar not in update_cache(epndb_loc, cache_dir=cache_dir):
+            raise KeyError(pulsar)
+    elif not _is_current(index["pulsars"][pulsar]) or not exists(psr_cache):
+        directories = scan_epndb(epndb_loc).get(pulsar)
+        if not directories:
+            del index["pulsars"][pulsar]
+            _write_index(index, cache_dir)
+            raise KeyError(pulsar)
+        build_pulsar(pulsar, directories, cache_dir=cache_dir)
+        index["pulsars"][pulsar] = directories
+        _write_index(index, cache_dir)
+    with np.load(psr_cache) as cached:
+        series = cached["series"]
+        entries = json.loads(str(cached["entries"]))
+    for meta in entries:
+        for stokes, (start, stop) in meta.pop("series").items():
+            meta[stokes] = series[start:stop]
+    return entries
@@ -0,0 +1,238 @@
+import os
+import glob
+import struct
+import logging
+import numpy as np
+from os.path import join, basename, abspath, getsize, getmtime, exists
+
+logger = logging.getLogger(__name__)
+
+# The PulsarFeatureLab feature type (Lyon et al. 2016) these features reproduce and their order in the feature matrix
+FEATURE_TYPE = 6
+FEATURE_NAMES = ["profile_mean", "profile_std", "profile_kurtosis", "profile_skewness",
+                 "dm_curve_mean", "dm_curve_std", "dm_curve_kurtosis", "dm_curve_skewness"]
+# Changed whenever the feature definitions change so old cached features aren't reused
+FEATURE_VERSION = 2
+
+
+def read_pfd(filename):
+    """
+    Reads the parts of a PRESTO .pfd file that are needed for feature extraction.
+    Follows the layout read by PRESTO's prepfold.pfd class
+
+    Returns:
+    --------
+    pfd: dictionary
+        Contains the header values, 'dms', 'periods', 'pdots', 'profs' (npart, nsub, proflen) and
+        'stats' (npart, nsub, 7) arrays as well as the derived 'subfreqs' and 'binspersec'
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    # The byte order is whichever gives sensible array dimensions
+    endian = "<"
+    if min(abs(np.asarray(struct.unpack_from("<5i", data, 0)))) > 100000:
+        endian = ">"
+    pos = 0
+    def unpack(fmt):
+        nonlocal pos
+        values = struct.unpack_from(endian + fmt, data, pos)
+        pos += struct.calcsize(endian + fmt)
+        return values
+    def read_string():
+        nonlocal pos
+        length, = unpack("i")
+        string = data[pos:pos + length].decode("utf-8", errors="replace")
+        pos += length
+        return string
+    def read_doubles(count):
+        nonlocal pos
+        values = np.frombuffer(data, dtype=f"{endian}f8", count=count, offset=pos).astype(np.float64)
+        pos += 8 * count
+        return values
+
+    pfd = {"filename": filename}
+    numdms, numperiods, numpdots, pfd["nsub"], pfd["npart"] = unpack("5i")
+    pfd["proflen"], pfd["numchan"], _, _, _, _, _ = unpack("7i")
+    pfd["filenm"] = read_string()
+    pfd["candnm"] = read_string()
+    pfd["telescope"] = read_string()
+    read_string() # pgdev
+    # Old pfds don't have the position
+    test = data[pos:pos + 16]
+    if b":" in test:
+        pfd["rastr"] = test[:test.find(b"\0")].decode("utf-8")
+        test = data[pos + 16:pos + 32]
+        pfd["decstr"] = test[:test.find(b"\0")].decode("utf-8")
+        pos += 32
+    else:
+        pfd["rastr"] = pfd["decstr"] = "Unknown"
+    pfd["dt"], pfd["startT"] = unpack("2d")
+    pfd["endT"], pfd["tepoch"], pfd["bepoch"], pfd["avgvoverc"], pfd["lofreq"], pfd["chan_wid"], pfd["bestdm"] = unpack("7d")
+    unpack("2f")
+    pfd["topo_p1"], pfd["topo_p2"], pfd["topo_p3"] = unpack("3d")
+    unpack("2f")
+    pfd["bary_p1"], pfd["bary_p2"], pfd["bary_p3"] = unpack("3d")
+    unpack("2f")
+    pfd["fold_p1"], pfd["fold_p2"], pfd["fold_p3"] = unpack("3d")
+    unpack("7d") # orbital parameters
+    pfd["dms"] = read_doubles(numdms)
+    pfd["periods"] = read_doubles(numperiods)
+    pfd["pdots"] = read_doubles(numpdots)
+    nprofs = pfd["npart"] * pfd["nsub"]
+    pfd["profs"] = read_doubles(nprofs * pfd["proflen"]).reshape(pfd["npart"], pfd["nsub"], pfd["proflen"])
+    pfd["stats"] = read_doubles(nprofs * 7).reshape(pfd["npart"], pfd["nsub"], 7)
+
+    # Derived values, as in prepfold.pfd
+    subdeltafreq = pfd["chan_wid"] * pfd["numchan"] / pfd["nsub"]
+    pfd["subfreqs"] = np.arange(pfd["nsub"]) * subdeltafreq + pfd["lofreq"] + subdeltafreq - pfd["chan_wid"]
+    # The Doppler corrected frequencies prepfold.pfd.plot_chi2_vs_DM() uses
+    pfd["barysubfreqs"] = pfd["subfreqs"] * (1. + pfd["avgvoverc"])
+    # fold_p1 is the folding frequency
+    fold_freq = pfd["fold_p1"] if pfd["fold_p1"] > 0 else 1. / pfd["bary_p1"]
+    pfd["binspersec"] = fold_freq * pfd["proflen"]
+    return pfd
+
+
+def _subband_shifts(pfd, dms, freqs=None):
+    """
+    Returns the integer bin shifts (ndms, nsub) that dedisperse the subbands to each DM, as prepfold.pfd.dedisperse().
+    freqs defaults to the subband frequencies
+    """
+    if freqs is None:
+        freqs = pfd["subfreqs"]
+    delays = np.atleast_1d(dms)[:, None] / (0.000241 * freqs[None, :] ** 2)
+    delays -= delays[:, -1:]
+    return np.floor(delays * pfd["binspersec"] + 0.5).astype(int) % pfd["proflen"]
+
+
+def dm_curve(pfd, dms=None):
+    """
+    Computes the reduced chi^2 of the summed profile against DM for all trial DMs at once, as
+    prepfold.pfd.plot_chi2_vs_DM() (without interpolation) does one DM at a time
+
+    Returns:
+    --------
+    dms: numpy.array
+        The trial DMs. Default: len(pfd['dms']) DMs spanning the DMs searched by prepfold, as PulsarFeatureLab uses
+    chis: numpy.array
+        The reduced chi^2 of the dedispersed profile at each DM
+    """
+    if dms is None:
+        dms = np.linspace(pfd["dms"][0], pfd["dms"][-1], len(pfd["dms"]))
+    dms = np.atleast_1d(dms)
+    nsub, proflen = pfd["nsub"], pfd["proflen"]
+    subprofs = pfd["profs"].sum(axis=0)
+    avg = pfd["profs"].sum() / proflen
+    var = pfd["stats"][:, :, 5].sum()
+    shifts = _subband_shifts(pfd, dms, freqs=pfd["barysubfreqs"])
+    idx = (np.arange(proflen)[None, None, :] + shifts[:, :, None]) % proflen
+    sumprofs = subprofs[np.arange(nsub)[None, :, None], idx].sum(axis=1)
+    # prepfold keeps the curve in single precision
+    chis = (((sumprofs - avg) ** 2 / var).sum(axis=1) / (proflen - 1.)).astype(np.float32)
+    return dms, chis
+
+
+def profile(pfd):
+    """
+    The integrated profile dedispersed to prepfold's best DM and scaled to the range [0, 1], as the
+    profile PulsarFeatureLab computes its features from
+    """
+    shifts = _subband_shifts(pfd, pfd["bestdm"])[0]
+    idx = (np.arange(pfd["proflen"])[None, :] + shifts[:, None]) % pfd["proflen"]
+    prof = pfd["profs"].sum(axis=0)[np.arange(pfd["nsub"])[:, None], idx].sum(axis=0)
+    prof = prof - prof.min()
+    peak = prof.max()
+    return prof / peak if peak > 0 else prof
+
+
+def moments(data):
+    """
+    The mean, standard deviation, excess kurtosis and skewness along the last axis, with the same (biased)
+    estimators as numpy.std() and scipy.stats.kurtosis()/skew() that PulsarFeatureLab uses
+    """
+    data = np.asarray(data, dtype=np.float64)
+    mean = data.mean(axis=-1)
+    dev = data - mean[..., None]
+    m2 = (dev ** 2).mean(axis=-1)
+    m3 = (dev ** 3).mean(axis=-1)
+    m4 = (dev ** 4).mean(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kurtosis = np.where(m2 > 0, m4 / m2 ** 2 - 3., -3.)
+        skewness = np.where(m2 > 0, m3 / m2 ** 1.5, 0.)
+    return mean, np.sqrt(m2), kurtosis, skewness
+
+
+def _cache_name(cache_dir, pfd_file):
+    return join(cache_dir, f"{basename(pfd_file)}.{getsize(pfd_file)}.{int(getmtime(pfd_file))}.t{FEATURE_TYPE}v{FEATURE_VERSION}.npy")
+
+
+def extract_features(pfd_files, cache_dir=None):
+    """
+    Computes the PulsarFeatureLab type 6 features of many pfds. The profile moments are computed for all
+    candidates with the same profile length at once
+
+    Parameters:
+    -----------
+    pfd_files: list
+        The pathnames of the .pfd files
+    cache_dir: string
+        If supplied, features are read from and saved to this directory so each pfd is only processed once. Default: None
+
+    Returns:
+    --------
+    features: numpy.array
+        (n_candidates, n_features) in the order of FEATURE_NAMES
+    """
+    features = np.zeros((len(pfd_files), len(FEATURE_NAMES)))
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    # Read everything not in the cache, keeping the DM curve features and grouping profiles by length
+    todo = []
+    profiles = {}
+    for i, pfd_file in enumerate(pfd_files):
+        if cache_dir and exists(_cache_name(cache_dir, pfd_file)):
+            features[i] = np.load(_cache_name(cache_dir, pfd_file))
+            continue
+        pfd = read_pfd(pfd_file)
+        _, chis = dm_curve(pfd)
+        features[i, 4:] = moments(chis)
+        prof = profile(pfd)
+        profiles.setdefault(len(prof), []).append((i, prof))
+        todo.append(i)
+    for group in profiles.values():
+        idx = [i for i, _ in group]
+        features[idx, :4] = np.stack(moments(np.stack([prof for _, prof in group])), axis=1)
+    if cache_dir:
+        for i in todo:
+            np.save(_cache_name(cache_dir, pfd_files[i]), features[i])
+    logger.debug(f"Features computed for {len(todo)}/{len(pfd_files)} pfds")
+    return features
+
+
+def write_arff(features, pfd_files, filename, meta=True):
+    """
+    Writes features in the .arff layout PulsarFeatureLab uses (with --arff and --meta) for the LOTAAS classifier.
+    The class of every candidate is unknown ('?') and the pfd pathname follows each row as a comment
+    """
+    lines = [f"@relation Pulsar_Feature_Data_Type_{FEATURE_TYPE}"]
+    for i in range(features.shape[1]):
+        lines.append(f"@attribute Feature_{i + 1} numeric")
+    lines.append("@attribute class {0,1}")
+    lines.append("@data")
+    for row, pfd_file in zip(features, pfd_files):
+        line = ",".join(str(float(value)) for value in row) + ",?"
+        if meta:
+            line += f"%{abspath(pfd_file)}"
+        lines.append(line)
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def features_main(pfd_dir, arff_name, cache_dir=None):
+    """Computes the features of every .pfd in pfd_dir and writes them to an .arff file"""
+    pfd_files = sorted(glob.glob(join(pfd_dir, "*.pfd")))
+    if not pfd_files:
+        raise FileNotFoundError(f"No pfds found in: {pfd_dir}")
+    features = extract_features(pfd_files, cache_dir=cache_dir)
+    write_arff(features, pfd_files, arff_name)
+    logger.info(f"Features of {len(pfd_files)} pfds written to: {arff_name}")
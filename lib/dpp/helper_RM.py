@@ -1,14 +1,14 @@
 import logging
-from os.path import join, basename
+from os.path import join, basename, exists
 
 from vcstools.job_submit import submit_slurm
-from rm_synthesis import rm_synth_pipe
+from dpp.rmsynth import rm_synth_coarse_fine
 
 logger = logging.getLogger(__name__)
 
 
-def RM_synth(cfg):
-    # Get some basic things in order
+def _phase_range(cfg):
+    """The phase range of the component used for RM synthesis, widened if it is too narrow"""
     my_comp = cfg["source"]["my_component"]
     comp_min = cfg["source"]["gfit"]["comp_idx"][my_comp][0]
     comp_max = cfg["source"]["gfit"]["comp_idx"][my_comp][-1]
@@ -19,6 +19,36 @@ def RM_synth(cfg):
         comp_max += (7-comp_range)/2
     phase_min = comp_min/prof_len
     phase_max = comp_max/prof_len
+    return phase_min, phase_max
+
+
+def RM_synth(cfg):
+    """Finds the RM with vcstools' rm_synth_pipe, or with dpp.rmsynth if the cfg asks for the native engine"""
+    if cfg["run_ops"].get("native_rm"):
+        RM_synth_native(cfg)
+    else:
+        RM_synth_pipe(cfg)
+
+
+def RM_synth_native(cfg):
+    """
+    Finds the RM with a coarse then fine RM synthesis, reading the archive once.
+    Opt-in (--native_rm) until it is shown to match RM_synth_pipe() on real archives (tests/test_rmsynth.py)
+    """
+    # The PSRFITS conversion holds the same data and can be read without psrchive
+    archive = cfg["files"]["converted_fits"] if exists(cfg["files"]["converted_fits"]) else cfg["files"]["archive"]
+    result = rm_synth_coarse_fine(archive, _phase_range(cfg), coarse_range=(-300, 300), fine_width=10,
+                                  phi_steps=10000, plot_name=join(cfg["files"]["psr_dir"], f"{cfg['files']['file_precursor']}_RMsynth_final.png"),
+                                  period=cfg["source"]["my_P"])
+    cfg["pol"]["RM"] = result["rm"]
+    cfg["pol"]["RM_e"] = result["rm_e"]
+    logger.info(f"Calculated RM through synthesis: {result['rm']} +/- {result['rm_e']}")
+
+
+def RM_synth_pipe(cfg):
+    """Finds the RM using vcstools' rm_synth_pipe, with a coarse then a fine synthesis"""
+    from rm_synthesis import rm_synth_pipe
+    phase_min, phase_max = _phase_range(cfg)
     # RM synthesis - Initial
     rms_kwargs = {}
     # Fill out the useless stuff
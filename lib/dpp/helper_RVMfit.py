@@ -1,44 +1,88 @@
 import logging
 import numpy as np
-from os.path import basename
+from os.path import basename, splitext, join
 
 from vcstools.job_submit import submit_slurm
+from dpp.rvmfit import rvm_fit, write_rvm_fit
 
 logger = logging.getLogger(__name__)
 
+# The alpha/beta grid sizes of the initial and final fits, and the l0 range (deg) of the final fit
+INITIAL_TRIALS = 200
+FINAL_TRIALS = 400
+FINAL_L0_WIDTH = 20
+# Used to size the ppp jobs that fit the RVM in the pipeline. About 1e7 grid elements are evaluated per second
+# per cpu, so this leaves a margin for slower nodes. The memory of each grid process is bounded by rvmfit.GRID_BLOCK
+RVM_CPUS = 8
+RVM_EVALS_PER_CPU_SECOND = 5e6
+RVM_MB_PER_CPU = 512
+
+
+def _component_range(cfg):
+    """The longitude range (deg) of the component used for the RVM fit"""
+    my_comp = cfg["source"]["my_component"]
+    component_min = cfg["source"]["gfit"]["comp_idx"][my_comp][0] * 360/len(cfg["source"]["gfit"]["profile"])
+    component_max = cfg["source"]["gfit"]["comp_idx"][my_comp][-1] * 360/len(cfg["source"]["gfit"]["profile"])
+    return component_min, component_max
+
+
+def rvm_job_resources(cfg):
+    """
+    The slurm time, memory and cpus of the ppp job that does the next RVM fit, sized for its grid if the cfg asks for
+    the fit to be done in the pipeline. Otherwise returns an empty dictionary, leaving relaunch_ppp()'s defaults
+    """
+    if not cfg["run_ops"].get("native_rvm") or cfg["completed"]["RVM_final"]:
+        return {}
+    if not cfg["completed"]["RVM_initial"]:
+        component_min, component_max = _component_range(cfg)
+        trials, l0_width = INITIAL_TRIALS, component_max - component_min
+    else:
+        trials, l0_width = FINAL_TRIALS, FINAL_L0_WIDTH
+    # The number of profile bins is an upper limit on the number of PA points. The l0 step is 1 deg
+    evaluations = trials ** 2 * (int(l0_width) + 1) * len(cfg["source"]["gfit"]["profile"])
+    seconds = 1800 + evaluations / (RVM_EVALS_PER_CPU_SECOND * RVM_CPUS)
+    hours, minutes = divmod(int(np.ceil(seconds / 60)), 60)
+    return {"time": f"{hours:02d}:{minutes:02d}:00", "mem": 8192 + RVM_CPUS * RVM_MB_PER_CPU, "cpu_threads": RVM_CPUS}
+
 
 def RVM_fit(cfg, depends_on=None, depend_type="afterany"):
-    """Calculates parameters for a PSRSALSA ppolFit job and submits it"""
+    """
+    Calculates the parameters of an RVM fit and submits a PSRSALSA ppolFit job or, if the cfg asks for it
+    (--native_rvm), fits it here. Returns the job ID, or None if the fit was done here
+    """
     alpha = cfg["pol"]["alpha"]
     beta = cfg["pol"]["beta"]
     if not cfg["completed"]["RVM_initial"] and not cfg["completed"]["RVM_final"]: # Initial
-        trials = 200
+        trials = INITIAL_TRIALS
         alpha_range = np.array((0, 180))
         beta_range = np.array((-30, 30))
         #Decide the longitude range to fit
-        my_comp = cfg["source"]["my_component"]
-        component_min = cfg["source"]["gfit"]["comp_idx"][my_comp][0] * 360/len(cfg["source"]["gfit"]["profile"])
-        component_max = cfg["source"]["gfit"]["comp_idx"][my_comp][-1] * 360/len(cfg["source"]["gfit"]["profile"])
+        component_min, component_max = _component_range(cfg)
         l_cmd = f" -l '{component_min} 1'"
         maxdl_cmd = f" -maxdl {component_max - component_min}"
+        l0_range = (component_min, component_max)
         chigrid_file = basename(cfg['files']['chigrid_initial_ps']) # Can't have names greater than 100 characters - use basenames instead
         paswing_file = basename(cfg['files']['paswing_initial_ps'])
         outfile = cfg['files']['RVM_fit_initial']
         name = f"RVM_fit_initial_{cfg['files']['file_precursor']}"
         cfg["completed"]["RVM_initial"] = True
     else: # Final
-        trials = 400
+        trials = FINAL_TRIALS
         alpha_range = np.array((alpha - 20, alpha + 20))
         beta_range = np.array((beta - 10, beta + 10))
-        alpha_range.clip(0, 180)
-        beta_range.clip(-30, 30) # forcing the range to reasonable values
-        l_cmd = f" -l '{cfg['pol']['l0'] - 10} 1'"
-        maxdl_cmd = " -maxdl 20"
+        alpha_range = alpha_range.clip(0, 180)
+        beta_range = beta_range.clip(-30, 30) # forcing the range to reasonable values
+        l_cmd = f" -l '{cfg['pol']['l0'] - FINAL_L0_WIDTH/2} 1'"
+        maxdl_cmd = f" -maxdl {FINAL_L0_WIDTH}"
+        l0_range = (cfg['pol']['l0'] - FINAL_L0_WIDTH/2, cfg['pol']['l0'] + FINAL_L0_WIDTH/2)
         chigrid_file = basename(cfg['files']['chigrid_final_ps'])
         paswing_file = basename(cfg['files']['paswing_final_ps'])
         outfile = cfg['files']['RVM_fit_final']
         name = f"RVM_fit_final_{cfg['files']['file_precursor']}"
         cfg["completed"]["RVM_final"] = True
+    if cfg["run_ops"].get("native_rvm"):
+        RVM_fit_native(cfg, outfile, alpha_range, beta_range, l0_range, trials, chigrid_file)
+        return None
     # Create the job commands
     commands = [f"cd {cfg['files']['psr_dir']}"]
     ppol_cmd = "ppolFit -showwedge"
@@ -68,6 +112,22 @@ def RVM_fit(cfg, depends_on=None, depend_type="afterany"):
     return jid
 
 
+def RVM_fit_native(cfg, outfile, alpha_range, beta_range, l0_range, trials, chigrid_file):
+    """
+    Fits the RVM to the paswing file without a job and writes the result where ppolFit would have.
+    Opt-in (--native_rvm) until it is shown to match ppolFit on real profiles (tests/test_rvmfit.py)
+    """
+    fit = rvm_fit(cfg["files"]["paswing"], alpha_range=alpha_range, beta_range=beta_range, l0_range=l0_range, trials=trials)
+    write_rvm_fit(fit, outfile)
+    logger.info(f"RVM fit: alpha={fit['alpha']} beta={fit['beta']} l0={fit['l0']} pa0={fit['pa0']} chi^2={fit['chi']}")
+    try:
+        from dpp.plotting_toolkit import plot_rvm_chi_map
+        plot_rvm_chi_map(fit["chi_map"], fit["alphas"], fit["betas"], name=join(cfg["files"]["psr_dir"], f"{splitext(chigrid_file)[0]}.png"),
+                         my_chi=fit["chi"], my_alpha=fit["alpha"], my_beta=fit["beta"])
+    except ImportError as e:
+        logger.warning(f"Unable to plot the RVM chi map: {e}")
+
+
 def RVM_file_to_cfg(cfg):
     if cfg["completed"]["RVM_final"]:
         RVM_file = cfg['files']['RVM_fit_final']
@@ -1,23 +1,32 @@
 import logging
 import sys
-from os.path import join
+import hashlib
+from os.path import join, getmtime, splitext
 from glob import glob
 
 from vcstools.prof_utils import auto_gfit, subprocess_pdv, get_from_ascii, ProfileLengthError, NoFitError
 from vcstools.job_submit import submit_slurm
 from vcstools.config import load_config_file
 from dpp.helper_bestprof import bestprof_fit
+from dpp.psrfits import is_psrfits, read_psrfits_profiles
 
 comp_config = load_config_file()
 logger = logging.getLogger(__name__)
+DSPSR_MEMORY = 4000 # The memory (MB) each dspsr process may use
+VDIF_FOLD_ATTEMPTS = 3 # The number of times each VDIF part is folded before giving up on it
 
 
 def archive_fit(cfg, archive_path, cliptype="verbose"):
     """Fits a profile to the supplied archive and adds it to cfg. Cliptype options found in prof_utils.py"""
     gfit_kwargs = {"cliptype":cliptype, "period":cfg["source"]["my_P"], "plot_name":cfg["files"]["gfit_plot"]}
-    # Get the profile
-    subprocess_pdv(archive_path, outfile=cfg["files"]["archive_ascii"])
-    profile, _ = get_from_ascii(cfg["files"]["archive_ascii"])
+    # Get the profile. Read the archive directly if it is PSRFITS, or its PSRFITS conversion if that is at least as new
+    # as the archive. Otherwise go through pdv
+    fits_path = archive_path if is_psrfits(archive_path) else converted_fits_path(archive_path)
+    if is_psrfits(fits_path) and (fits_path == archive_path or getmtime(fits_path) >= getmtime(archive_path)):
+        profile = list(read_psrfits_profiles(fits_path, period=cfg["source"]["my_P"])[0])
+    else:
+        subprocess_pdv(archive_path, outfile=cfg["files"]["archive_ascii"])
+        profile, _ = get_from_ascii(cfg["files"]["archive_ascii"])
     # Gaussian fit
     fit = auto_gfit(profile, **gfit_kwargs)
     # Find the longest component
@@ -31,8 +40,20 @@ def archive_fit(cfg, archive_path, cliptype="verbose"):
     cfg["source"]["gfit"] = fit
 
 
-def fits_to_archive(fits_dir, ar_name, bins, dm, period, out_dir, memory=4000, total=1.0, seek=0, vdif=False, container="/pawsey/mwa/singularity/dspsr/dspsr.sif"):
-    """Returns bash commands to fold on a fits file using dspsr"""
+def fold_key(bins, dm, period, seek, total):
+    """A short hash of the fold parameters, used to name the VDIF parts of a fold"""
+    return hashlib.md5(f"{bins} {dm} {period} {seek} {total}".encode("utf-8")).hexdigest()[:8]
+
+
+def fits_to_archive(fits_dir, ar_name, bins, dm, period, out_dir, memory=4000, total=1.0, seek=0, vdif=False, n_procs=1,
+                    container="/pawsey/mwa/singularity/dspsr/dspsr.sif"):
+    """
+    Returns bash commands to fold on a fits file using dspsr.
+    VDIF files are folded in parallel by up to n_procs dspsr processes, each part up to VDIF_FOLD_ATTEMPTS times.
+    Each part leaves a .done marker when it finishes so a rerun only refolds the parts that failed, and the parts are
+    only merged once all have finished. The parts and markers are named after the fold parameters, so a rerun with
+    different parameters never reuses them
+    """
     # Normally I'd just use absolute filepaths but psrchive runs into issues if the filename 
     # is too long. So instead we cd into the fits dir and process there, then move everything
     # back to the out_dir
@@ -47,12 +68,27 @@ def fits_to_archive(fits_dir, ar_name, bins, dm, period, out_dir, memory=4000, t
     dspsr_cmd += f" -T {total}"
     dspsr_cmd += f" -L {total}" # Timescrunch the whole obs
     if vdif: # TODO: fix this because it can't deal with long filenames
+        parts = f"ipfb_{fold_key(bins, dm, period, seek, total)}"
+        # Parts are numbered in the order of the .hdr files, as they were when folded serially
         commands.append("j=0")
         commands.append(f"for i in *.hdr;")
-        commands.append(f"   do {dspsr_cmd} -O ipfb_$j $i ;")
+        commands.append("do")
+        commands.append(f"   if [ ! -f {parts}_$j.done ]; then")
+        commands.append(f"      ( for attempt in $(seq {VDIF_FOLD_ATTEMPTS}); do")
+        commands.append(f"           {dspsr_cmd} -O {parts}_$j $i && touch {parts}_$j.done && break")
+        commands.append("           echo \"Folding VDIF part $j ($i) failed on attempt $attempt\"")
+        commands.append("        done ) &")
+        commands.append(f"      while [ $(jobs -rp | wc -l) -ge {n_procs} ]; do wait -n; done")
+        commands.append("   fi")
         commands.append("   j=$((j+1))")
         commands.append("done;")
-        commands.append(f"{container_launch} psradd -R -m time ipfb*.ar -o {ar_name}.ar")
+        commands.append("wait")
+        commands.append(f"n_done=$(ls {parts}_*.done 2>/dev/null | wc -l)")
+        commands.append("if [ $n_done -ne $j ]; then")
+        commands.append("   echo \"Only $n_done of $j VDIF parts were folded. Rerun to refold the others\"")
+        commands.append("   exit 1")
+        commands.append("fi")
+        commands.append(f"{container_launch} psradd -R -m time {parts}_*.ar -o {ar_name}.ar && rm {parts}_*.done {parts}_*.ar")
     else:
         dspsr_cmd += f" -O {ar_name}"
         dspsr_cmd += f" *.fits"
@@ -63,6 +99,11 @@ def fits_to_archive(fits_dir, ar_name, bins, dm, period, out_dir, memory=4000, t
     return commands
 
 
+def converted_fits_path(ar_file, extension="fits"):
+    """Returns the pathname of the PSRFITS file that archive_to_fits() makes from an archive"""
+    return f"{splitext(ar_file)[0]}.{extension}"
+
+
 def archive_to_fits(ar_file, extension="fits", container="/pawsey/mwa/singularity/dspsr/dspsr.sif"):
     """Returns bash commands to turn an arhive file to a fits file"""
     container_launch = f"singularity exec -e {container}"
@@ -100,18 +141,20 @@ def ppp_archive_creation(cfg, depends_on=None, depend_type="afterany"):
     # Add folds to commands
     psrchive_container = comp_config['prschive_container']
     archive_base = cfg["files"]["archive"].split(".ar")[0] # Archive without .ar extension
-    commands.append(fits_to_archive(fits_dir, archive_base, bins, dm, period, cfg["files"]["psr_dir"],
-                    total=total, seek=seek, vdif=cfg["run_ops"]["vdif"], container=psrchive_container))
+    mem=32768
+    # Fold as many VDIF files at once as the job's memory allows
+    n_procs = max(1, min(len(glob(vdif_hdrs)), mem // DSPSR_MEMORY)) if cfg["run_ops"]["vdif"] else 1
+    commands.append(fits_to_archive(fits_dir, archive_base, bins, dm, period, cfg["files"]["psr_dir"], memory=DSPSR_MEMORY,
+                    total=total, seek=seek, vdif=cfg["run_ops"]["vdif"], n_procs=n_procs, container=psrchive_container))
     # Add ar -> fits conversion to commands
     commands.append(archive_to_fits(cfg["files"]["archive"], container=psrchive_container))
     #Submit_job
     name = f"to_archive_{cfg['source']['name']}_{cfg['obs']['id']}"
     slurm_kwargs = {"time":"08:00:00"} # dspsr folding can take some time
     modules = ["singularity"]
-    mem=32768
     jid = submit_slurm(name, commands,
         slurm_kwargs=slurm_kwargs, module_list=modules, mem=mem, batch_dir=cfg["files"]["batch_dir"], depend=depends_on,
-        depend_type=depend_type, vcstools_version=cfg["run_ops"]["vcstools"], submit=True)
+        depend_type=depend_type, vcstools_version=cfg["run_ops"]["vcstools"], cpu_threads=n_procs, submit=True)
     logger.info(f"Submitted archive/fits creation job: {name}")
     logger.info(f"job ID: {jid}")
     if depends_on:
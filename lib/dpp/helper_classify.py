@@ -1,10 +1,10 @@
 import logging
-from os.path import join, exists
 
 from vcstools.job_submit import submit_slurm
 from dpp.helper_files import setup_classify
 from dpp.helper_relaunch import relaunch_ppp
 from dpp.helper_config import dump_to_yaml
+from mwa_search.classifier_tools import find_classifier_files, aggregate_votes, pointing_votes
 
 
 logger = logging.getLogger(__name__)
@@ -26,16 +26,8 @@ def add_classify_to_commands(cfg, container="/pawsey/mwa/singularity/lofar_pulsa
     # Run the feature extractor
     cmds.append("REALPATH=`realpath feature_extraction.arff`")
     cmds.append(f"{container_launch} python /usr/local/bin/PulsarFeatureLab.py -d `pwd` -f feature_extraction.arff -t 6 -c 3 --meta --arff")
-    #Run the features through the 5 models
-    cmds.append("for i in {1..5}; do")
-    cmds.append(f"   {container_launch} java -jar /usr/local/bin/LOTAASClassifier.jar -m /home/soft/models/V1.3.1model${{i}}.model -p ${{REALPATH}} -a 1 -d") # ${LOTAAS_MLC_MODEL_DIR}
-    cmds.append("   if [ -f '\${REALPATH%arff}positive' ]; then")
-    cmds.append("       mv \${REALPATH%arff}positive feature_extraction_m${i}.positive")
-    cmds.append("   fi")
-    cmds.append("   if [ -f '\${REALPATH%arff}negative' ]; then")
-    cmds.append("       mv \${REALPATH%arff}negative feature_extraction_m${i}.negative")
-    cmds.append("   fi")
-    cmds.append("done")
+    #Run the features through the 5 models in a single JVM
+    cmds.append(f"lotaas_classify.py -p ${{REALPATH}} --model_dir /home/soft/models --launch '{container_launch}'") # ${LOTAAS_MLC_MODEL_DIR}
     return cmds
 
 
@@ -46,7 +38,7 @@ def submit_classify(cfg):
     # Work out some things for the job
     name = f"{cfg['files']['file_precursor']}_classify"
     slurm_kwargs = {"time":"00:30:00"}
-    modules = ["singularity"]
+    modules = ["singularity", f"mwa_search/{cfg['run_ops']['mwa_search']}"]
     mem = 8192
     # Submit Job
     jid = submit_slurm(name, cmds,
@@ -58,19 +50,14 @@ def submit_classify(cfg):
 
 def read_classifications(cfg):
     """Reads the output of the classifier and updates cfg with the information"""
-    negfile = join(cfg["files"]["classify_dir"], "feature_extraction.negative")
-    posfile = join(cfg["files"]["classify_dir"], "feature_extraction.positive")
-    try:
-        with open(posfile, "r") as f:
-            pos = f.readlines()
-    except FileNotFoundError as e:
-        if not exists(negfile): # A least one of the pos and neg files should exist
-                raise FileNotFoundError(f"Classifier outputs not found in dir: {cfg['files']['classify_dir']}")
-        else:
-            pos = []
+    classifier_files = find_classifier_files(cfg["files"]["classify_dir"])
+    if not classifier_files: # A least one of the pos and neg files should exist
+        raise FileNotFoundError(f"Classifier outputs not found in dir: {cfg['files']['classify_dir']}")
+    _, votes = aggregate_votes(classifier_files)
+    counts = pointing_votes(votes)
     for pointing in cfg["folds"].keys():
         # Count positive model classifications
-        cfg["folds"][pointing]["classifier"] = sum(pointing in s for s in pos)
+        cfg["folds"][pointing]["classifier"] = counts.get(pointing, 0)
         logger.debug(f"{pointing} Positive models found: {cfg['folds'][pointing]['classifier']}")
 
 
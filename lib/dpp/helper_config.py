@@ -1,12 +1,13 @@
-import psrqpy
 import logging
 from os.path import join
 import yaml
-import subprocess
+from multiprocessing import get_context
 
 from dpp.helper_source_info import bin_sampling_limit, is_binary, required_bin_folds
 from dpp.helper_obs_info import find_fold_times
 from dpp.helper_files import file_precursor
+from dpp.helper_state_db import state_db_path, record_cfg
+from dpp.helper_ephemeris import get_ephemeris, get_ephemerides, edit_eph
 from vcstools.metadb_utils import get_common_obs_metadata
 from vcstools.progress_bar import progress_bar
 from vcstools import data_load
@@ -16,14 +17,20 @@ from vcstools.config import load_config_file
 comp_config = load_config_file()
 logger = logging.getLogger(__name__)
 
+# Objects shared with the worker processes of create_cfgs_main. They are set before the pool
+# is forked so the ATNF query and metadata are inherited by the workers instead of pickled
+_shared = {}
 
-def initiate_cfg(kwargs, psr, pointings, enter, leave, power, query=None, metadata=None):
+
+def initiate_cfg(kwargs, psr, pointings, enter, leave, power, query=None, metadata=None, edited_eph=None):
     """
     Adds all available keys to the cfg dictionary and figures out some useful constants
     Takes kwargs from observation_processing_pipeline
+    If the pulsar is a binary and edited_eph is None, will call psrcat to make the edited ephemeris
     """
     cfg = {"obs": {}, "source": {}, "completed": {}, "folds": {}, "run_ops": {}, "pol": {}, "files":{}}
     if query is None:
+        import psrqpy # Slow to import and only needed without a query
         query = psrqpy.QueryATNF(loadfromdb=data_load.ATNF_LOC).pandas
     if metadata is None:
         metadata = get_common_obs_metadata(kwargs["obsid"])
@@ -49,6 +56,9 @@ def initiate_cfg(kwargs, psr, pointings, enter, leave, power, query=None, metada
     cfg["run_ops"]["good_sn"] = 20.0
     cfg["run_ops"]["vdif"] = None
     cfg["run_ops"]["mask"] = None
+    cfg["run_ops"]["state_db"] = state_db_path(kwargs["obsid"]) if kwargs.get("state_db") else None
+    cfg["run_ops"]["native_rvm"] = bool(kwargs.get("native_rvm"))
+    cfg["run_ops"]["native_rm"] = bool(kwargs.get("native_rm"))
 
     cfg["files"]["file_precursor"] = file_precursor(kwargs, psr)
     cfg["files"]["psr_dir"] = join(comp_config["base_data_dir"], str(cfg["obs"]["id"]), "dpp", cfg["files"]["file_precursor"])
@@ -100,7 +110,9 @@ def initiate_cfg(kwargs, psr, pointings, enter, leave, power, query=None, metada
     cfg["source"]["total"] = (cfg["source"]["exit_frac"] - cfg["source"]["enter_frac"]) * (cfg["obs"]["end"] - cfg["obs"]["beg"])
     if cfg["source"]["binary"]:
         cfg["source"]["edited_eph_name"] = join(cfg["files"]["psr_dir"], f"{cfg['files']['file_precursor']}.eph")
-        cfg["source"]["edited_eph"] = create_edited_eph(cfg["source"]["name"])
+        if edited_eph is None:
+            edited_eph = create_edited_eph(cfg["source"]["name"])
+        cfg["source"]["edited_eph"] = edited_eph
     else:
         cfg["source"]["edited_eph"] = None
         cfg["source"]["edited_eph_name"] = None
@@ -136,10 +148,15 @@ def initiate_cfg(kwargs, psr, pointings, enter, leave, power, query=None, metada
 
 def create_edited_eph(pulsar_name):
     """Created a string version of 'psrcat -e2' and removes the last line"""
-    eph = subprocess.check_output(["psrcat", "-e2", pulsar_name])
-    eph = eph.decode("utf-8")
-    eph = "\n".join(tuple(eph.split("\n")[:-2]))
-    return eph
+    return edit_eph(get_ephemeris(pulsar_name))
+
+
+def create_edited_ephs(pulsar_names):
+    """
+    Gets the 'psrcat -e2' ephemerides of all of the supplied pulsars with at most one psrcat call.
+    Returns a dictionary of pulsar name: edited ephemeris, each identical to create_edited_eph()
+    """
+    return {pulsar: edit_eph(eph) for pulsar, eph in get_ephemerides(pulsar_names).items()}
 
 
 def reset_cfg(cfg):
@@ -163,28 +180,50 @@ def from_yaml(filepath):
 def dump_to_yaml(cfg):
     with open(cfg["files"]["my_name"], 'w') as f:
         yaml.dump(cfg, f, default_flow_style=False)
+    # Keep the state database in step with the yaml
+    record_cfg(cfg)
     return cfg["files"]["my_name"]
 
 
+def _initiate_cfg_worker(psr):
+    """Initiates a single pulsar's cfg using the objects in _shared. Returns None if the pulsar isn't in the beam"""
+    fold_times = _shared["fold_times_dict"][psr]
+    try:
+        return initiate_cfg(_shared["kwargs"], psr, _shared["psrs_pointing_dict"][psr], fold_times["enter"], fold_times["leave"],
+                            fold_times["power"], query=_shared["query"], metadata=_shared["metadata"], edited_eph=_shared["ephs"].get(psr))
+    except TypeError as e:
+        logger.info(e)
+        return None
+
+
 def create_cfgs_main(kwargs, psrs_pointing_dict):
     """
     uses kwargs from observation_processing_pipeline.py
+    If kwargs["n_procs"] is greater than 1, the cfgs are initiated by a pool of that many forked processes
     """
+    import psrqpy
     metadata, full_meta = get_common_obs_metadata(kwargs["obsid"], return_all=True)
     query = psrqpy.QueryATNF(loadfromdb=data_load.ATNF_LOC).pandas
-    cfgs = []
     # Make the fold times dictionary (it's done for all pulsars simultaneously for speed)
     psr_list = list(psrs_pointing_dict.keys())
     fold_times_dict = find_fold_times(psr_list, kwargs["obsid"], kwargs["beg"], kwargs["end"], metadata=metadata, full_meta=full_meta, query=query)
-    for psr in progress_bar(psr_list, "Initiating pulsar configs: "):
-        logger.info(psr)
-        pointing_list = psrs_pointing_dict[psr]
-        enter = fold_times_dict[psr]["enter"]
-        leave = fold_times_dict[psr]["leave"]
-        power = fold_times_dict[psr]["power"]
-        try:
-            cfgs.append(initiate_cfg(kwargs, psr, pointing_list, enter, leave, power, query=query, metadata=metadata))
-        except TypeError as e:
-            logger.info(e)
-            continue
-    return cfgs
+    # Get the ephemerides of all binaries with one psrcat call
+    binaries = [psr for psr in psr_list if is_binary(psr, query=query)]
+    ephs = create_edited_ephs(binaries)
+
+    _shared.update({"kwargs": kwargs, "psrs_pointing_dict": psrs_pointing_dict, "fold_times_dict": fold_times_dict,
+                    "query": query, "metadata": metadata, "ephs": ephs})
+    n_procs = kwargs.get("n_procs", 1)
+    try:
+        if n_procs > 1:
+            logger.info(f"Initiating pulsar configs with {n_procs} processes")
+            with get_context("fork").Pool(n_procs) as pool:
+                cfgs = pool.map(_initiate_cfg_worker, psr_list)
+        else:
+            cfgs = []
+            for psr in progress_bar(psr_list, "Initiating pulsar configs: "):
+                logger.info(psr)
+                cfgs.append(_initiate_cfg_worker(psr))
+    finally:
+        _shared.clear()
+    return [cfg for cfg in cfgs if cfg is not None]
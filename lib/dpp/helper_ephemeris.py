@@ -0,0 +1,168 @@
+import os
+import logging
+import hashlib
+import subprocess
+from functools import lru_cache
+from os.path import join, exists, expanduser, getmtime
+
+logger = logging.getLogger(__name__)
+
+# Can be overridden to point at a different psrcat executable (e.g. a fake one for testing)
+PSRCAT = os.environ.get("DPP_PSRCAT", "psrcat")
+EPH_CACHE_DIR = os.environ.get("DPP_EPH_CACHE", join(expanduser("~"), ".cache", "dpp", "ephemerides"))
+
+
+@lru_cache(maxsize=8)
+def _catalogue_version(psrcat, cat_file, cat_mtime):
+    """Does the work of catalogue_version(). The catalogue file and its modification time are part of the key"""
+    output = subprocess.check_output([psrcat, "-v"]).decode("utf-8")
+    version = None
+    for line in output.split("\n"):
+        if "version" in line.lower() and "catalogue" in line.lower():
+            version = line.split("=")[-1].split(":")[-1].strip()
+            break
+    if not version:
+        version = hashlib.md5(output.encode("utf-8")).hexdigest()[:12]
+    if cat_file:
+        cat_hash = hashlib.md5(f"{cat_file}{cat_mtime}".encode("utf-8")).hexdigest()[:8]
+        version = f"{version}_{cat_hash}"
+    return version.replace(os.sep, "_").replace(" ", "_")
+
+
+def catalogue_version(psrcat=PSRCAT):
+    """
+    Returns a string identifying the catalogue psrcat is reading. This is the catalogue version number
+    reported by 'psrcat -v' plus, if $PSRCAT_FILE is set, a hash of its path and modification time.
+    'psrcat -v' is only run once per process for each psrcat and catalogue file
+    """
+    cat_file = os.environ.get("PSRCAT_FILE")
+    if cat_file and exists(cat_file):
+        return _catalogue_version(psrcat, cat_file, getmtime(cat_file))
+    return _catalogue_version(psrcat, None, None)
+
+
+def split_psrcat_output(output, pulsar_names):
+    """
+    Splits the output of a multi-pulsar 'psrcat -e' or 'psrcat -e2' call.
+    psrcat ends each pulsar's ephemeris with a line beginning with '@'. Each ephemeris starts at its PSRJ or PSRB
+    line, so anything before that (e.g. the warning for a pulsar that isn't in the catalogue) is left out
+
+    Returns:
+    --------
+    ephs: dictionary
+        pulsar name: the text psrcat returns when called on that pulsar alone
+    """
+    ephs = {}
+    block = []
+    for line in output.split("\n"):
+        if line.startswith("@"):
+            starts = [i for i, name_line in enumerate(block) if name_line.split()[:1] in (["PSRJ"], ["PSRB"])]
+            if starts:
+                block = block[starts[0]:]
+            for name_line in block:
+                words = name_line.split()
+                if len(words) > 1 and words[0] in ("PSRJ", "PSRB") and words[1] in pulsar_names:
+                    ephs[words[1]] = "\n".join(block + [line, ""])
+            block = []
+        else:
+            block.append(line)
+    return ephs
+
+
+def _cache_path(cache_dir, version, eph_type, pulsar):
+    return join(cache_dir, version, eph_type.lstrip("-"), f"{pulsar}.eph")
+
+
+def _write_cache(path, eph):
+    """Writes to a temporary file first so that concurrent jobs never read a partial ephemeris"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(eph)
+    os.replace(tmp_path, path)
+
+
+def get_ephemerides(pulsar_names, eph_type="-e2", psrcat=PSRCAT, cache_dir=EPH_CACHE_DIR, use_cache=True):
+    """
+    Gets the psrcat ephemerides of many pulsars, calling psrcat once for every pulsar not already in the cache
+
+    Parameters:
+    -----------
+    pulsar_names: list
+        The J or B names of the pulsars
+    eph_type: string
+        The psrcat ephemeris option. '-e' or '-e2'. Default: '-e2'
+    psrcat: string
+        The psrcat executable. Default: $DPP_PSRCAT or 'psrcat'
+    cache_dir: string
+        The directory of the on-disk cache. Default: $DPP_EPH_CACHE or ~/.cache/dpp/ephemerides
+    use_cache: boolean
+        Whether to read and write the cache. Default: True
+
+    Returns:
+    --------
+    ephs: dictionary
+        pulsar name: the text output of 'psrcat <eph_type> <pulsar name>'
+    """
+    pulsar_names = list(dict.fromkeys(pulsar_names))
+    if not pulsar_names:
+        return {}
+    ephs = {}
+    version = None
+    if use_cache:
+        version = catalogue_version(psrcat=psrcat)
+        for pulsar in pulsar_names:
+            path = _cache_path(cache_dir, version, eph_type, pulsar)
+            if exists(path):
+                with open(path, "r") as f:
+                    ephs[pulsar] = f.read()
+        logger.debug(f"{len(ephs)}/{len(pulsar_names)} ephemerides found in cache for catalogue version {version}")
+
+    missing = [pulsar for pulsar in pulsar_names if pulsar not in ephs]
+    if missing:
+        output = subprocess.check_output([psrcat, eph_type, *missing]).decode("utf-8")
+        new_ephs = split_psrcat_output(output, missing)
+        if use_cache:
+            for pulsar, eph in new_ephs.items():
+                _write_cache(_cache_path(cache_dir, version, eph_type, pulsar), eph)
+        # Anything psrcat didn't give a recognisable block for (e.g. not in the catalogue) is fetched alone
+        # and not cached so that the text is exactly what it has always been
+        for pulsar in missing:
+            if pulsar not in new_ephs:
+                logger.debug(f"{pulsar} not found in batched psrcat output. Calling psrcat for it alone")
+                new_ephs[pulsar] = subprocess.check_output([psrcat, eph_type, pulsar]).decode("utf-8")
+        ephs.update(new_ephs)
+    return {pulsar: ephs[pulsar] for pulsar in pulsar_names}
+
+
+def get_ephemeris(pulsar_name, **kwargs):
+    """Returns the text output of 'psrcat -e2 <pulsar_name>'. kwargs are passed to get_ephemerides()"""
+    return get_ephemerides([pulsar_name], **kwargs)[pulsar_name]
+
+
+def edit_eph(eph):
+    """Removes the final separator line from psrcat ephemeris text"""
+    return "\n".join(tuple(eph.split("\n")[:-2]))
+
+
+def write_ephemerides(pulsar_names, out_dir=".", exclude=None, **kwargs):
+    """
+    Writes <pulsar>.eph files for many pulsars with a single psrcat call.
+    Lines containing any of the strings in exclude are removed (e.g. ['TCB'] like 'psrcat -e | grep -v TCB')
+    kwargs are passed to get_ephemerides()
+
+    Returns:
+    --------
+    eph_files: list
+        The pathnames of the written files
+    """
+    ephs = get_ephemerides(pulsar_names, **kwargs)
+    eph_files = []
+    for pulsar, eph in ephs.items():
+        if exclude:
+            eph = "".join(line for line in eph.splitlines(keepends=True) if not any(ex in line for ex in exclude))
+        eph_file = join(out_dir, f"{pulsar}.eph")
+        with open(eph_file, "w") as f:
+            f.write(eph)
+        eph_files.append(eph_file)
+    return eph_files
@@ -1,11 +1,14 @@
 import logging
-from os import symlink, rmdir, unlink, getcwd, chdir, remove
-from os.path import exists, join, basename
+from os import symlink, rmdir, unlink, remove, link, scandir
+from os.path import exists, lexists, join
+from errno import EXDEV
 from shutil import copyfile
 from glob import glob
+from fnmatch import fnmatch
 
 from vcstools.config import load_config_file
 from vcstools.general_utils import mdir
+from dpp.helper_state_db import state_db_path, find_config_files_db
 
 comp_config = load_config_file()
 logger = logging.getLogger(__name__)
@@ -53,6 +56,8 @@ def remove_old_results(cfg):
         remove(f)
     for pointing in cfg["folds"].keys(): # Remove every 'thing'
         stuff = glob(join(cfg["files"]["psr_dir"], f"*{cfg['files']['file_precursor']}*.pfd*"))
+        # The VDIF parts of unfinished archive folds and their .done markers
+        stuff += glob(join(cfg["files"]["psr_dir"], pointing, "ipfb_*"))
         for thing in stuff:
             remove(thing)
 
@@ -68,27 +73,56 @@ def file_precursor(kwargs, psr):
     return f"{kwargs['obsid']}{label}_{psr}"
 
 
+def stage_file(src, dest):
+    """
+    Makes src available at dest without copying the data. Uses a hardlink, falling back to a copy only when
+    src and dest are on different filesystems. Any existing dest is replaced
+    """
+    if lexists(dest):
+        remove(dest)
+    try:
+        link(src, dest)
+    except OSError as e:
+        if e.errno != EXDEV:
+            raise
+        copyfile(src, dest)
+
+
 def setup_classify(cfg):
-    """Creates the required directories and copies files for the lotaas classifier"""
-    owd = getcwd()
-    chdir(cfg["files"]["psr_dir"])
+    """
+    Creates the required directories and stages the initial fold pfds for the lotaas classifier.
+    Doesn't change the working directory so can safely be run for many pulsars at once
+    """
+    psr_dir = cfg["files"]["psr_dir"]
     mdir(cfg["files"]["classify_dir"], cfg["files"]["classify_dir"]) # This should already exist but keep it anyway
+    # List the pulsar directory once. Hidden files are skipped to match glob
+    with scandir(psr_dir) as entries:
+        names = [entry.name for entry in entries if not entry.name.startswith(".")]
     for pointing in cfg["folds"].keys():
         init_bins = list(cfg["folds"][pointing]["init"].keys())[0]
         if int(init_bins) not in (50, 100):
             raise ValueError(f"Initial bins for {cfg['source']['name']} is invalid: {init_bins}")
+        pattern = pfd_pattern(cfg, pointing, init_bins, pfd_type=".pfd")
         try:
-            pfd_name = glob_pfds(cfg, pointing, init_bins, pfd_type=".pfd")[0]
-        except IndexError as e:
-            raise IndexError(f"No suitable pfds found: {cfg['files']['psr_dir']}")
-        # Copy pdf file to classify directory
-        newfilename=join(cfg["files"]["classify_dir"], basename(pfd_name))
-        copyfile(pfd_name, newfilename)
-    chdir(owd)
+            pfd_name = next(name for name in names if fnmatch(name, pattern))
+        except StopIteration as e:
+            raise IndexError(f"No suitable pfds found: {psr_dir}")
+        # Link pfd file into classify directory
+        stage_file(join(psr_dir, pfd_name), join(cfg["files"]["classify_dir"], pfd_name))
 
 
-def find_config_files(obsid, label=""):
-    """Searches the obsid/dpp directories to find any config (.yaml) files"""
+def find_config_files(obsid, label="", state_db=False):
+    """
+    Finds the config (.yaml) files of an observation. If state_db, the files registered in the observation's state
+    database are used, unless it doesn't exist or has none for the label. Otherwise the obsid/dpp directories are searched
+    """
+    db_path = state_db_path(obsid)
+    if state_db and exists(db_path):
+        try:
+            return find_config_files_db(obsid, label=label, db_path=db_path)
+        except ValueError:
+            logger.warning(f"No config files with label '{label}' in the state database {db_path}. "
+                           "Searching the dpp directories instead")
     dpp_dir = join(comp_config["base_data_dir"], str(obsid), "dpp")
     yaml_files = join(dpp_dir, "*", f"{obsid}*{label}.yaml")
     config_pathnames = glob(yaml_files)
@@ -97,8 +131,12 @@ def find_config_files(obsid, label=""):
     return config_pathnames
 
 
-def glob_pfds(cfg, pointing, bins, pfd_type=".pfd"):
-    """Globs the appropriate directory for the given pointing and bins for .pfds and returns the list"""
+def pfd_pattern(cfg, pointing, bins, pfd_type=".pfd"):
+    """Returns the glob pattern of the pfds for the given pointing and bins"""
     # See helper_prepfold.generate_prep_name() for glob dir reference
-    glob_dir = join(f"*{cfg['files']['file_precursor']}*{pointing}*b{bins}*{pfd_type}")
-    return glob(glob_dir)
\ No newline at end of file
+    return f"*{cfg['files']['file_precursor']}*{pointing}*b{bins}*{pfd_type}"
+
+
+def glob_pfds(cfg, pointing, bins, pfd_type=".pfd", directory=""):
+    """Globs the appropriate directory (default: the working directory) for the given pointing and bins for .pfds and returns the list"""
+    return glob(join(directory, pfd_pattern(cfg, pointing, bins, pfd_type=pfd_type)))
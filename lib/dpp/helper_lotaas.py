@@ -0,0 +1,327 @@
+import os
+import shlex
+import hashlib
+import logging
+import subprocess
+from shutil import move, rmtree
+from os.path import join, exists, basename, realpath, expanduser, splitext
+
+logger = logging.getLogger(__name__)
+
+LOTAAS_JAR = "/usr/local/bin/LOTAASClassifier.jar"
+LOTAAS_MODEL_DIR = os.environ.get("LOTAAS_MLC_MODEL_DIR", "/home/soft/models")
+LOTAAS_MODELS = [f"V1.3.1model{i}.model" for i in range(1, 6)]
+WORKER_DIR = os.environ.get("DPP_CLASSIFIER_WORKER_DIR", join(expanduser("~"), ".cache", "dpp", "classifier_worker"))
+# Printed by the worker after every request, followed by the exit status of the classifier
+DONE = "__CLASSIFIER_DONE__"
+
+# A small JVM-side worker that calls the classifier's main() for every line of tab separated arguments read from
+# stdin. The classifier's classes are loaded from the jar (whose Main-Class is read inside the JVM) by a class loader
+# that points their System.exit(int) calls at ClassifierWorker.exit(int), which throws instead of exiting. This
+# rewrites the constant pools of the class files, so unlike a SecurityManager it works on every JVM.
+# Every request gets a new class loader, so no static state of the classifier carries over from one model or .arff
+# to the next, just as when each ran in its own JVM. Only the JVM start-up is shared
+WORKER_SOURCE = """
+import java.io.*;
+import java.lang.reflect.*;
+import java.net.URL;
+import java.util.jar.JarFile;
+
+public class ClassifierWorker {
+    static class ExitTrap extends Error {
+        final int status;
+        ExitTrap(int status) { super("exit " + status); this.status = status; }
+    }
+
+    public static void exit(int status) { throw new ExitTrap(status); }
+
+    static int u2(byte[] b, int i) { return ((b[i] & 0xff) << 8) | (b[i + 1] & 0xff); }
+
+    static String utf8(byte[] b, int[] offsets, int index) throws IOException {
+        int off = offsets[index];
+        return new String(b, off + 3, u2(b, off + 1), "UTF-8");
+    }
+
+    static byte[] patchExits(byte[] b) throws IOException {
+        int count = u2(b, 8);
+        int[] offsets = new int[count];
+        int pos = 10;
+        for (int i = 1; i < count; i++) {
+            offsets[i] = pos;
+            int tag = b[pos] & 0xff;
+            switch (tag) {
+                case 1: pos += 3 + u2(b, pos + 1); break;
+                case 5: case 6: pos += 9; i++; break;
+                case 3: case 4: case 9: case 10: case 11: case 12: case 17: case 18: pos += 5; break;
+                case 15: pos += 4; break;
+                case 7: case 8: case 16: case 19: case 20: pos += 3; break;
+                default: throw new IOException("Unknown constant pool tag " + tag);
+            }
+        }
+        int poolEnd = pos;
+        boolean found = false;
+        for (int i = 1; i < count; i++) {
+            int off = offsets[i];
+            if (off == 0 || b[off] != 10) continue;
+            int nameAndType = offsets[u2(b, off + 3)];
+            if (utf8(b, offsets, u2(b, offsets[u2(b, off + 1)] + 1)).equals("java/lang/System")
+                    && utf8(b, offsets, u2(b, nameAndType + 1)).equals("exit")
+                    && utf8(b, offsets, u2(b, nameAndType + 3)).equals("(I)V")) {
+                // Point the Methodref at the Class entry appended to the pool below
+                b[off + 1] = (byte) ((count + 1) >> 8);
+                b[off + 2] = (byte) (count + 1);
+                found = true;
+            }
+        }
+        if (!found) return b;
+        if (count + 2 > 0xffff) throw new IOException("No room in the constant pool to redirect System.exit()");
+        byte[] name = ClassifierWorker.class.getName().replace('.', '/').getBytes("UTF-8");
+        ByteArrayOutputStream out = new ByteArrayOutputStream(b.length + name.length + 6);
+        out.write(b, 0, 8);
+        out.write((count + 2) >> 8);
+        out.write(count + 2);
+        out.write(b, 10, poolEnd - 10);
+        out.write(1);
+        out.write(name.length >> 8);
+        out.write(name.length);
+        out.write(name, 0, name.length);
+        out.write(7);
+        out.write(count >> 8);
+        out.write(count);
+        out.write(b, poolEnd, b.length - poolEnd);
+        return out.toByteArray();
+    }
+
+    static class ExitPatchingLoader extends java.net.URLClassLoader {
+        ExitPatchingLoader(URL jar) { super(new URL[] {jar}, ClassLoader.getSystemClassLoader().getParent()); }
+
+        protected Class<?> loadClass(String name, boolean resolve) throws ClassNotFoundException {
+            if (name.equals(ClassifierWorker.class.getName())) return ClassifierWorker.class;
+            return super.loadClass(name, resolve);
+        }
+
+        protected Class<?> findClass(String name) throws ClassNotFoundException {
+            URL url = findResource(name.replace('.', '/') + ".class");
+            if (url == null) throw new ClassNotFoundException(name);
+            try {
+                // Not cached, so closing one request's loader can't close the jar under the next one
+                java.net.URLConnection connection = url.openConnection();
+                connection.setUseCaches(false);
+                ByteArrayOutputStream bytes = new ByteArrayOutputStream();
+                try (InputStream in = connection.getInputStream()) {
+                    byte[] buf = new byte[8192];
+                    int n;
+                    while ((n = in.read(buf)) > 0) bytes.write(buf, 0, n);
+                }
+                byte[] b = patchExits(bytes.toByteArray());
+                return defineClass(name, b, 0, b.length);
+            } catch (IOException e) {
+                throw new ClassNotFoundException(name, e);
+            }
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        String mainClass;
+        try (JarFile jar = new JarFile(args[0])) {
+            mainClass = jar.getManifest().getMainAttributes().getValue("Main-Class");
+        }
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true);
+        // The classifier's own output goes to stderr so it can't be confused with the protocol
+        System.setOut(System.err);
+        URL jarUrl = new File(args[0]).toURI().toURL();
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while ((line = in.readLine()) != null) {
+            int status = 0;
+            try (ExitPatchingLoader loader = new ExitPatchingLoader(jarUrl)) {
+                Thread.currentThread().setContextClassLoader(loader);
+                Method main = Class.forName(mainClass, true, loader).getMethod("main", String[].class);
+                main.invoke(null, (Object) (line.isEmpty() ? new String[0] : line.split("\\\\t")));
+            } catch (InvocationTargetException e) {
+                if (e.getCause() instanceof ExitTrap) {
+                    status = ((ExitTrap) e.getCause()).status;
+                } else {
+                    e.getCause().printStackTrace();
+                    status = 1;
+                }
+            } catch (ExceptionInInitializerError e) {
+                // The classifier exited from a static initialiser
+                if (e.getCause() instanceof ExitTrap) {
+                    status = ((ExitTrap) e.getCause()).status;
+                } else {
+                    e.printStackTrace();
+                    status = 1;
+                }
+            }
+            Thread.currentThread().setContextClassLoader(ClassifierWorker.class.getClassLoader());
+            protocol.println("%s " + status);
+        }
+    }
+}
+""" % DONE
+
+
+def container_binds(launch, paths):
+    """
+    Adds bind mounts of the given paths to a singularity/apptainer 'exec' launch command, so that the container
+    can see them. Other launch commands are returned unchanged
+    """
+    launch = list(launch or [])
+    if launch and basename(launch[0]) in ("singularity", "apptainer") and "exec" in launch:
+        i = launch.index("exec") + 1
+        for path in paths:
+            launch[i:i] = ["-B", path]
+    return launch
+
+
+def build_worker(jar=LOTAAS_JAR, launch=None, worker_dir=WORKER_DIR):
+    """
+    Compiles the JVM worker (once per launch command) and returns the command that starts it.
+    Both run under launch, a list of words to prepend to java commands, e.g. ['singularity', 'exec', '-e', <container>],
+    so the jar only has to exist where java runs. worker_dir is bound into singularity/apptainer containers
+    """
+    launch = container_binds(launch, [worker_dir])
+    # Keyed by the launch command as well, as classes compiled in one container may not run in another's JVM
+    key = hashlib.md5((WORKER_SOURCE + repr(launch)).encode("utf-8")).hexdigest()[:12]
+    class_dir = join(worker_dir, key)
+    if not exists(join(class_dir, "ClassifierWorker.class")):
+        os.makedirs(worker_dir, exist_ok=True)
+        tmp_dir = f"{class_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        source = join(tmp_dir, "ClassifierWorker.java")
+        with open(source, "w") as f:
+            f.write(WORKER_SOURCE)
+        try:
+            subprocess.run(launch + ["javac", "-d", tmp_dir, source], check=True)
+            os.rename(tmp_dir, class_dir)
+        except OSError:
+            # Another job built the worker first
+            if not exists(join(class_dir, "ClassifierWorker.class")):
+                raise
+        finally:
+            if exists(tmp_dir):
+                rmtree(tmp_dir)
+    return launch + ["java", "-cp", class_dir, "ClassifierWorker", jar]
+
+
+class ClassifierWorker:
+    """
+    A persistent process that runs the classifier once per request without restarting.
+    Any command that reads tab separated arguments from stdin and replies with a 'DONE <status>' line can be used,
+    which allows a local stand-in for the JVM worker
+    """
+    def __init__(self, worker_cmd):
+        self.worker_cmd = worker_cmd
+        self.proc = None
+        # The number of processes started and requests answered, so callers can check one process served them all
+        self.starts = 0
+        self.served = 0
+        self.failed = False
+
+    def start(self):
+        logger.debug(f"Starting classifier worker: {' '.join(self.worker_cmd)}")
+        self.proc = subprocess.Popen(self.worker_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self.starts += 1
+
+    def run(self, args):
+        """
+        Runs the classifier with the given arguments. Returns its exit status or None if the worker died.
+        A worker that dies is restarted for the next request, unless it has never answered one
+        """
+        if self.failed:
+            return None
+        if self.proc is None or self.proc.poll() is not None:
+            self.start()
+        try:
+            self.proc.stdin.write("\t".join(args) + "\n")
+            self.proc.stdin.flush()
+            for line in self.proc.stdout:
+                if line.startswith(DONE):
+                    self.served += 1
+                    return int(line.split()[1])
+        except BrokenPipeError:
+            pass
+        logger.warning("Classifier worker exited unexpectedly")
+        self.close()
+        if not self.served:
+            logger.warning("The classifier worker never answered a request, so it won't be restarted")
+            self.failed = True
+        return None
+
+    def close(self):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.stdin.close()
+                self.proc.wait()
+            self.proc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_classifier_once(args, jar=LOTAAS_JAR, launch=None):
+    """Runs the classifier in its own JVM, as it has always been run. Returns its exit status"""
+    return subprocess.run((launch or []) + ["java", "-jar", jar] + list(args)).returncode
+
+
+def classify_arff(arff, worker=None, models=None, model_dir=LOTAAS_MODEL_DIR, jar=LOTAAS_JAR, launch=None, out_dir="."):
+    """
+    Scores an .arff file with every model and moves the outputs of model i to <arff name>_m<i>.positive/.negative
+    in out_dir (default: the working directory), exactly as the 'for i in {1..5}' loop did.
+    If the worker is None or dies, falls back to a new JVM for the model
+
+    Returns:
+    --------
+    outputs: list
+        The pathnames of the .positive/.negative files written
+    """
+    if models is None:
+        models = [join(model_dir, model) for model in LOTAAS_MODELS]
+    arff = realpath(arff)
+    stem = splitext(arff)[0]
+    outputs = []
+    for i, model in enumerate(models, 1):
+        args = ["-m", model, "-p", arff, "-a", "1", "-d"]
+        status = worker.run(args) if worker is not None else None
+        if status is None:
+            status = run_classifier_once(args, jar=jar, launch=launch)
+        if status != 0:
+            logger.warning(f"Classifier model {basename(model)} exited with status {status} for: {arff}")
+        for det in ("positive", "negative"):
+            if exists(f"{stem}.{det}"):
+                renamed = join(out_dir, f"{basename(stem)}_m{i}.{det}")
+                move(f"{stem}.{det}", renamed)
+                outputs.append(renamed)
+    return outputs
+
+
+def classify_arffs(arffs, models=None, model_dir=LOTAAS_MODEL_DIR, jar=LOTAAS_JAR, launch=None, worker_cmd=None, out_dir="."):
+    """
+    Scores many .arff files with every model using a single persistent worker.
+    worker_cmd replaces the JVM worker (e.g. with a stand-in for testing)
+    """
+    if worker_cmd is None:
+        try:
+            worker_cmd = build_worker(jar=jar, launch=launch)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"Unable to build the classifier worker, running one JVM per model: {e}")
+    worker = ClassifierWorker(worker_cmd) if worker_cmd else None
+    outputs = []
+    try:
+        for arff in arffs:
+            outputs += classify_arff(arff, worker=worker, models=models, model_dir=model_dir, jar=jar, launch=launch,
+                                     out_dir=out_dir)
+    finally:
+        if worker is not None:
+            worker.close()
+            logger.info(f"The classifier worker ran {worker.served} classifications in {worker.starts} JVM(s)")
+    return outputs
+
+
+def parse_launch(launch):
+    """Splits a launch command string (e.g. 'singularity exec -e <container>') into a list"""
+    return shlex.split(launch) if launch else None
@@ -1,22 +1,16 @@
 import logging
-from astropy.coordinates import SkyCoord
-import astropy.units as u
 import numpy as np
 import os
 import glob
 import math
-import psrqpy
 import sys
 
-# vcstools imports
-import vcstools.sn_flux_utils as snfu
+# vcstools imports. The beam, catalogue and flux modules (and psrqpy and astropy.coordinates)
+# are slow to import and are imported by the functions that use them
 from vcstools.metadb_utils import get_common_obs_metadata, obs_max_min, get_obs_array_phase
 from vcstools import data_load
 from vcstools.pointing_utils import format_ra_dec
-from vcstools.catalogue_utils import grab_source_alog
-from vcstools.beam_calc import find_sources_in_obs
 from vcstools.config import load_config_file
-comp_config = load_config_file()
 
 # mwa_search imports
 from mwa_search.grid_tools import get_grid
@@ -107,6 +101,8 @@ def find_fold_times(pulsars, obsid, beg, end, min_z_power=(0.3, 0.1), metadata=N
                     exit: float
                         The normalisd time the pulsar leaves the beam
     """
+    from vcstools import sn_flux_utils as snfu
+    from vcstools.catalogue_utils import grab_source_alog
     if not metadata or not full_meta:
         metadata, full_meta = get_common_obs_metadata(obsid, return_all=True)
     min_z_power = sorted(min_z_power, reverse=True)
@@ -157,6 +153,8 @@ def find_pulsars_power(obsid, powers=None, names_ra_dec=None, metadata_list=None
     meta_data: list
         A list of the output of get_common_obs_metadata for the input obsid
     """
+    from vcstools.catalogue_utils import grab_source_alog
+    from vcstools.beam_calc import find_sources_in_obs
     if not powers:
         powers = [0.3, 0.1]
     elif not (isinstance(powers, list) or isinstance(powers, tuple)):
@@ -232,6 +230,8 @@ def get_pointings_required(source_ra, source_dec, fwhm, search_radius):
         A list of pointings where each pointing contains an RA and a Dec in the format 'hh:mm:ss.ss'
         [[RA, Dec]]
     """
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
     #convert to radians
     coord = SkyCoord(source_ra, source_dec, unit=(u.hourangle,u.deg))
     rar = coord.ra.radian #in radians
@@ -279,6 +279,8 @@ def get_sources_in_fov(obsid, source_type, fwhm):
         pointing_list: list
             A list of pointings corresponding to the pulsars in name_list
     """
+    from vcstools.catalogue_utils import grab_source_alog
+    from vcstools.beam_calc import find_sources_in_obs
     names_ra_dec = grab_source_alog(source_type=source_type)
     obs_data, _ = find_sources_in_obs([obsid], names_ra_dec, dt_input=100)
     name_list = []
@@ -345,6 +347,9 @@ def find_pulsars_in_fov(obsid, psrbeg, psrend,
             sp_name_list,
             sp_pointing_list]
     """
+    import psrqpy
+    from vcstools import sn_flux_utils as snfu
+    from vcstools.catalogue_utils import grab_source_alog
     if not meta_data or not full_meta:
         meta_data, full_meta = get_common_obs_metadata(obsid, return_all=True)
     channels = meta_data[-1]
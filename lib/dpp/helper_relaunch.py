@@ -13,14 +13,14 @@ def launch_label(cfg):
     return order[counter]
 
 
-def relaunch_ppp(cfg, depends_on=None, depend_type="afterany", fresh_run=False, reset_logs=False, time="00:30:00"):
+def relaunch_ppp(cfg, depends_on=None, depend_type="afterany", fresh_run=False, reset_logs=False, time="00:30:00", mem=8192,
+                 cpu_threads=1):
     """Relaunches the pulsar processing pipeline using the supplied cfg file"""
     # dump the new cfg
     dump_to_yaml(cfg)
     label = launch_label(cfg)
     name = f"ppp_{label}_{cfg['files']['file_precursor']}"
     slurm_kwargs = {"time": time}
-    mem=8192
     ppp_launch = "pulsar_processing_pipeline.py"
     ppp_launch += f" --cfg {cfg['files']['my_name']}"
     if fresh_run:
@@ -32,7 +32,7 @@ def relaunch_ppp(cfg, depends_on=None, depend_type="afterany", fresh_run=False,
     modules = [f"mwa_search/{cfg['run_ops']['mwa_search']}", "singularity"]
     jid = submit_slurm(name, cmds,
             slurm_kwargs=slurm_kwargs, module_list=modules, mem=mem, batch_dir=cfg["files"]["batch_dir"], depend=depends_on,
-            depend_type=depend_type, vcstools_version=cfg["run_ops"]["vcstools"], submit=True)
+            depend_type=depend_type, vcstools_version=cfg["run_ops"]["vcstools"], cpu_threads=cpu_threads, submit=True)
     logger.info(f"Submitted relaunch of ppp: {name}")
     logger.info(f"job ID: {jid}")
     if depends_on:
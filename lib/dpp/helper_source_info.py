@@ -1,5 +1,4 @@
 from vcstools import data_load
-import psrqpy
 
 import logging
 import math
@@ -10,6 +9,7 @@ logger = logging.getLogger(__name__)
 def bin_sampling_limit(pulsar, sampling_rate=1e-4, query=None):
     """Finds the sampling limit of the input pulsar in units of number of bins"""
     if query is None:
+        import psrqpy # Slow to import and only needed without a query
         query = psrqpy.QueryATNF(params=["P0"], psrs=[
                                  pulsar], loadfromdb=data_load.ATNF_LOC).pandas
     query_index = list(query["JNAME"]).index(pulsar)
@@ -21,6 +21,7 @@ def bin_sampling_limit(pulsar, sampling_rate=1e-4, query=None):
 def is_binary(pulsar, query=None):
     """Checks the ATNF database to see if a pulsar is part of a binary system"""
     if query is None:
+        import psrqpy # Slow to import and only needed without a query
         query = psrqpy.QueryATNF(params=["BINARY"], psrs=[
                                  pulsar], loadfromdb=data_load.ATNF_LOC).pandas
     query_index = list(query["JNAME"]).index(pulsar)
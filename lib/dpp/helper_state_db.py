@@ -0,0 +1,227 @@
+import logging
+import sqlite3
+import time
+from os.path import join, exists
+
+from vcstools.config import load_config_file
+
+comp_config = load_config_file()
+logger = logging.getLogger(__name__)
+
+# The order in which the pipeline completes its stages. Mirrors cfg["completed"]
+STAGES = ["init_folds", "classify", "post_folds", "upload", "debase", "RM", "RVM_initial", "RVM_final"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pulsars (
+    precursor   TEXT PRIMARY KEY,
+    obsid       TEXT NOT NULL,
+    label       TEXT NOT NULL,
+    pulsar      TEXT NOT NULL,
+    cfg_path    TEXT NOT NULL,
+    psr_dir     TEXT NOT NULL,
+    binary      INTEGER,
+    my_pointing TEXT,
+    my_bins     INTEGER,
+    updated     REAL
+);
+CREATE TABLE IF NOT EXISTS folds (
+    precursor   TEXT NOT NULL,
+    pointing    TEXT NOT NULL,
+    fold_type   TEXT NOT NULL,
+    bins        INTEGER NOT NULL,
+    classifier  INTEGER,
+    sn          REAL,
+    chi         REAL,
+    dm          REAL,
+    period      REAL,
+    PRIMARY KEY (precursor, pointing, fold_type, bins)
+);
+CREATE TABLE IF NOT EXISTS stages (
+    precursor   TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    stage_idx   INTEGER NOT NULL,
+    completed   INTEGER NOT NULL,
+    updated     REAL,
+    PRIMARY KEY (precursor, stage)
+);
+CREATE TABLE IF NOT EXISTS dispatches (
+    precursor   TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    start_time  REAL NOT NULL,
+    end_time    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    precursor   TEXT PRIMARY KEY,
+    my_DM       REAL,
+    my_P        REAL,
+    my_Pdot     REAL,
+    RM          REAL,
+    RM_e        REAL,
+    alpha       REAL,
+    beta        REAL,
+    l0          REAL,
+    pa0         REAL,
+    chi         REAL
+);
+CREATE INDEX IF NOT EXISTS pulsars_obsid_idx ON pulsars (obsid, label);
+CREATE INDEX IF NOT EXISTS pulsars_pulsar_idx ON pulsars (pulsar);
+CREATE INDEX IF NOT EXISTS folds_precursor_idx ON folds (precursor);
+CREATE INDEX IF NOT EXISTS stages_stage_idx ON stages (stage, completed);
+CREATE INDEX IF NOT EXISTS dispatches_precursor_idx ON dispatches (precursor, stage);
+"""
+
+
+def state_db_path(obsid):
+    """Returns the pathname of the state database for an observation"""
+    return join(comp_config["base_data_dir"], str(obsid), "dpp", "dpp_state.db")
+
+
+def connect_state_db(db_path):
+    """
+    Opens a connection to a dpp state database, creating the tables if necessary.
+    The timeout is generous because many ppp jobs may be writing at once
+    """
+    conn = sqlite3.connect(db_path, timeout=120)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def current_stage(cfg):
+    """Returns the first stage that has not been completed or 'finished' if they all have"""
+    for stage in STAGES:
+        if not cfg["completed"][stage]:
+            return stage
+    return "finished"
+
+
+def _fold_rows(cfg):
+    """Makes a row for the folds table for every fold in the cfg"""
+    rows = []
+    for pointing, pointing_info in cfg["folds"].items():
+        for fold_type in ("init", "post"):
+            for bins, info in pointing_info[fold_type].items():
+                rows.append((cfg["files"]["file_precursor"], pointing, fold_type, int(bins), pointing_info["classifier"],
+                            info.get("sn"), info.get("chi"), info.get("dm"), info.get("period")))
+    return rows
+
+
+def record_cfg(cfg):
+    """
+    Writes the state of a cfg to its observation's state database as a single transaction.
+    Does nothing if the cfg was not set up to use a state database
+    """
+    db_path = cfg["run_ops"].get("state_db")
+    if not db_path:
+        return
+    precursor = cfg["files"]["file_precursor"]
+    now = time.time()
+    conn = connect_state_db(db_path)
+    try:
+        with conn: # Commits on success, rolls back if anything goes wrong
+            conn.execute("INSERT OR REPLACE INTO pulsars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (precursor, str(cfg["obs"]["id"]), cfg["run_ops"]["label"], cfg["source"]["name"],
+                        cfg["files"]["my_name"], cfg["files"]["psr_dir"], int(bool(cfg["source"]["binary"])),
+                        cfg["source"]["my_pointing"], cfg["source"]["my_bins"], now))
+            conn.execute("DELETE FROM folds WHERE precursor = ?", (precursor,))
+            conn.executemany("INSERT INTO folds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", _fold_rows(cfg))
+            conn.executemany("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)",
+                            [(precursor, stage, i, int(bool(cfg["completed"][stage])), now) for i, stage in enumerate(STAGES)])
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (precursor, cfg["source"]["my_DM"], cfg["source"]["my_P"], cfg["source"]["my_Pdot"],
+                        cfg["pol"]["RM"], cfg["pol"]["RM_e"], cfg["pol"]["alpha"], cfg["pol"]["beta"],
+                        cfg["pol"]["l0"], cfg["pol"]["pa0"], cfg["pol"]["chi"]))
+    finally:
+        conn.close()
+
+
+def record_dispatch(cfg, stage, start, end):
+    """
+    Records the wall time a ppp job spent dispatching a pipeline stage. This covers the work done in the ppp job itself
+    and the submission of the stage's jobs, not the run time of the jobs it submitted
+    """
+    db_path = cfg["run_ops"].get("state_db")
+    if not db_path:
+        return
+    conn = connect_state_db(db_path)
+    try:
+        with conn:
+            conn.execute("INSERT INTO dispatches VALUES (?, ?, ?, ?)", (cfg["files"]["file_precursor"], stage, start, end))
+    finally:
+        conn.close()
+
+
+def find_config_files_db(obsid, label="", db_path=None):
+    """Returns the pathnames of all config files registered in the observation's state database"""
+    if db_path is None:
+        db_path = state_db_path(obsid)
+    conn = connect_state_db(db_path)
+    try:
+        rows = conn.execute("SELECT cfg_path FROM pulsars WHERE obsid = ? AND label = ? ORDER BY pulsar",
+                            (str(obsid), label)).fetchall()
+    finally:
+        conn.close()
+    config_pathnames = [row["cfg_path"] for row in rows]
+    if not config_pathnames:
+        raise ValueError(f"No config files found in state database: {db_path}")
+    return config_pathnames
+
+
+def stage_progress(obsid, label="", db_path=None):
+    """
+    Finds the stage that each pulsar in an observation is up to
+
+    Returns:
+    --------
+    progress: dictionary
+        Keys are the stages in STAGES plus 'finished'. Values are lists of the pulsars at that stage
+    """
+    if db_path is None:
+        db_path = state_db_path(obsid)
+    conn = connect_state_db(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT p.pulsar AS pulsar, MIN(s.stage_idx) AS stage_idx
+            FROM pulsars p LEFT JOIN stages s ON s.precursor = p.precursor AND s.completed = 0
+            WHERE p.obsid = ? AND p.label = ?
+            GROUP BY p.precursor
+            ORDER BY p.pulsar
+            """, (str(obsid), label)).fetchall()
+    finally:
+        conn.close()
+    progress = {stage: [] for stage in STAGES + ["finished"]}
+    for row in rows:
+        stage = "finished" if row["stage_idx"] is None else STAGES[row["stage_idx"]]
+        progress[stage].append(row["pulsar"])
+    return progress
+
+
+def results_summary(obsid, label="", db_path=None):
+    """Returns the results of every pulsar in an observation that has completed the pipeline as a list of dictionaries"""
+    if db_path is None:
+        db_path = state_db_path(obsid)
+    conn = connect_state_db(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT p.pulsar AS pulsar, p.my_pointing AS my_pointing, p.my_bins AS my_bins, r.*
+            FROM pulsars p JOIN results r ON r.precursor = p.precursor
+            WHERE p.obsid = ? AND p.label = ?
+            AND NOT EXISTS (SELECT 1 FROM stages s WHERE s.precursor = p.precursor AND s.completed = 0)
+            ORDER BY p.pulsar
+            """, (str(obsid), label)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def log_progress(obsid, label="", db_path=None):
+    """Logs a summary of the progress of every pulsar in an observation"""
+    if db_path is None:
+        db_path = state_db_path(obsid)
+    if not exists(db_path):
+        logger.info(f"No state database found: {db_path}")
+        return
+    progress = stage_progress(obsid, label=label, db_path=db_path)
+    logger.info(f"Pipeline progress for observation {obsid}:")
+    for stage, pulsars in progress.items():
+        logger.info(f"{stage:<12} {len(pulsars):>5}  {' '.join(pulsars)}")
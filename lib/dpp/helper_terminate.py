@@ -1,6 +1,8 @@
 import logging
 import sys
 
+from dpp.helper_state_db import record_cfg, results_summary
+
 logger = logging.getLogger(__name__)
 
 def finish_unsuccessful(cfg, e):
@@ -35,4 +37,10 @@ def finish_successful(cfg):
     logger.info(f"beta:                     {cfg['pol']['beta']}")
     logger.info(f"alpha:                    {cfg['pol']['alpha']}")
     logger.info(f"chi:                      {cfg['pol']['chi']}")
+    if cfg["run_ops"].get("state_db"):
+        record_cfg(cfg)
+        summary = results_summary(cfg["obs"]["id"], label=cfg["run_ops"]["label"], db_path=cfg["run_ops"]["state_db"])
+        logger.info(f"Pulsars in this observation that have completed a full run: {len(summary)}")
+        for result in summary:
+            logger.info(f"{result['pulsar']:<12} RM: {result['RM']} +/- {result['RM_e']}  alpha: {result['alpha']}  beta: {result['beta']}")
     sys.exit(0)
\ No newline at end of file
@@ -8,16 +8,15 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 import matplotlib.colors as colors
 import logging
 import argparse
-import json
 import os
-import glob
 import sys
 
 from vcstools import prof_utils
-from dpp import stokes_fold
+from dpp.psrfits import is_psrfits, read_psrfits_profiles
+from dpp.epndb import load_pulsar
 
 logger = logging.getLogger(__name__)
-EPNDB_LOC = os.environ["EPNDB_LOC"]
+EPNDB_LOC = os.environ.get("EPNDB_LOC") # Only needed to read the EPNDB
 
 #---------------------------------------------------------------
 class NoEPNDBError(Exception):
@@ -32,7 +31,7 @@ def read_ascii_archive(archive, roll=True, norm=True):
     Parameters:
     -----------
     archive: string
-        The pathname of the ascii archive
+        The pathname of the ascii archive or of a PSRFITS archive
     roll: boolean
         If True, will align the archive at the centre
     norm: boolean
@@ -56,14 +55,15 @@ def read_ascii_archive(archive, roll=True, norm=True):
         If pa is in archive, this is the error in the pa. Otherwise empty
     """
     #Read the archive
-    f = np.genfromtxt(archive, skip_header=1)
-    I               = np.array([i[3] for i in f])
-    Q               = np.array([i[4] for i in f])
-    U               = np.array([i[5] for i in f])
-    V               = np.array([i[6] for i in f])
-    if len(f[0])==10: #read PA if it exists in file
-        pa          = np.array([i[8] for i in f])
-        pa_err      = np.array([i[9] for i in f])
+    if is_psrfits(archive): #PSRFITS archives are read directly without a pdv conversion
+        I, Q, U, V  = read_psrfits_profiles(archive)
+        f           = np.empty((0, 7))
+    else:
+        f           = np.genfromtxt(archive, skip_header=1, ndmin=2)
+        I, Q, U, V  = f[:, 3:7].T
+    if f.shape[1]==10: #read PA if it exists in file
+        pa          = f[:, 8]
+        pa_err      = f[:, 9]
         lin_pol, _  = calc_lin_pa(Q, U)
     else: #otherwise, generate PA (always generate lin_pol because psrchive sucks at it)
         lin_pol, pa = calc_lin_pa(Q, U)
@@ -162,58 +162,25 @@ def get_data_from_epndb(pulsar):
             The location the pulsar was observed at
 
     """
-    #find all directories in epndb
-    all_json_dirs = glob.glob(EPNDB_LOC + "/json/*/*/*.json")
-    json_pulsar_dirs = []
-
-    for directory in all_json_dirs:
-        name = directory.split("/")[-2]
-        if name==pulsar:
-            json_pulsar_dirs.append(directory)
-
-    logger.debug("All json directories:            {}".format(len(all_json_dirs)))
-    logger.debug("Positive json directories:       {}".format(len(json_pulsar_dirs)))
+    #read the pulsar's entries from the EPNDB cache, which is updated if the pulsar has new entries
+    try:
+        entries = load_pulsar(pulsar, EPNDB_LOC)
+    except KeyError:
+        raise NoEPNDBError("Pulsar not on the EPNDB!")
+    logger.debug("EPNDB entries with frequency info: {}".format(len(entries)))
 
     pulsar_dict={"Ix":[], "Qx":[], "Ux":[], "Vx":[], "Iy":[], "Qy":[], "Uy":[], "Vy":[],\
                 "freq":[], "dm":[], "rm":[], "site":[]}
-    for file_path in json_pulsar_dirs:
-        with open(file_path) as json_file:
-            data = json.load(json_file)
-            header = data["hdr"]
-            series = data["series"]
-
-            #Ignore anything without frequency info
-            if "freq" in header:
-                pulsar_dict["freq"].append(float(header["freq"]))
-                pulsar_dict["dm"].append(float(header["dm"]))
-                pulsar_dict["rm"].append(float(header["rm"]))
-                pulsar_dict["site"].append(header["site"])
-                pulsar_dict["Ix"].append([k[0] for k in series["I"]])
-                pulsar_dict["Iy"].append([k[1] for k in series["I"]])
-
-                if "Q" in series:
-                    pulsar_dict["Qx"].append([k[0] for k in series["Q"]])
-                    pulsar_dict["Qy"].append([k[1] for k in series["Q"]])
-                else:
-                    pulsar_dict["Qx"].append([])
-                    pulsar_dict["Qy"].append([])
-                if "U" in series:
-                    pulsar_dict["Ux"].append([k[0] for k in series["U"]])
-                    pulsar_dict["Uy"].append([k[1] for k in series["U"]])
-                else:
-                    pulsar_dict["Ux"].append([])
-                    pulsar_dict["Uy"].append([])
-                if "V" in series:
-                    pulsar_dict["Vx"].append([k[0] for k in series["V"]])
-                    pulsar_dict["Vy"].append([k[1] for k in series["V"]])
-                else:
-                    pulsar_dict["Vx"].append([])
-                    pulsar_dict["Vy"].append([])
-
-    #sort by frequency
-    if len(pulsar_dict["freq"]) > 0:
-        pulsar_dict = sort_pulsar_dict(pulsar_dict)
-    else:
+    #entries are already sorted by frequency
+    for entry in entries:
+        for key in ("freq", "dm", "rm", "site"):
+            pulsar_dict[key].append(entry[key])
+        for stokes in ("I", "Q", "U", "V"):
+            series = entry.get(stokes)
+            pulsar_dict[stokes + "x"].append(series[:, 0] if series is not None else [])
+            pulsar_dict[stokes + "y"].append(series[:, 1] if series is not None else [])
+
+    if len(pulsar_dict["freq"]) == 0:
         raise NoEPNDBError("Pulsar not on the EPNDB!")
 
     return pulsar_dict
@@ -461,6 +428,7 @@ def plot_archive_stokes(archive, pulsar=None, freq=None, obsid=None, out_dir="./
 
     if rvm_fit:
         #plot the rvm fit
+        from dpp import stokes_fold
         res_upscale = 5120/len(sI)
         phi_range = np.linspace(0, 360, int(res_upscale*len(sI)))
         x = np.linspace(-0.5, 0.5, int(res_upscale*len(sI)))
@@ -610,9 +578,10 @@ def sort_pulsar_dict(pulsar_dict):
     pulsar_dict: dictionary
         The same dictionary sorted by frequency
     """
-    freq_list = pulsar_dict["freq"]
+    #sort on frequency alone so profiles (which may be arrays) are never compared
+    order = sorted(range(len(pulsar_dict["freq"])), key=lambda i: pulsar_dict["freq"][i])
     for key in pulsar_dict.keys():
-        _, pulsar_dict[key] = (list(t) for t in zip(*sorted(zip(freq_list, pulsar_dict[key]))))
+        pulsar_dict[key] = [pulsar_dict[key][i] for i in order]
 
     return pulsar_dict
 
@@ -0,0 +1,127 @@
+import logging
+import numpy as np
+from functools import lru_cache
+from os.path import getmtime
+
+logger = logging.getLogger(__name__)
+
+
+def is_psrfits(filename):
+    """Checks whether a file is a FITS file (rather than e.g. a Timer archive) from its first bytes"""
+    try:
+        with open(filename, "rb") as f:
+            return f.read(6) == b"SIMPLE"
+    except OSError:
+        return False
+
+
+def coherence_to_stokes(aa, bb, cr, ci, basis="LIN", hand=1):
+    """
+    Converts the coherence products of a feed to Stokes I, Q, U, V. Only linear feeds of the usual handedness
+    (FD_POLN = LIN, FD_HAND = +1) are supported, as anything else needs more of the feed's conventions than this knows
+    """
+    basis = str(basis).strip().upper()
+    if not basis.startswith("LIN") or int(hand) != 1:
+        raise ValueError(f"Can only convert coherence products of a linear feed with FD_HAND = +1 to Stokes, "
+                         f"not basis {basis} with FD_HAND = {hand}. Convert the archive to Stokes with psrchive first")
+    return np.stack([aa + bb, aa - bb, 2 * cr, 2 * ci])
+
+
+def _to_stokes(data, pol_type, basis="LIN", hand=1):
+    """Converts (npol, ...) data to Stokes I, Q, U, V. basis and hand are the FD_POLN and FD_HAND of the feed"""
+    pol_type = pol_type.strip().upper()
+    if pol_type == "IQUV":
+        return data[:4]
+    if pol_type == "AABBCRCI":
+        return coherence_to_stokes(*data[:4], basis=basis, hand=hand)
+    # Total intensity only
+    zeros = np.zeros_like(data[0])
+    return np.stack([data[0], zeros, zeros, zeros])
+
+
+def dedisperse(profiles, freqs, dm, period, ref_freq):
+    """
+    Rotates the profile of each channel (..., nchan, nbin) to remove the dispersion delay with respect to ref_freq,
+    using a Fourier shift so fractional bin delays are kept as psrchive does
+    """
+    nbin = profiles.shape[-1]
+    delays = dm / 2.41e-4 * (1. / freqs ** 2 - 1. / ref_freq ** 2) # seconds
+    shifts = delays / period * nbin # bins to move each channel earlier
+    k = np.fft.rfftfreq(nbin, d=1. / nbin)
+    phasors = np.exp(2j * np.pi * k[None, :] * shifts[:, None] / nbin)
+    return np.fft.irfft(np.fft.rfft(profiles, axis=-1) * phasors, n=nbin, axis=-1)
+
+
+@lru_cache(maxsize=4)
+def _load_psrfits(filename, mtime, period):
+    """Does the work of load_psrfits(). The modification time is part of the key so a rewritten file is reloaded"""
+    from astropy.io import fits
+    with fits.open(filename, memmap=True) as hdul:
+        primary = hdul[0].header
+        subint = hdul["SUBINT"]
+        header = subint.header
+        nbin, nchan, npol = header["NBIN"], header["NCHAN"], header["NPOL"]
+        nsub = header["NAXIS2"]
+        data = subint.data["DATA"].reshape(nsub, npol, nchan, nbin) # memory mapped
+        scales = subint.data["DAT_SCL"].reshape(nsub, npol, nchan).astype(np.float64)
+        offsets = subint.data["DAT_OFFS"].reshape(nsub, npol, nchan).astype(np.float64)
+        weights = subint.data["DAT_WTS"].reshape(nsub, nchan).astype(np.float64)
+        freqs = np.asarray(subint.data["DAT_FREQ"]).reshape(nsub, nchan)[0].astype(np.float64)
+        if period is None and "PERIOD" in subint.columns.names:
+            period = float(subint.data["PERIOD"][0])
+        dm = header.get("DM", primary.get("CHAN_DM", 0.))
+        dedispersed = False
+        if "HISTORY" in hdul and "DEDISP" in hdul["HISTORY"].columns.names:
+            dedispersed = bool(hdul["HISTORY"].data["DEDISP"][-1])
+        # Scale, offset and weight every subint in a single pass over the mapped data
+        ws = weights[:, None, :] * scales
+        chan_weights = weights.sum(axis=0)
+        norm = np.where(chan_weights > 0, chan_weights, 1.)
+        cube = np.einsum("spc,spcb->pcb", ws, data, dtype=np.float64)
+        cube += (weights[:, None, :] * offsets).sum(axis=0)[:, :, None]
+        cube /= norm[None, :, None]
+        stokes = _to_stokes(cube, header.get("POL_TYPE", "AABBCRCI"), basis=primary.get("FD_POLN", "LIN"),
+                            hand=primary.get("FD_HAND", 1))
+        ref_freq = primary.get("OBSFREQ", freqs.mean())
+    if not dedispersed and dm:
+        if period is None:
+            raise ValueError(f"The archive is not dedispersed and no period was supplied: {filename}")
+        stokes = dedisperse(stokes, freqs, dm, period, ref_freq)
+    return {"freqs": freqs, "stokes": stokes, "weights": chan_weights, "dm": dm, "period": period, "nbin": nbin}
+
+
+def load_psrfits(filename, period=None):
+    """
+    Loads a PSRFITS fold-mode archive with its data memory mapped, applying the scales, offsets and weights,
+    time scrunching, dedispersing each channel and converting to Stokes. Results are cached so that
+    every user of the same archive shares one load
+
+    Parameters:
+    -----------
+    filename: string
+        The pathname of the PSRFITS archive
+    period: float
+        OPTIONAL - The folding period (s). Only needed if the archive isn't dedispersed and has no PERIOD column
+
+    Returns:
+    --------
+    archive: dictionary
+        'freqs' (nchan,) MHz, 'stokes' (4, nchan, nbin), 'weights' (nchan,), 'dm', 'period' and 'nbin'
+    """
+    return _load_psrfits(filename, getmtime(filename), period)
+
+
+def read_psrfits_profiles(filename, period=None):
+    """
+    Returns the frequency scrunched Stokes profiles of a PSRFITS archive
+
+    Returns:
+    --------
+    I, Q, U, V: numpy.arrays
+        The profiles (nbin,)
+    """
+    archive = load_psrfits(filename, period=period)
+    weights = archive["weights"]
+    total = weights.sum() if weights.sum() > 0 else 1.
+    profiles = (archive["stokes"] * weights[None, :, None]).sum(axis=1) / total
+    return tuple(profiles)
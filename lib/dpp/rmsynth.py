@@ -0,0 +1,198 @@
+import logging
+import subprocess
+import numpy as np
+
+from dpp.psrfits import is_psrfits, load_psrfits, dedisperse, coherence_to_stokes
+
+logger = logging.getLogger(__name__)
+
+C = 299792458.0 # speed of light (m/s)
+# The maximum number of elements in each block of the (nphi, nchan) synthesis kernel
+KERNEL_BLOCK = 2**22
+
+
+def _psredit(archive, params):
+    """Returns the requested header parameters of an archive as strings"""
+    output = subprocess.check_output(["psredit", "-Q", "-c", ",".join(params), archive]).decode("utf-8")
+    return output.split()[1:]
+
+
+def load_stokes(archive, period=None):
+    """
+    Loads the time scrunched, dedispersed Stokes parameters of every channel of an archive, reading the archive only once.
+    PSRFITS archives are read directly. Otherwise uses the psrchive python interface if it is available, or pdv and psredit.
+    period (s) is only needed for archives that are not dedispersed and are read with pdv, or are PSRFITS without a
+    PERIOD column
+
+    Returns:
+    --------
+    freqs: numpy.array
+        The centre frequencies of the channels (MHz)
+    stokes: numpy.array
+        (4, nchan, nbin) Stokes I, Q, U, V
+    weights: numpy.array
+        The weight of each channel
+    """
+    if is_psrfits(archive):
+        loaded = load_psrfits(archive, period=period)
+        return loaded["freqs"], loaded["stokes"], loaded["weights"]
+    try:
+        import psrchive
+    except ImportError:
+        psrchive = None
+    if psrchive is not None:
+        ar = psrchive.Archive_load(archive)
+        ar.dedisperse() # Does nothing if the archive is already dedispersed
+        ar.tscrunch()
+        ar.convert_state("Stokes")
+        return np.asarray(ar.get_frequencies()), ar.get_data()[0].astype(np.float64), ar.get_weights()[0]
+
+    freq, bw, nchan, state, dm, dmc, basis, hand = _psredit(archive, ["freq", "bw", "nchan", "state", "dm", "dmc",
+                                                                      "rcvr:basis", "rcvr:hand"])
+    freq, bw, nchan, dm = float(freq), float(bw), int(nchan), float(dm)
+    freqs = freq - bw / 2 + (np.arange(nchan) + 0.5) * bw / nchan
+    output = subprocess.check_output(["pdv", "-Tt", archive]).decode("utf-8")
+    data = np.array([line.split() for line in output.splitlines() if line and not line.startswith("File")], dtype=np.float64)
+    nbin = int(data[:, 2].max()) + 1
+    pols = data[:, 3:].reshape(nchan, nbin, -1).transpose(2, 0, 1)
+    if state.lower().startswith("coherence"): # AA, BB, CR, CI
+        pols = coherence_to_stokes(*pols, basis=basis, hand=hand)
+    weights = (np.abs(pols[0]).sum(axis=1) > 0).astype(np.float64) # zapped channels are zeroed by pdv
+    # pdv prints the data as stored, so it is dedispersed here if the archive isn't
+    if dmc.lower() not in ("1", "true", "yes") and dm:
+        if period is None:
+            raise ValueError(f"The archive is not dedispersed and no period was supplied: {archive}")
+        pols = dedisperse(pols, freqs, dm, period, freq)
+    return freqs, pols, weights
+
+
+def lambda_sq(freqs):
+    """Wavelength squared (m^2) of frequencies in MHz"""
+    return (C / (np.asarray(freqs) * 1e6)) ** 2
+
+
+def rmsf_fwhm(freqs):
+    """The theoretical FWHM (rad/m^2) of the RM spread function for the band"""
+    l2 = lambda_sq(freqs)
+    return 2 * np.sqrt(3) / (l2.max() - l2.min())
+
+
+def faraday_dispersion(Q, U, freqs, phis, weights=None):
+    """
+    Evaluates the Faraday dispersion function at every trial Faraday depth with a single matrix product
+
+    Parameters:
+    -----------
+    Q, U: numpy.array
+        (nchan,) or (nchan, nbin) Stokes Q and U
+    freqs: numpy.array
+        The channel frequencies (MHz)
+    phis: numpy.array
+        The trial Faraday depths (rad/m^2)
+    weights: numpy.array
+        The weight of each channel. Default: uniform
+
+    Returns:
+    --------
+    fdf: numpy.array
+        (nphi,) or (nphi, nbin) complex Faraday dispersion function
+    """
+    l2 = lambda_sq(freqs)
+    if weights is None:
+        weights = np.ones_like(l2)
+    K = 1. / weights.sum()
+    l2_0 = K * (weights * l2).sum()
+    P = (np.asarray(Q) + 1j * np.asarray(U)) * (K * weights).reshape((-1,) + (1,) * (np.ndim(Q) - 1))
+    phis = np.asarray(phis)
+    fdf = np.empty((len(phis),) + P.shape[1:], dtype=np.complex128)
+    # The kernel is built in blocks of trials to bound the memory used
+    block = max(1, KERNEL_BLOCK // len(l2))
+    for start in range(0, len(phis), block):
+        kernel = np.exp(-2j * np.outer(phis[start:start + block], l2 - l2_0))
+        fdf[start:start + block] = kernel @ P
+    return fdf
+
+
+def rm_synthesis(freqs, stokes, weights, on_bins, phi_range, phi_steps):
+    """
+    Performs RM synthesis on the on-pulse bins of baseline subtracted Stokes data
+
+    Returns:
+    --------
+    result: dictionary
+        'rm', 'rm_e', 'phis', 'fdf' (summed over the on-pulse bins) and 'bin_rms' (the RM of each on-pulse bin)
+    """
+    phis = np.linspace(phi_range[0], phi_range[1], phi_steps)
+    Q = stokes[1][:, on_bins]
+    U = stokes[2][:, on_bins]
+    # Every on-pulse bin in one go. The FDF is linear so the sum over bins is the FDF of the summed profile
+    bin_fdfs = faraday_dispersion(Q, U, freqs, phis, weights=weights)
+    fdf = bin_fdfs.sum(axis=1)
+    peak = np.abs(fdf).argmax()
+    # Noise of the FDF from the off-pulse Q and U of each channel
+    off_bins = np.setdiff1d(np.arange(stokes.shape[2]), on_bins)
+    sigma_chan = 0.5 * (stokes[1][:, off_bins].std(axis=1) + stokes[2][:, off_bins].std(axis=1)) * np.sqrt(len(on_bins))
+    sigma_fdf = np.sqrt((weights ** 2 * sigma_chan ** 2).sum()) / weights.sum()
+    sn = np.abs(fdf[peak]) / sigma_fdf if sigma_fdf > 0 else np.inf
+    return {"rm": float(phis[peak]),
+            "rm_e": float(rmsf_fwhm(freqs[weights > 0]) / (2 * sn)),
+            "phis": phis,
+            "fdf": fdf,
+            "bin_rms": phis[np.abs(bin_fdfs).argmax(axis=0)]}
+
+
+def plot_fdf(result, filename):
+    """Plots the Faraday dispersion function"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(result["phis"], np.abs(result["fdf"]), color="k")
+    ax.axvline(result["rm"], linestyle="--", color="r")
+    ax.set_xlabel("Faraday depth (rad m$^{-2}$)")
+    ax.set_ylabel("|F($\\phi$)|")
+    ax.set_title(f"RM: {result['rm']:.3f} $\\pm$ {result['rm_e']:.3f}")
+    fig.savefig(filename, bbox_inches="tight")
+    plt.close(fig)
+
+
+def rm_synth_coarse_fine(archive, phase_range, coarse_range=(-300, 300), fine_width=10, phi_steps=10000, plot_name=None, period=None):
+    """
+    Finds the RM of the on-pulse region of an archive with a coarse RM synthesis followed by a fine one
+    about the coarse peak. The archive is read once and shared by both stages
+
+    Parameters:
+    -----------
+    archive: string
+        The pathname of the archive
+    phase_range: tuple
+        The (min, max) phase of the on-pulse region
+    coarse_range: tuple
+        The Faraday depth range of the coarse search. Default: (-300, 300)
+    fine_width: float
+        The fine search covers the coarse RM +/- fine_width. Default: 10
+    phi_steps: int
+        The number of Faraday depth trials of each stage. Default: 10000
+    plot_name: string
+        If supplied, the fine FDF is plotted to this file. Default: None
+    period: float
+        OPTIONAL - The folding period (s), passed to load_stokes()
+
+    Returns:
+    --------
+    result: dictionary
+        The fine stage result of rm_synthesis()
+    """
+    freqs, stokes, weights = load_stokes(archive, period=period)
+    nbin = stokes.shape[2]
+    phases = np.arange(nbin) / nbin
+    on_bins = np.where((phases >= phase_range[0]) & (phases <= phase_range[1]))[0]
+    off_bins = np.setdiff1d(np.arange(nbin), on_bins)
+    # Subtract the off-pulse baseline of each channel
+    stokes = stokes - stokes[:, :, off_bins].mean(axis=2, keepdims=True)
+    coarse = rm_synthesis(freqs, stokes, weights, on_bins, coarse_range, phi_steps)
+    logger.debug(f"Coarse RM: {coarse['rm']}")
+    fine = rm_synthesis(freqs, stokes, weights, on_bins, (coarse["rm"] - fine_width, coarse["rm"] + fine_width), phi_steps)
+    if plot_name:
+        plot_fdf(fine, plot_name)
+    return fine
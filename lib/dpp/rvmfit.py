@@ -0,0 +1,176 @@
+import os
+import logging
+import numpy as np
+from multiprocessing import get_context
+
+logger = logging.getLogger(__name__)
+
+# The number of (alpha, beta, l0, point) elements evaluated at once by each worker
+GRID_BLOCK = 2**22
+
+
+def read_paswing(paswing_file):
+    """
+    Reads the significant PA points of a PSRSALSA .paswing file
+
+    Returns:
+    --------
+    lon: numpy.array
+        The pulse longitudes (deg)
+    pa, pa_err: numpy.arrays
+        The position angles and their errors (deg)
+    """
+    paswing = np.atleast_2d(np.loadtxt(paswing_file))
+    lon = paswing[:, 1]
+    pa = paswing[:, -2]
+    pa_err = paswing[:, -1]
+    good = pa_err > 0 # Insignificant points have no error
+    return lon[good], pa[good], pa_err[good]
+
+
+def rvm_pa(alpha, beta, lon, l0):
+    """
+    The rotating vector model PA (deg) without the pa0 offset, in the convention used by PSRSALSA's ppolFit.
+    All arguments are in degrees and are broadcast against each other
+    """
+    alpha = np.deg2rad(alpha)
+    zeta = alpha + np.deg2rad(beta)
+    dl = np.deg2rad(lon - l0)
+    num = np.sin(alpha) * np.sin(dl)
+    den = np.sin(zeta) * np.cos(alpha) - np.cos(zeta) * np.sin(alpha) * np.cos(dl)
+    return np.rad2deg(np.arctan2(num, den))
+
+
+def _wrap(angle):
+    """Wraps PA differences (deg) to [-90, 90)"""
+    return (angle + 90.) % 180. - 90.
+
+
+def rvm_chi2(alpha, beta, l0, lon, pa, pa_err):
+    """
+    The chi^2 of the RVM at every (alpha, beta, l0) with pa0 minimised analytically as the weighted circular mean of the
+    residuals. alpha, beta and l0 are broadcast against each other, the data are broadcast along a new last axis
+
+    Returns:
+    --------
+    chi2, pa0: numpy.arrays
+        The chi^2 and best pa0 (deg) at every grid point
+    """
+    psi = rvm_pa(np.asarray(alpha)[..., None], np.asarray(beta)[..., None], lon, np.asarray(l0)[..., None])
+    weights = 1. / pa_err ** 2
+    diff = np.deg2rad(2 * (pa - psi))
+    pa0 = 0.5 * np.rad2deg(np.arctan2((weights * np.sin(diff)).sum(axis=-1), (weights * np.cos(diff)).sum(axis=-1)))
+    chi2 = ((_wrap(pa - psi - pa0[..., None]) / pa_err) ** 2).sum(axis=-1)
+    return chi2, pa0
+
+
+def _grid_chunk(args):
+    """Evaluates the chi^2 of a block of alphas over all betas and l0s, keeping the best l0 of each (alpha, beta)"""
+    alphas, betas, l0s, lon, pa, pa_err = args
+    # The l0s are done in blocks too, so a chunk never holds much more than GRID_BLOCK elements
+    step = max(1, GRID_BLOCK // (len(alphas) * len(betas) * len(lon)))
+    best_chi2 = None
+    for start in range(0, len(l0s), step):
+        block = l0s[start:start + step]
+        chi2, pa0 = rvm_chi2(alphas[:, None, None], betas[None, :, None], block[None, None, :], lon, pa, pa_err)
+        best = chi2.argmin(axis=2)
+        idx = np.indices(best.shape)
+        chi2, l0, pa0 = chi2[idx[0], idx[1], best], block[best], pa0[idx[0], idx[1], best]
+        if best_chi2 is None:
+            best_chi2, best_l0, best_pa0 = chi2, l0, pa0
+        else:
+            # Ties keep the earlier l0, as a single argmin would
+            better = chi2 < best_chi2
+            best_chi2 = np.where(better, chi2, best_chi2)
+            best_l0 = np.where(better, l0, best_l0)
+            best_pa0 = np.where(better, pa0, best_pa0)
+    return best_chi2, best_l0, best_pa0
+
+
+def rvm_grid(lon, pa, pa_err, alphas, betas, l0s, n_procs=1):
+    """
+    Evaluates the RVM chi^2 over an (alpha, beta, l0) grid, with the alphas split into chunks over a process pool
+
+    Returns:
+    --------
+    chi2, l0, pa0: numpy.arrays
+        (nalpha, nbeta) the chi^2 minimised over l0 and pa0, and the l0 and pa0 that minimise it
+    """
+    rows = max(1, min(GRID_BLOCK // (len(betas) * len(l0s) * len(lon)), -(-len(alphas) // n_procs)))
+    chunks = [(alphas[i:i + rows], betas, l0s, lon, pa, pa_err) for i in range(0, len(alphas), rows)]
+    if n_procs > 1 and len(chunks) > 1:
+        with get_context("fork").Pool(n_procs) as pool:
+            results = pool.map(_grid_chunk, chunks)
+    else:
+        results = [_grid_chunk(chunk) for chunk in chunks]
+    return tuple(np.concatenate(arrays, axis=0) for arrays in zip(*results))
+
+
+def refine(lon, pa, pa_err, alpha, beta, l0, steps=(1., 1., 1.), iterations=4, trials=11):
+    """Refines a grid minimum with successively smaller local (alpha, beta, l0) grids"""
+    steps = np.array(steps, dtype=np.float64)
+    for _ in range(iterations):
+        offsets = np.linspace(-1, 1, trials)
+        a = np.clip(alpha + offsets * steps[0], 0, 180)
+        b = beta + offsets * steps[1]
+        l = l0 + offsets * steps[2]
+        chi2, _ = rvm_chi2(a[:, None, None], b[None, :, None], l[None, None, :], lon, pa, pa_err)
+        i, j, k = np.unravel_index(chi2.argmin(), chi2.shape)
+        alpha, beta, l0 = a[i], b[j], l[k]
+        steps *= 2. / (trials - 1)
+    chi2, pa0 = rvm_chi2(alpha, beta, l0, lon, pa, pa_err)
+    return float(alpha), float(beta), float(l0), float(pa0), float(chi2)
+
+
+def rvm_fit(paswing_file, alpha_range=(0, 180), beta_range=(-30, 30), l0_range=None, l0_step=1., trials=200, n_procs=None):
+    """
+    Fits the RVM to a PSRSALSA .paswing file with a grid search followed by a local refinement
+
+    Parameters:
+    -----------
+    paswing_file: string
+        The pathname of the .paswing file
+    alpha_range, beta_range: tuples
+        The (min, max) of the alpha and beta grids (deg)
+    l0_range: tuple
+        The (min, max) of the l0 search (deg). Default: the longitude range of the PA points
+    l0_step: float
+        The l0 step (deg). Default: 1
+    trials: int
+        The number of alpha and beta grid points. Default: 200
+    n_procs: int
+        The number of processes to spread the grid over. Default: the number of available cpus
+
+    Returns:
+    --------
+    fit: dictionary
+        'alpha', 'beta', 'l0', 'pa0', 'chi' (reduced chi^2) and 'chi_map', 'alphas', 'betas' for plot_rvm_chi_map()
+    """
+    lon, pa, pa_err = read_paswing(paswing_file)
+    dof = len(lon) - 4
+    if dof < 1:
+        raise ValueError(f"Not enough PA points to fit the RVM: {paswing_file}")
+    if l0_range is None:
+        l0_range = (lon.min(), lon.max())
+    if n_procs is None:
+        n_procs = len(os.sched_getaffinity(0))
+    alphas = np.linspace(*alpha_range, trials)
+    betas = np.linspace(*beta_range, trials)
+    l0s = np.arange(l0_range[0], l0_range[1] + l0_step / 2, l0_step)
+    chi_map, l0_map, _ = rvm_grid(lon, pa, pa_err, alphas, betas, l0s, n_procs=n_procs)
+    i, j = np.unravel_index(chi_map.argmin(), chi_map.shape)
+    steps = (alphas[1] - alphas[0], betas[1] - betas[0], l0_step)
+    alpha, beta, l0, pa0, chi2 = refine(lon, pa, pa_err, alphas[i], betas[j], l0_map[i, j], steps=steps)
+    logger.debug(f"RVM fit: alpha={alpha} beta={beta} l0={l0} pa0={pa0} chi^2={chi2}")
+    return {"alpha": alpha, "beta": beta, "l0": l0, "pa0": pa0, "chi": chi2 / dof,
+            "chi_map": chi_map.T / dof, "alphas": alphas, "betas": betas}
+
+
+def write_rvm_fit(fit, outfile):
+    """Writes the best fit in the same layout as ppolFit's output so read_RVM_fit() can read it"""
+    with open(outfile, "w") as f:
+        f.write(f"alpha = {fit['alpha']} deg\n")
+        f.write(f"beta  = {fit['beta']} deg\n")
+        f.write(f"l0    = {fit['l0']} deg\n")
+        f.write(f"pa0   = {fit['pa0']} deg\n")
+        f.write(f"Reduced chi^2={fit['chi']}\n")
@@ -0,0 +1,223 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+from functools import lru_cache
+from os.path import join, exists, expanduser
+
+from mwa_search.sky_coverage import power_reductions
+
+import logging
+logger = logging.getLogger(__name__)
+
+BEAM_CACHE_DIR = os.environ.get("MWA_SEARCH_BEAM_CACHE", join(expanduser("~"), ".cache", "mwa_search", "beam_maps"))
+# The cache is trimmed to this size (GB) by removing the least recently used maps
+BEAM_CACHE_MAX_GB = float(os.environ.get("MWA_SEARCH_BEAM_CACHE_MAX_GB", 20.))
+# The largest separation (deg) between a map's pointing and the one asked for by find_beam_map()
+POINTING_TOLERANCE = 2.
+
+
+@lru_cache(maxsize=1)
+def beam_model_version():
+    """The versions of the packages that calculate the tile beam, so that a new beam model invalidates the cache"""
+    from importlib.metadata import version, PackageNotFoundError
+    versions = []
+    for package in ("mwa_pb", "vcstools"):
+        try:
+            versions.append(f"{package}{version(package)}")
+        except PackageNotFoundError:
+            versions.append(f"{package}unknown")
+    return "_".join(versions).replace(os.sep, "-")
+
+
+def grid_tag(res):
+    """The tag of maps made on the regular sky grid of sky_coverage.sky_grid()"""
+    return f"res{res}"
+
+
+def positions_tag(names_ra_dec):
+    """A tag for maps of any other set of positions"""
+    positions = np.asarray(names_ra_dec)[:, 1:].astype(np.float64)
+    return "pos" + hashlib.md5(positions.tobytes()).hexdigest()[:12]
+
+
+def cache_path(obs_metadata, tag, dt, kind, cache_dir=BEAM_CACHE_DIR):
+    """
+    The pathname of a beam map. Maps are keyed by obsid, positions tag, dt and beam model version, plus a hash
+    of the observation's metadata because planned observations re-use obsids with different pointings
+
+    Parameters:
+    -----------
+    obs_metadata: list
+        [obsid, ra, dec, duration, delays, centrefreq, channels] as passed to get_beam_power_over_time()
+    tag: string
+        The positions tag from grid_tag() or positions_tag()
+    dt: int
+        The time step (s) of the beam calculation, or None for get_beam_power_over_time()'s default
+    kind: string
+        'power' for the (npositions, ntimes, nfreqs) power or 'reduced' for its (2, npositions) max and sum over time
+    """
+    meta_hash = hashlib.md5(repr([str(m) for m in obs_metadata[1:]]).encode("utf-8")).hexdigest()[:8]
+    return join(cache_dir, f"{obs_metadata[0]}_{tag}_dt{dt}_{beam_model_version()}_{meta_hash}_{kind}.npy")
+
+
+def pointing_path(path):
+    """The pathname of the file that records the pointing of a map"""
+    return f"{os.path.splitext(path)[0]}.json"
+
+
+def map_token(path):
+    """
+    Returns a string that identifies the contents of a cached map. Reads update a map's modification time for the
+    eviction order, so this uses the pathname (which holds the metadata hash and beam model version), size and inode.
+    Maps are only ever written through a rename, so a rewritten map has a new inode
+    """
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_ino}"
+
+
+def _touch(path):
+    """Marks a map as recently used for the eviction order"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _save(path, array):
+    """Saves through a temporary file so that concurrent readers never load a partial map"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _save_pointing(path, obs_metadata):
+    """Records the pointing of a map so find_beam_map() can tell maps of re-used obsids apart"""
+    tmp_path = f"{pointing_path(path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"obsid": str(obs_metadata[0]), "ra": float(obs_metadata[1]), "dec": float(obs_metadata[2])}, f)
+    os.replace(tmp_path, pointing_path(path))
+
+
+def separation(ra1, dec1, ra2, dec2):
+    """The angular separation (deg) of two positions (deg)"""
+    ra1, dec1, ra2, dec2 = np.deg2rad([ra1, dec1, ra2, dec2])
+    hav = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return float(np.rad2deg(2 * np.arcsin(np.sqrt(np.clip(hav, 0., 1.)))))
+
+
+def evict(cache_dir=BEAM_CACHE_DIR, max_gb=BEAM_CACHE_MAX_GB):
+    """
+    Removes the least recently used maps until the cache is smaller than max_gb
+
+    Returns:
+    --------
+    removed: list
+        The pathnames of the removed maps
+    """
+    maps = []
+    for path in glob.glob(join(cache_dir, "*.npy")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError: # removed by another process
+            continue
+        maps.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in maps)
+    removed = []
+    for _, size, path in sorted(maps):
+        if total <= max_gb * 1e9:
+            break
+        for remove_path in (path, pointing_path(path)):
+            try:
+                os.remove(remove_path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed.append(path)
+    if removed:
+        logger.debug(f"Evicted {len(removed)} beam maps from {cache_dir}")
+    return removed
+
+
+def find_beam_map(obsid, ra, dec, tag, dt=600, kind="reduced", cache_dir=BEAM_CACHE_DIR, tolerance=POINTING_TOLERANCE):
+    """
+    Finds the most recent map of an obsid pointed within tolerance (deg) of ra, dec (deg), for plots that only know
+    the pointing of an observation and not the rest of its metadata. Planned observations re-use obsids with
+    different pointings, so maps are matched on the pointing recorded with them by get_beam_map()
+
+    Returns:
+    --------
+    beam_map: numpy.memmap
+        The memory mapped map or None if there isn't one
+    """
+    paths = []
+    for path in glob.glob(join(cache_dir, f"{obsid}_{tag}_dt{dt}_{beam_model_version()}_*_{kind}.npy")):
+        try:
+            paths.append((os.path.getmtime(path), path))
+        except FileNotFoundError: # removed by another process
+            continue
+    for _, path in sorted(paths, reverse=True):
+        try:
+            with open(pointing_path(path)) as f:
+                pointing = json.load(f)
+        except (OSError, ValueError): # Maps made before pointings were recorded can't be matched
+            continue
+        if separation(pointing["ra"], pointing["dec"], ra, dec) <= tolerance:
+            _touch(path)
+            return np.load(path, mmap_mode="r")
+    return None
+
+
+def get_beam_map(obs_metadata, names_ra_dec, dt=600, tag=None, reduce=False, cache_dir=BEAM_CACHE_DIR,
+                 max_gb=BEAM_CACHE_MAX_GB, degrees=True, lut=False):
+    """
+    Returns the beam power of an observation from the cache, calculating and caching it if it isn't there
+
+    Parameters:
+    -----------
+    obs_metadata: list
+        [obsid, ra, dec, duration, delays, centrefreq, channels]
+    names_ra_dec: numpy.array
+        [[name, ra, dec]] of the positions
+    dt: int
+        The time step (s). If None, get_beam_power_over_time()'s default is used. Default: 600
+    tag: string
+        The positions tag. Default: positions_tag(names_ra_dec)
+    reduce: boolean
+        If True, only the (2, npositions) max and sum over time are cached and returned. Default: False
+    lut: boolean
+        If True, the beam is interpolated from a lookup table (see beam_lut) instead of the analytic
+        model. Default: False
+
+    Returns:
+    --------
+    beam_map: numpy.memmap
+        (npositions, ntimes, nfreqs) power or, if reduce, (2, npositions) max and summed power
+    """
+    if tag is None:
+        tag = positions_tag(names_ra_dec)
+    if lut:
+        tag = f"{tag}_lut"
+    path = cache_path(obs_metadata, tag, dt, "reduced" if reduce else "power", cache_dir=cache_dir)
+    if exists(path):
+        _touch(path)
+        if not exists(pointing_path(path)): # Cached before pointings were recorded
+            _save_pointing(path, obs_metadata)
+        return np.load(path, mmap_mode="r")
+    if lut:
+        from mwa_search.beam_lut import beam_power_over_time as get_beam_power_over_time
+    else:
+        from vcstools.beam_calc import get_beam_power_over_time
+    logger.debug(f"Calculating the beam power of {obs_metadata[0]} for {path}")
+    dt_kwargs = {} if dt is None else {"dt": dt}
+    power = get_beam_power_over_time(obs_metadata, names_ra_dec, degrees=degrees, **dt_kwargs)
+    if reduce:
+        max_power, sum_power, _ = power_reductions(power, np.zeros(len(power)))
+        power = np.stack([max_power, sum_power])
+    _save(path, power)
+    _save_pointing(path, obs_metadata)
+    evict(cache_dir=cache_dir, max_gb=max_gb)
+    return np.load(path, mmap_mode="r") if exists(path) else power
@@ -0,0 +1,179 @@
+import os
+import hashlib
+import numpy as np
+from functools import lru_cache
+from os.path import join, exists, expanduser
+
+from mwa_search.beam_cache import beam_model_version
+
+import logging
+logger = logging.getLogger(__name__)
+
+BEAM_LUT_DIR = os.environ.get("MWA_SEARCH_BEAM_LUT", join(expanduser("~"), ".cache", "mwa_search", "beam_luts"))
+# The largest error (in normalised power) allowed between the interpolated and analytic beam
+BEAM_LUT_TOLERANCE = 1e-3
+
+# The MWA's location (deg)
+MWA_LAT = -26.703319
+MWA_LON = 116.67081
+
+
+def tile_beam_power(za, az, freq, delays):
+    """
+    The analytic tile beam power, the mean of the XX and YY powers normalised at zenith
+
+    Parameters:
+    -----------
+    za, az: numpy.arrays
+        The zenith angle and azimuth (rad)
+    freq: float
+        The frequency (Hz)
+    delays: list
+        The 16 dipole delays, or [xdelays, ydelays]
+    """
+    from mwa_pb import primary_beam
+    delays = np.atleast_2d(np.asarray(delays, dtype=np.float64))
+    if len(delays) == 1:
+        delays = np.repeat(delays, 2, axis=0)
+    rX, rY = primary_beam.MWA_Tile_analytic(za, az, freq=freq, delays=delays, zenithnorm=True, power=True)
+    return 0.5 * (np.asarray(rX) + np.asarray(rY))
+
+
+def lut_path(delays, freq, lut_dir=BEAM_LUT_DIR):
+    """The pathname of the lookup table of a delay setting and frequency (Hz)"""
+    delay_hash = hashlib.md5(np.asarray(delays, dtype=np.int64).tobytes()).hexdigest()[:12]
+    return join(lut_dir, f"beam_{delay_hash}_{int(round(freq))}Hz_{beam_model_version()}.npz")
+
+
+def _bilinear(power, res, az, za):
+    """Interpolates a (naz + 1, nza + 1) table with res (deg) cells at az, za (deg). Beyond the horizon is 0"""
+    az = np.mod(az, 360.) / res
+    za = np.asarray(za, dtype=np.float64) / res
+    n_za = power.shape[1] - 1
+    below = za > n_za
+    za = np.clip(za, 0., n_za)
+    i_az = np.minimum(az.astype(np.int64), power.shape[0] - 2)
+    i_za = np.minimum(za.astype(np.int64), n_za - 1)
+    f_az = az - i_az
+    f_za = za - i_za
+    interp = (power[i_az, i_za] * (1 - f_az) * (1 - f_za) + power[i_az + 1, i_za] * f_az * (1 - f_za) +
+              power[i_az, i_za + 1] * (1 - f_az) * f_za + power[i_az + 1, i_za + 1] * f_az * f_za)
+    return np.where(below, 0., interp)
+
+
+def build_lut(delays, freq, res=1., tolerance=BEAM_LUT_TOLERANCE, min_res=0.125):
+    """
+    Tabulates the tile beam on an (az, za) grid. The grid is halved until the largest interpolation error at
+    the cell centres is below tolerance (or the resolution reaches min_res)
+
+    Returns:
+    --------
+    lut: dict
+        power: (naz + 1, nza + 1) float32 power, az from 0 to 360 and za from 0 to 90 deg
+        res: the grid resolution (deg)
+        max_error: the largest interpolation error found at the cell centres
+    """
+    while True:
+        az = np.arange(0., 360. + res/2, res)
+        za = np.arange(0., 90. + res/2, res)
+        az_grid, za_grid = np.meshgrid(az, za, indexing="ij")
+        power = tile_beam_power(np.radians(za_grid), np.radians(az_grid), freq, delays).reshape(az_grid.shape)
+        power = power.astype(np.float32)
+        # Compare against the beam where the interpolation is worst, halfway between the grid points
+        az_mid, za_mid = np.meshgrid(az[:-1] + res/2, za[:-1] + res/2, indexing="ij")
+        exact = tile_beam_power(np.radians(za_mid), np.radians(az_mid), freq, delays).reshape(az_mid.shape)
+        max_error = float(np.max(np.abs(_bilinear(power, res, az_mid, za_mid) - exact)))
+        logger.debug(f"Beam lookup table at {res} deg has a max error of {max_error:.2e}")
+        if max_error <= tolerance or res / 2 < min_res:
+            break
+        res /= 2
+    if max_error > tolerance:
+        logger.warning(f"The beam lookup table's max error {max_error:.2e} is above the tolerance {tolerance:.2e}")
+    return {"power": power, "res": res, "max_error": max_error}
+
+
+@lru_cache(maxsize=16)
+def _load_lut(path):
+    with np.load(path) as data:
+        return {"power": data["power"], "res": float(data["res"]), "max_error": float(data["max_error"])}
+
+
+def get_lut(delays, freq, lut_dir=BEAM_LUT_DIR, **kwargs):
+    """
+    Returns the lookup table of a delay setting and frequency (Hz), building and saving it (compressed) if it
+    isn't on disk. The keyword arguments are passed to build_lut()
+    """
+    delays = np.atleast_2d(np.asarray(delays, dtype=np.int64))
+    if len(delays) == 2 and np.array_equal(delays[0], delays[1]):
+        delays = delays[:1]
+    path = lut_path(delays, freq, lut_dir=lut_dir)
+    if not exists(path):
+        logger.info(f"Building the beam lookup table {path}")
+        lut = build_lut(delays, freq, **kwargs)
+        os.makedirs(lut_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **lut)
+        os.replace(tmp_path, path)
+    return _load_lut(path)
+
+
+def lut_power(lut, az, za):
+    """The interpolated beam power at az, za (deg)"""
+    return _bilinear(lut["power"], lut["res"], np.asarray(az, dtype=np.float64), za)
+
+
+def radec_to_azza(ra, dec, gps_times):
+    """
+    Converts RAs and Decs (deg, J2000) to azimuths and zenith angles (deg) at the MWA for many times at once.
+    The positions are precessed to the observation's epoch once, then the local sidereal time is used for
+    each time step, ignoring refraction
+
+    Returns:
+    --------
+    az, za: numpy.arrays
+        (npositions, ntimes) azimuth (east of north) and zenith angle
+    """
+    from astropy.time import Time
+    from astropy.coordinates import SkyCoord, FK5
+    import astropy.units as u
+    times = Time(np.asarray(gps_times, dtype=np.float64), format="gps", scale="utc")
+    coords = SkyCoord(ra, dec, unit=(u.deg, u.deg), frame="icrs").transform_to(FK5(equinox=times[len(times)//2]))
+    ra = coords.ra.rad[:, None]
+    dec = coords.dec.rad[:, None]
+    lst = times.sidereal_time("apparent", longitude=MWA_LON * u.deg).rad[None, :]
+    ha = lst - ra
+    lat = np.radians(MWA_LAT)
+    sin_alt = np.sin(dec) * np.sin(lat) + np.cos(dec) * np.cos(lat) * np.cos(ha)
+    alt = np.arcsin(np.clip(sin_alt, -1., 1.))
+    az = np.arctan2(-np.cos(dec) * np.sin(ha), np.sin(dec) * np.cos(lat) - np.cos(dec) * np.sin(lat) * np.cos(ha))
+    return np.mod(np.degrees(az), 360.), 90. - np.degrees(alt)
+
+
+def beam_power_over_time(obs_metadata, names_ra_dec, dt=296, degrees=False, start_time=0, lut_dir=BEAM_LUT_DIR,
+                         **kwargs):
+    """
+    A lookup table version of vcstools.beam_calc.get_beam_power_over_time() with the same arguments, time steps
+    (the middle of each dt) and output. The keyword arguments are passed to build_lut()
+
+    Returns:
+    --------
+    power: numpy.array
+        (npositions, ntimes, 1) beam power at the centre frequency
+    """
+    obsid, _, _, time, delays, centrefreq, _ = obs_metadata
+    names_ra_dec = np.asarray(names_ra_dec)
+    if degrees:
+        ras = names_ra_dec[:, 1].astype(np.float64)
+        decs = names_ra_dec[:, 2].astype(np.float64)
+    else:
+        from astropy.coordinates import SkyCoord
+        import astropy.units as u
+        coords = SkyCoord(names_ra_dec[:, 1], names_ra_dec[:, 2], unit=(u.hourangle, u.deg))
+        ras, decs = coords.ra.deg, coords.dec.deg
+    starttimes = np.arange(start_time, time + start_time, dt)
+    stoptimes = np.minimum(starttimes + dt, time + start_time)
+    midtimes = float(obsid) + 0.5 * (starttimes + stoptimes)
+    lut = get_lut(delays, float(centrefreq) * 1e6, lut_dir=lut_dir, **kwargs)
+    az, za = radec_to_azza(ras, decs, midtimes)
+    return lut_power(lut, az, za)[:, :, None]
@@ -0,0 +1,103 @@
+import re
+import glob
+import logging
+from os.path import join, basename
+
+logger = logging.getLogger(__name__)
+
+# Pointings are of the form HH:MM:SS.SS_+DD:MM:SS.SS
+POINTING_RE = re.compile(r"\d{2}:\d{2}:\d{2}(?:\.\d+)?_[+-]?\d{2}:\d{2}:\d{2}(?:\.\d+)?")
+
+
+def find_classifier_files(directory=".", prefix="feature_extraction"):
+    """
+    Finds the LOTAAS classifier output files in a directory
+
+    Returns:
+    --------
+    classifier_files: list
+        (pathname, model, is_positive) for each file. The model is the integer after '_m' in the file name,
+        or 0 for a file without a model number
+    """
+    file_re = re.compile(rf"^{re.escape(prefix)}(?:_m(\d+))?\.(positive|negative)$")
+    classifier_files = []
+    for pathname in sorted(glob.glob(join(directory, f"{prefix}*"))):
+        match = file_re.match(basename(pathname))
+        if match:
+            classifier_files.append((pathname, int(match.group(1) or 0), match.group(2) == "positive"))
+    return classifier_files
+
+
+def aggregate_votes(classifier_files):
+    """
+    Streams every classifier output file once and collects the votes of each model for each candidate
+
+    Parameters:
+    -----------
+    classifier_files: list
+        (pathname, model, is_positive) as returned by find_classifier_files()
+
+    Returns:
+    --------
+    models: list
+        The model numbers in the order of the vote vectors
+    votes: dictionary
+        candidate: vote vector with 1 for a positive, 0 for a negative and -1 where the model gave no vote
+    """
+    models = sorted({model for _, model, _ in classifier_files})
+    model_idx = {model: i for i, model in enumerate(models)}
+    votes = {}
+    for pathname, model, is_positive in classifier_files:
+        col = model_idx[model]
+        with open(pathname, "r") as f:
+            for line in f:
+                cand = line.strip()
+                if not cand:
+                    continue
+                vector = votes.get(cand)
+                if vector is None:
+                    vector = votes[cand] = [-1] * len(models)
+                vector[col] = int(is_positive)
+    logger.debug(f"Votes of {len(models)} models collected for {len(votes)} candidates")
+    return models, votes
+
+
+def positive_votes(vector):
+    """The number of models that classified the candidate as positive"""
+    return sum(vote == 1 for vote in vector)
+
+
+def split_votes(votes, min_votes=3):
+    """
+    Splits the candidates into those with at least min_votes positive classifications and the rest
+
+    Returns:
+    --------
+    positive, negative: lists
+        The candidates
+    """
+    positive = []
+    negative = []
+    for cand, vector in votes.items():
+        if positive_votes(vector) >= min_votes:
+            positive.append(cand)
+        else:
+            negative.append(cand)
+    return positive, negative
+
+
+def pointing_votes(votes):
+    """
+    Counts the positive classifications of every pointing, taking the pointing from each candidate name
+
+    Returns:
+    --------
+    counts: dictionary
+        pointing: the total number of positive votes of all of the pointing's candidates
+    """
+    counts = {}
+    for cand, vector in votes.items():
+        match = POINTING_RE.search(cand)
+        if match:
+            counts[match.group()] = counts.get(match.group(), 0) + positive_votes(vector)
+    return counts
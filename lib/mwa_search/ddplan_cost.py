@@ -0,0 +1,287 @@
+import itertools
+import numpy as np
+
+from mwa_search.dispersion_tools import dd_plan, trial_sensitivity, subband_smear, SENSITIVITY_PERIODS
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Rough single core costs (s) per time sample of the search_dd_fft_acc steps. They are scaled so that a
+# downsample 1 DM trial of a 4800 s observation costs about the 0.006 * 5 * obs_length s per trial and a job
+# about the 5 * obs_length s overhead of the pipeline's job time estimate
+SUBBAND_COST = 1.6e-7 # prepsubband, forming the subbands (per channel)
+DEDISP_COST = 2e-8    # prepsubband, dedispersing the subbands (per subband)
+FFT_COST = 1e-8       # realfft (per log2(nsamples))
+ACCEL_COST = 1.5e-6   # accelsearch with zmax = 0
+# accelsearch's cost grows by a factor of (1 + zmax / ACCEL_ZMAX_SCALE)
+ACCEL_ZMAX_SCALE = 33.
+
+# The search space of optimise_dd_plan()
+SMEAR_FACTS = (1., 1.5, 2., 2.5, 3., 3.5, 4., 4.5, 5., 5.5, 6.)
+BREAKPOINT_FACTS = (1.5, 2., 3., 4., 6.)
+NSUB_TIME_RESS = (0.05, 0.1, 0.2, 0.4)
+
+
+def trial_cost(obs_length, timeres, downsample, nsub, zmax=0):
+    """
+    The predicted CPU time (s) of searching one DM trial
+
+    Parameters
+    ----------
+    obs_length: float
+        The observation duration in s
+    timeres: float
+        The native time resolution in ms
+    downsample: int or numpy.array
+        The downsampling factor
+    nsub: int or numpy.array
+        The number of subbands
+    zmax: int
+        accelsearch's zmax
+    """
+    nsamples = obs_length * 1000. / timeres / np.asarray(downsample, dtype=np.float64)
+    return nsamples * (DEDISP_COST * np.asarray(nsub) + FFT_COST * np.log2(nsamples) +
+                       ACCEL_COST * (1. + zmax / ACCEL_ZMAX_SCALE))
+
+
+def job_overhead(obs_length, timeres, nfreqchan):
+    """The predicted CPU time (s) of a job that doesn't depend on the number of DM trials"""
+    return SUBBAND_COST * nfreqchan * obs_length * 1000. / timeres
+
+
+def plan_cost(DD_plan_array, obs_length, timeres, nfreqchan, zmax=0):
+    """
+    The predicted CPU time (s) of each row of a dedispersion plan, with each row run as one job
+
+    Parameters
+    ----------
+    DD_plan_array: list list
+        [[low_DM, high_DM, DM_step, nDM_step, timeres, downsample, nsub]] from dd_plan()
+    obs_length: float
+        The observation duration in s
+    timeres: float
+        The native time resolution in ms
+    nfreqchan: int
+        The number of frequency channels
+    """
+    plan = np.asarray(DD_plan_array, dtype=np.float64).reshape(-1, 7)
+    return job_overhead(obs_length, timeres, nfreqchan) + \
+           plan[:, 3] * trial_cost(obs_length, timeres, plan[:, 5], plan[:, 6], zmax=zmax)
+
+
+def plan_sensitivity(DD_plan_array, dms, time, centrefreq, freqres, bandwidth, periods=SENSITIVITY_PERIODS):
+    """
+    The sensitivity of a dedispersion plan at any DMs, from the row that covers each DM. Unlike
+    dispersion_tools.sensitivity_curve() this includes the smearing within subbands and can be compared
+    between plans with different DM trials
+
+    Returns
+    -------
+    sensitivities: numpy.array
+        (nperiods, ndms) the 10 sigma detection sensitivity in mJy
+    """
+    plan = np.asarray(DD_plan_array, dtype=np.float64).reshape(-1, 7)
+    row = np.clip(np.searchsorted(plan[:, 0], dms, side="right") - 1, 0, len(plan) - 1)
+    return trial_sensitivity(dms, plan[row, 2], plan[row, 4], time, centrefreq, freqres, bandwidth, periods=periods,
+                             extra_smear=subband_smear(centrefreq, plan[row, 1], plan[row, 6]))
+
+
+def plan_loss(DD_plan_array, lowDM, highDM, time, centrefreq, freqres, bandwidth, timeres,
+              periods=SENSITIVITY_PERIODS, n_dms=512):
+    """
+    The sensitivity loss of a dedispersion plan compared to searching every DM at the native time resolution.
+    For each period this is the geometric mean of the ratio of the sensitivities over DM, minus 1, ignoring DMs
+    where even the ideal search is smeared over the whole period
+
+    Returns
+    -------
+    loss: numpy.array
+        (nperiods) the fractional loss of each period
+    """
+    dms = np.linspace(lowDM, highDM, n_dms)
+    plan_sens = plan_sensitivity(DD_plan_array, dms, time, centrefreq, freqres, bandwidth, periods=periods)
+    ideal_sens = trial_sensitivity(dms, 0., timeres, time, centrefreq, freqres, bandwidth, periods=periods)
+    detectable = ideal_sens < 1000.
+    log_ratio = np.where(detectable, np.log(plan_sens / ideal_sens), 0.)
+    with np.errstate(invalid="ignore"):
+        return np.exp(log_ratio.sum(axis=1) / detectable.sum(axis=1)) - 1.
+
+
+def optimise_dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM, obs_length=4800, zmax=0,
+                     max_loss=None, min_DM_step=0.02, max_DM_step=500.0, max_dms_per_job=5000,
+                     periods=SENSITIVITY_PERIODS):
+    """
+    Searches dd_plan()'s smear factor, downsample breakpoints and number of subbands for the plan with the
+    lowest predicted CPU time that stays within a sensitivity loss budget
+
+    Parameters
+    ----------
+    centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM, min_DM_step, max_DM_step, max_dms_per_job:
+        As for dd_plan()
+    obs_length: float
+        The observation duration in s
+    zmax: int
+        accelsearch's zmax
+    max_loss: float or list
+        The largest plan_loss() allowed for all periods, or for each period. Default: the loss of the default
+        dd_plan(), so the optimised plan is never less sensitive than it
+
+    Returns
+    -------
+    result: dict
+        plan: the optimised DD_plan_array
+        cpu_hours: its predicted CPU hours
+        loss: its plan_loss() of each period
+        smear_fact, breakpoint_fact, nsub_time_res: the dd_plan() arguments that made it
+        default_cpu_hours, default_loss: the same for the default dd_plan()
+    """
+    freqres = bandwidth / float(nfreqchan)
+
+    def evaluate(**kwargs):
+        plan = dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM, min_DM_step=min_DM_step,
+                       max_DM_step=max_DM_step, max_dms_per_job=max_dms_per_job, **kwargs)
+        cost = plan_cost(plan, obs_length, timeres, nfreqchan, zmax=zmax).sum() / 3600.
+        loss = plan_loss(plan, lowDM, highDM, obs_length, centrefreq, freqres, bandwidth, timeres, periods=periods)
+        return plan, cost, loss
+
+    def within(loss):
+        # NaN losses (periods that can't be detected at any DM) are within any budget
+        return np.all((loss <= budget + 1e-9) | np.isnan(loss))
+
+    default_plan, default_cost, default_loss = evaluate()
+    budget = default_loss if max_loss is None else np.broadcast_to(max_loss, default_loss.shape)
+
+    best = None
+    if within(default_loss):
+        best = {"plan": default_plan, "cpu_hours": default_cost, "loss": default_loss,
+                "smear_fact": 3., "breakpoint_fact": 3., "nsub_time_res": 0.1}
+    for smear_fact, breakpoint_fact, nsub_time_res in itertools.product(SMEAR_FACTS, BREAKPOINT_FACTS,
+                                                                         NSUB_TIME_RESS):
+        plan, cost, loss = evaluate(smear_fact=smear_fact, breakpoint_fact=breakpoint_fact,
+                                    nsub_time_res=nsub_time_res)
+        if within(loss) and (best is None or cost < best["cpu_hours"]):
+            best = {"plan": plan, "cpu_hours": cost, "loss": loss, "smear_fact": smear_fact,
+                    "breakpoint_fact": breakpoint_fact, "nsub_time_res": nsub_time_res}
+    if best is None:
+        raise ValueError(f"No dedispersion plan has a sensitivity loss within {max_loss}")
+    logger.debug(f"Optimised DD plan: {best['cpu_hours']:.1f} CPU hours, default: {default_cost:.1f}")
+    best["default_cpu_hours"] = default_cost
+    best["default_loss"] = default_loss
+    return best
+
+
+def _coalesce_rows(DD_plan_array):
+    """Merges neighbouring rows that only differ in their DM range, e.g. those split by max_dms_per_job"""
+    rows = []
+    for row in DD_plan_array:
+        row = list(row)
+        if rows and rows[-1][2:3] + rows[-1][4:] == row[2:3] + row[4:] and abs(rows[-1][1] - row[0]) < 1e-6:
+            rows[-1][1] = row[1]
+            rows[-1][3] += row[3]
+        else:
+            rows.append(row)
+    return rows
+
+
+def _min_jobs(rows, max_dms_per_job=None):
+    """The fewest jobs rows can be split into without a job having more than max_dms_per_job DM trials"""
+    if not max_dms_per_job:
+        return len(rows)
+    return sum(max(1, -(-int(row[3]) // max_dms_per_job)) for row in rows)
+
+
+def _split_rows(rows, max_cost, overhead, trial_costs, max_dms_per_job=None):
+    """
+    Splits rows into as few equal jobs as keeps each below max_cost and max_dms_per_job DM trials
+    (rows of a single trial can't be split)
+    """
+    jobs = []
+    for row, cost in zip(rows, trial_costs):
+        low_DM, high_DM, DM_step, nDM_step = row[:4]
+        trials_per_job = max(1, int((max_cost - overhead) // cost)) if max_cost > overhead else 1
+        if max_dms_per_job:
+            trials_per_job = min(trials_per_job, max_dms_per_job)
+        n_jobs = max(1, -(-nDM_step // trials_per_job))
+        sizes = [nDM_step // n_jobs + (1 if i < nDM_step % n_jobs else 0) for i in range(n_jobs)]
+        start = 0
+        for i, size in enumerate(sizes):
+            job_low = round(low_DM + start * DM_step, 6)
+            job_high = high_DM if i == n_jobs - 1 else round(low_DM + (start + size) * DM_step, 6)
+            jobs.append([job_low, job_high, DM_step, size] + row[4:])
+            start += size
+    return jobs
+
+
+def makespan(job_costs, n_workers=None):
+    """
+    The predicted time until the last job finishes when the jobs are run, longest first, on n_workers (all at
+    once if None)
+    """
+    job_costs = sorted(job_costs, reverse=True)
+    if not job_costs:
+        return 0.
+    if n_workers is None or n_workers >= len(job_costs):
+        return job_costs[0]
+    workers = np.zeros(n_workers)
+    for cost in job_costs:
+        workers[np.argmin(workers)] += cost
+    return workers.max()
+
+
+def partition_dd_plan(DD_plan_array, obs_length, timeres, nfreqchan, zmax=0, n_jobs=None, max_job_hours=None,
+                      max_dms_per_job=None):
+    """
+    Splits and merges the rows of a dedispersion plan into jobs of roughly equal predicted cost (see plan_cost()),
+    so that no job in a group of DM jobs is much longer than the others. Each job is a row in dd_plan()'s format
+
+    Parameters
+    ----------
+    DD_plan_array: list list
+        The dedispersion plan from dd_plan()
+    obs_length: float
+        The observation duration in s
+    timeres: float
+        The native time resolution in ms
+    nfreqchan: int
+        The number of frequency channels
+    zmax: int
+        accelsearch's zmax
+    n_jobs: int
+        The most jobs to make. The longest job is made as short as possible within this. The search pipeline
+        groups a candidate's jobs by this number, so a ValueError is raised if the plan needs more jobs
+    max_job_hours: float
+        The longest a job should be predicted to take, if n_jobs isn't given
+    max_dms_per_job: int
+        The most DM trials in any job, as for dd_plan(). Default: no limit
+
+    Returns
+    -------
+    jobs: list list
+        [[low_DM, high_DM, DM_step, nDM_step, timeres, downsample, nsub]] of each job
+    job_hours: numpy.array
+        The predicted CPU hours of each job
+    """
+    rows = _coalesce_rows(DD_plan_array)
+    overhead = job_overhead(obs_length, timeres, nfreqchan)
+    trial_costs = [float(trial_cost(obs_length, timeres, row[5], row[6], zmax=zmax)) for row in rows]
+    if n_jobs is not None:
+        min_jobs = _min_jobs(rows, max_dms_per_job=max_dms_per_job)
+        if n_jobs < min_jobs:
+            limit = f"with at most {max_dms_per_job} DM trials per job" if max_dms_per_job else "(one per row)"
+            raise ValueError(f"{n_jobs} jobs are too few for this plan, which needs at least {min_jobs} {limit}")
+        # Bisect the longest job cost down to where one more split would need more than n_jobs
+        low_cost = max(overhead + cost for cost in trial_costs)
+        high_cost = float(plan_cost(rows, obs_length, timeres, nfreqchan, zmax=zmax).max()) * (1 + 1e-9)
+        while high_cost - low_cost > 1e-3 * high_cost:
+            max_cost = (low_cost + high_cost) / 2
+            if len(_split_rows(rows, max_cost, overhead, trial_costs, max_dms_per_job=max_dms_per_job)) > n_jobs:
+                low_cost = max_cost
+            else:
+                high_cost = max_cost
+        max_cost = high_cost
+    elif max_job_hours is not None:
+        max_cost = max_job_hours * 3600.
+    else:
+        raise ValueError("Either n_jobs or max_job_hours is required")
+    jobs = _split_rows(rows, max_cost, overhead, trial_costs, max_dms_per_job=max_dms_per_job)
+    return jobs, plan_cost(jobs, obs_length, timeres, nfreqchan, zmax=zmax) / 3600.
@@ -0,0 +1,168 @@
+import os
+import json
+import hashlib
+import inspect
+from functools import lru_cache
+from os.path import join, exists, expanduser
+
+from mwa_search import dispersion_tools
+
+import logging
+logger = logging.getLogger(__name__)
+
+DD_PLAN_CACHE_DIR = os.environ.get("MWA_SEARCH_DDPLAN_CACHE", join(expanduser("~"), ".cache", "mwa_search", "dd_plans"))
+
+# The observation the pipeline's DD plans are made for
+PIPELINE_CENTREFREQ = 150.
+PIPELINE_BANDWIDTH = 30.72
+PIPELINE_NFREQCHAN = 3072
+PIPELINE_TIMERES = 0.1
+# The DM range (either side of the catalogue DM) searched for targeted candidates
+TARGETED_DM_HALF_WIDTH = 2.0
+# The catalogues searched, in order, for candidates that aren't FRBs
+TARGETED_SOURCE_TYPES = ("RRATs", "Pulsar")
+
+
+@lru_cache(maxsize=1)
+def dd_plan_version():
+    """A hash of the dispersion_tools source, so that a change to dd_plan() invalidates the cache"""
+    return hashlib.md5(inspect.getsource(dispersion_tools).encode("utf-8")).hexdigest()[:12]
+
+
+def plan_key(*args, **kwargs):
+    """The cache key of a dd_plan() call. Numbers are converted to floats so 1 and 1.0 share a plan"""
+    args = [float(a) for a in args]
+    kwargs = {k: float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v
+              for k, v in sorted(kwargs.items())}
+    return hashlib.md5(repr((args, kwargs)).encode("utf-8")).hexdigest()[:16]
+
+
+def plan_path(key, cache_dir=DD_PLAN_CACHE_DIR):
+    """The pathname of a cached plan"""
+    return join(cache_dir, f"ddplan_{key}_{dd_plan_version()}.json")
+
+
+@lru_cache(maxsize=256)
+def _cached_dd_plan(key, args, kwargs, cache_dir):
+    path = plan_path(key, cache_dir=cache_dir)
+    if exists(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Unreadable cached DD plan {path}, recalculating")
+    plan = dispersion_tools.dd_plan(*args, **dict(kwargs))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(plan, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not cache the DD plan: {e}")
+    return plan
+
+
+def cached_dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM, cache_dir=DD_PLAN_CACHE_DIR, **kwargs):
+    """
+    dispersion_tools.dd_plan() memoized in memory and on disk. The arguments are the same as dd_plan()
+
+    Returns
+    -------
+    DD_plan_array: list list
+        A copy of the plan, so callers can modify it
+    """
+    args = (centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM)
+    key = plan_key(*args, **kwargs)
+    plan = _cached_dd_plan(key, args, tuple(sorted(kwargs.items())), cache_dir)
+    return [list(row) for row in plan]
+
+
+def candidate_source(name):
+    """The source name of a candidate name key (candidateName_obsid_pointing)"""
+    return name.split("_")[0]
+
+
+def catalogue_dms(names):
+    """
+    Looks up the DMs of many candidates with one catalogue query per source type, instead of one per candidate.
+    Blind and dm_ candidates are skipped. Pulsars are looked up in TARGETED_SOURCE_TYPES order
+
+    Parameters
+    ----------
+    names: list
+        Candidate name keys (candidateName_obsid_pointing)
+
+    Returns
+    -------
+    dms: dict
+        The DM of each source name
+    """
+    sources = {candidate_source(n) for n in names if not n.startswith("Blind") and not n.startswith("dm_")}
+    if not sources:
+        return {}
+    from vcstools.catalogue_utils import grab_source_alog
+
+    frbs = sorted(s for s in sources if s.startswith("FRB"))
+    remaining = sorted(sources.difference(frbs))
+    dms = {}
+    queries = [("FRB", frbs)] + [(source_type, None) for source_type in TARGETED_SOURCE_TYPES]
+    for source_type, pulsar_list in queries:
+        if pulsar_list is None:
+            pulsar_list = [s for s in remaining if s not in dms]
+        if not pulsar_list:
+            continue
+        for row in grab_source_alog(source_type=source_type, pulsar_list=pulsar_list, include_dm=True):
+            dms.setdefault(row[0], float(row[-1]))
+    missing = sources.difference(dms)
+    if missing:
+        raise ValueError(f"No catalogue DM found for: {', '.join(sorted(missing))}")
+    return dms
+
+
+def candidate_dm_range(name, dm_min, dm_max, dms=None):
+    """
+    The DM range to search for a candidate, following the naming of the pipeline's candidates:
+    Blind* searches dm_min to dm_max, dm_<DM>_* and catalogue sources search TARGETED_DM_HALF_WIDTH either side
+    of their DM (but not below 1)
+
+    Parameters
+    ----------
+    dms: dict
+        The catalogue DMs from catalogue_dms()
+    """
+    if name.startswith("Blind"):
+        return dm_min, dm_max
+    if name.startswith("dm_"):
+        dm = float(name.split("dm_")[-1].split("_")[0])
+    else:
+        dm = dms[candidate_source(name)]
+    return max(dm - TARGETED_DM_HALF_WIDTH, 1.0), dm + TARGETED_DM_HALF_WIDTH
+
+
+def batch_dd_plans(names, dm_min, dm_max, centrefreq=PIPELINE_CENTREFREQ, bandwidth=PIPELINE_BANDWIDTH,
+                   nfreqchan=PIPELINE_NFREQCHAN, timeres=PIPELINE_TIMERES, cache_dir=DD_PLAN_CACHE_DIR, **kwargs):
+    """
+    The DD plans of many candidates, in one process. Candidates with the same DM range share a plan and the
+    catalogue is only queried once per source type. The keyword arguments are passed to dd_plan()
+
+    Parameters
+    ----------
+    names: list
+        Candidate name keys (candidateName_obsid_pointing)
+    dm_min, dm_max: float
+        The DM range of blind searches
+
+    Returns
+    -------
+    plans: dict
+        The DD_plan_array of each name
+    """
+    dms = catalogue_dms(names)
+    plans = {}
+    for name in names:
+        low_dm, high_dm = candidate_dm_range(name, dm_min, dm_max, dms=dms)
+        plans[name] = cached_dd_plan(centrefreq, bandwidth, nfreqchan, timeres, low_dm, high_dm,
+                                     cache_dir=cache_dir, **kwargs)
+    logger.debug(f"Made {len(plans)} DD plans from {_cached_dd_plan.cache_info().currsize} distinct DM ranges")
+    return plans
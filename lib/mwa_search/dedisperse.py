@@ -0,0 +1,392 @@
+import os
+import math
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# PRESTO's dispersion constant, the delay (s) is DM_CONST * DM / f**2 with f in MHz
+DM_CONST = 1. / 2.41e-4
+# The number of output (downsampled) time samples dedispersed at once
+DEDISP_BLOCK = 2**14
+# The most raw time samples read (and downsampled) at once, to bound the memory of large downsample factors
+READ_CHUNK = 2**14
+
+
+def _unpack(raw, nbits):
+    """Unpacks (..., nbytes) uint8 data of 1, 2 or 4 bit samples, the first sample in the most significant bits"""
+    per_byte = 8 // nbits
+    shifts = np.arange(8 - nbits, -1, -nbits, dtype=np.uint8)
+    samples = (raw[..., None] >> shifts) & np.uint8(2**nbits - 1)
+    return samples.reshape(*raw.shape[:-1], raw.shape[-1] * per_byte)
+
+
+def open_search_fits(filename):
+    """
+    Opens a PSRFITS search-mode file with its data memory mapped. Only the small per subint scales, offsets and
+    weights are read into memory
+
+    Returns:
+    --------
+    fits_file: dict
+        'filename', 'hdul' (the open astropy HDUList), 'data' (the memory mapped DATA column), 'scales', 'offsets'
+        (nrows, npol, nchan), 'weights' (nrows, nchan), 'freqs' (nchan,) MHz, 'tbin' (s), 'nsblk', 'nrows',
+        'nsamples', 'npol', 'nchan', 'nbits', 'zero_off', 'pol_type', 'start_mjd' and the header values used in
+        the .inf files
+    """
+    from astropy.io import fits
+    hdul = fits.open(filename, memmap=True)
+    primary = hdul[0].header
+    subint = hdul["SUBINT"]
+    header = subint.header
+    nchan, npol, nsblk = header["NCHAN"], header["NPOL"], header["NSBLK"]
+    nrows = header["NAXIS2"]
+    tbin = float(header["TBIN"])
+    offs_sub = float(subint.data["OFFS_SUB"][0]) if "OFFS_SUB" in subint.columns.names else nsblk * tbin / 2.
+    start_sec = primary["STT_SMJD"] + primary.get("STT_OFFS", 0.) + offs_sub - nsblk * tbin / 2.
+    return {"filename": filename,
+            "hdul": hdul,
+            "data": subint.data["DATA"],
+            "scales": np.asarray(subint.data["DAT_SCL"], dtype=np.float32).reshape(nrows, npol, nchan),
+            "offsets": np.asarray(subint.data["DAT_OFFS"], dtype=np.float32).reshape(nrows, npol, nchan),
+            "weights": np.asarray(subint.data["DAT_WTS"], dtype=np.float32).reshape(nrows, nchan),
+            "freqs": np.asarray(subint.data["DAT_FREQ"], dtype=np.float64).reshape(nrows, nchan)[0],
+            "tbin": tbin,
+            "nsblk": nsblk,
+            "nrows": nrows,
+            "nsamples": nrows * nsblk,
+            "npol": npol,
+            "nchan": nchan,
+            "nbits": header["NBITS"],
+            "zero_off": float(header.get("ZERO_OFF", primary.get("ZERO_OFF", 0.)) or 0.),
+            "pol_type": header.get("POL_TYPE", "AA+BB").strip().upper(),
+            "start_mjd": primary["STT_IMJD"] + start_sec / 86400.,
+            "telescope": primary.get("TELESCOP", "Unknown"),
+            "backend": primary.get("BACKEND", "Unknown"),
+            "source": primary.get("SRC_NAME", "Unknown"),
+            "observer": primary.get("OBSERVER", "Unknown"),
+            "ra": primary.get("RA", "00:00:00.0000"),
+            "dec": primary.get("DEC", "00:00:00.0000"),
+            "beam_diameter": primary.get("BMAJ", 0.) * 3600.}
+
+
+def open_observation(filenames):
+    """
+    Opens the PSRFITS search-mode files of an observation, which are treated as one contiguous time series in
+    order of their start times
+
+    Returns:
+    --------
+    obs: dict
+        'files' (see open_search_fits()), 'file_starts' the first sample of each file, 'nsamples', 'tbin',
+        'freqs' (nchan,) MHz, 'flip' (True if the files' channels are in decreasing frequency), 'chan_mask' the
+        channels with weight in any subint and 'start_mjd'
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    files = sorted((open_search_fits(f) for f in filenames), key=lambda f: f["start_mjd"])
+    first = files[0]
+    for f in files[1:]:
+        if f["nchan"] != first["nchan"] or f["tbin"] != first["tbin"] or not np.allclose(f["freqs"], first["freqs"]):
+            raise ValueError(f"{f['filename']} has a different channelisation or time resolution to {first['filename']}")
+    file_starts = np.cumsum([0] + [f["nsamples"] for f in files])
+    for f, start in zip(files[1:], file_starts[1:-1]):
+        gap = (f["start_mjd"] - first["start_mjd"]) * 86400. - start * first["tbin"]
+        if abs(gap) > first["tbin"]:
+            logger.warning(f"{f['filename']} starts {gap:.6f} s from the end of the previous file, "
+                           "the files are treated as contiguous")
+    flip = first["freqs"][0] > first["freqs"][-1]
+    chan_mask = np.any(np.concatenate([f["weights"] for f in files]) > 0, axis=0)
+    return {"files": files,
+            "file_starts": file_starts,
+            "nsamples": int(file_starts[-1]),
+            "tbin": first["tbin"],
+            "freqs": first["freqs"][::-1] if flip else first["freqs"],
+            "flip": flip,
+            "chan_mask": chan_mask[::-1] if flip else chan_mask,
+            "start_mjd": first["start_mjd"]}
+
+
+def close_observation(obs):
+    """Closes the files of an observation from open_observation()"""
+    for f in obs["files"]:
+        f["hdul"].close()
+
+
+def _read_rows(fits_file, row_start, row_stop):
+    """The scaled and weighted total intensity of a range of subints as (nchan, nsamples) float32"""
+    nrows = row_stop - row_start
+    nsblk, npol, nchan, nbits = fits_file["nsblk"], fits_file["npol"], fits_file["nchan"], fits_file["nbits"]
+    raw = np.asarray(fits_file["data"][row_start:row_stop])
+    if nbits < 8:
+        raw = _unpack(raw.view(np.uint8).reshape(nrows, -1), nbits)
+    data = raw.reshape(nrows, nsblk, npol, nchan).astype(np.float32)
+    if fits_file["zero_off"]:
+        data -= fits_file["zero_off"]
+    data *= fits_file["scales"][row_start:row_stop, None]
+    data += fits_file["offsets"][row_start:row_stop, None]
+    if npol > 1 and fits_file["pol_type"] in ("AABB", "AABBCRCI"):
+        data = data[:, :, 0] + data[:, :, 1]
+    else:
+        # Stokes I or a single polarisation is first
+        data = data[:, :, 0]
+    data *= fits_file["weights"][row_start:row_stop, None]
+    return data.reshape(nrows * nsblk, nchan).T
+
+
+def read_samples(obs, start, nsamples, downsamp=1):
+    """
+    Reads a range of downsampled time samples of an observation, only touching the subints that contain them
+
+    Parameters:
+    -----------
+    obs: dict
+        From open_observation()
+    start, nsamples: int
+        The first sample and number of samples, in downsampled samples. Samples past the end of the
+        observation are not returned
+    downsamp: int
+        The number of time samples averaged together. Default: 1
+
+    Returns:
+    --------
+    data: numpy.array
+        (nchan, nsamples) float32 in increasing frequency
+    """
+    raw_start = start * downsamp
+    raw_stop = min((start + nsamples) * downsamp, obs["nsamples"] - obs["nsamples"] % downsamp)
+    step = max(READ_CHUNK // downsamp, 1) * downsamp
+    pieces = []
+    for chunk_start in range(raw_start, raw_stop, step):
+        data = _read_raw(obs, chunk_start, min(chunk_start + step, raw_stop))
+        if downsamp > 1:
+            data = data.reshape(data.shape[0], -1, downsamp).mean(axis=2, dtype=np.float32)
+        pieces.append(data)
+    if not pieces:
+        return np.zeros((len(obs["freqs"]), 0), dtype=np.float32)
+    return np.ascontiguousarray(np.concatenate(pieces, axis=1) if len(pieces) > 1 else pieces[0])
+
+
+def _read_raw(obs, raw_start, raw_stop):
+    """Reads raw samples raw_start to raw_stop, which may span files, as (nchan, nsamples) in increasing frequency"""
+    pieces = []
+    for f, file_start in zip(obs["files"], obs["file_starts"]):
+        lo = max(raw_start - file_start, 0)
+        hi = min(raw_stop - file_start, f["nsamples"])
+        if hi <= lo:
+            continue
+        row_start, row_stop = lo // f["nsblk"], (hi - 1) // f["nsblk"] + 1
+        offset = row_start * f["nsblk"]
+        pieces.append(_read_rows(f, row_start, row_stop)[:, lo - offset:hi - offset])
+    data = np.concatenate(pieces, axis=1) if len(pieces) > 1 else pieces[0]
+    return data[::-1] if obs["flip"] else data
+
+
+def dispersion_delay(dm, freqs, ref_freq):
+    """The dispersion delay (s) of freqs (MHz) relative to ref_freq (MHz)"""
+    return DM_CONST * np.asarray(dm)[..., None] * (1. / np.asarray(freqs)**2 - 1. / ref_freq**2)
+
+
+def delay_tables(freqs, nsub, dms, tsamp, sub_dm=None):
+    """
+    The integer sample delays of two-stage subband dedispersion. Each channel is first shifted to the top of its
+    subband at sub_dm, then each subband is shifted to the top of the band at each trial DM
+
+    Parameters:
+    -----------
+    freqs: numpy.array
+        The channel frequencies (MHz) in increasing order
+    nsub: int
+        The number of subbands, which must divide the number of channels
+    dms: numpy.array
+        The trial DMs
+    tsamp: float
+        The sample time (s)
+    sub_dm: float
+        The DM the subbands are formed at. Default: the middle of the DM trials
+
+    Returns:
+    --------
+    chan_delays: numpy.array
+        (nchan,) int delays of each channel within its subband
+    sub_delays: numpy.array
+        (ndms, nsub) int delays of each subband
+    """
+    nchan = len(freqs)
+    if nchan % nsub:
+        raise ValueError(f"The number of subbands ({nsub}) must divide the number of channels ({nchan})")
+    if sub_dm is None:
+        sub_dm = 0.5 * (dms[0] + dms[-1])
+    sub_freqs = freqs.reshape(nsub, nchan // nsub)[:, -1]
+    chan_ref = np.repeat(sub_freqs, nchan // nsub)
+    chan_delays = np.rint(DM_CONST * sub_dm * (1. / freqs**2 - 1. / chan_ref**2) / tsamp).astype(np.int64)
+    sub_delays = np.rint(dispersion_delay(dms, sub_freqs, freqs[-1]) / tsamp).astype(np.int64)
+    return chan_delays, sub_delays
+
+
+def form_subbands(data, chan_delays, nsub, nout):
+    """Shifts each channel of (nchan, >= nout + max(chan_delays)) data by its delay and sums them into subbands"""
+    nchan = data.shape[0]
+    subbands = np.zeros((nsub, nout), dtype=np.float32)
+    per_sub = nchan // nsub
+    for chan, delay in enumerate(chan_delays):
+        subbands[chan // per_sub] += data[chan, delay:delay + nout]
+    return subbands
+
+
+def dedisperse_subbands(subbands, sub_delays, nout):
+    """Dedisperses (nsub, >= nout + max(sub_delays)) subbands for every DM trial at once, returning (ndms, nout)"""
+    out = np.zeros((sub_delays.shape[0], nout), dtype=np.float32)
+    samples = np.arange(nout)
+    for sub, delays in enumerate(sub_delays.T):
+        out += subbands[sub][delays[:, None] + samples[None, :]]
+    return out
+
+
+def dat_basename(outbase, dm):
+    """The PRESTO style name of a time series, e.g. outbase_DM12.34"""
+    return f"{outbase}_DM{dm:.2f}"
+
+
+def write_inf(basename, obs, dm, nsamples, tsamp, notes="Dedispersed by mwa_search.dedisperse"):
+    """Writes the PRESTO .inf file of a time series"""
+    first = obs["files"][0]
+    freqs = obs["freqs"]
+    chan_bw = abs(freqs[1] - freqs[0]) if len(freqs) > 1 else 0.
+    imjd = int(obs["start_mjd"])
+    frac_mjd = f"{obs['start_mjd'] - imjd:.15f}".split(".")[-1]
+    lines = [f" Data file name without suffix          =  {os.path.basename(basename)}",
+             f" Telescope used                         =  {first['telescope']}",
+             f" Instrument used                        =  {first['backend']}",
+             f" Object being observed                  =  {first['source']}",
+             f" J2000 Right Ascension (hh:mm:ss.ssss)  =  {first['ra']}",
+             f" J2000 Declination     (dd:mm:ss.ssss)  =  {first['dec']}",
+             f" Data observed by                       =  {first['observer']}",
+             f" Epoch of observation (MJD)             =  {imjd}.{frac_mjd}",
+             " Barycentered?           (1=yes, 0=no)  =  0",
+             f" Number of bins in the time series      =  {nsamples}",
+             f" Width of each time series bin (sec)    =  {tsamp:.15g}",
+             " Any breaks in the data? (1=yes, 0=no)  =  0",
+             " Type of observation (EM band)          =  Radio",
+             f" Beam diameter (arcsec)                 =  {first['beam_diameter']:.0f}",
+             f" Dispersion measure (cm-3 pc)           =  {dm:.12g}",
+             f" Central freq of low channel (Mhz)      =  {freqs[0]:.12g}",
+             f" Total bandwidth (Mhz)                  =  {chan_bw * len(freqs):.12g}",
+             f" Number of channels                     =  {len(freqs)}",
+             f" Channel bandwidth (Mhz)                =  {chan_bw:.12g}",
+             f" Data analyzed by                       =  {os.environ.get('USER', 'Unknown')}",
+             " Any additional notes:",
+             f"    {notes}",
+             ""]
+    with open(f"{basename}.inf", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def max_delay(freqs, dm, tsamp):
+    """The largest number of samples the two-stage delays can reach at a DM, allowing for rounding"""
+    return int(math.ceil(DM_CONST * dm * (1. / freqs[0]**2 - 1. / freqs[-1]**2) / tsamp)) + 2
+
+
+def _dedisperse_chunk(task):
+    """Dedisperses a chunk of DM trials over the whole observation, writing a .dat and .inf file per trial"""
+    filenames, outbase, dms, downsamp, nsub, nout_total, overlap, block, zerodm, numout = task
+    obs = open_observation(filenames)
+    try:
+        tsamp = obs["tbin"] * downsamp
+        chan_delays, sub_delays = delay_tables(obs["freqs"], nsub, dms, tsamp)
+        sub_overlap = int(sub_delays.max())
+        basenames = [dat_basename(outbase, dm) for dm in dms]
+        for basename in basenames:
+            open(f"{basename}.dat", "wb").close()
+        sums = np.zeros(len(dms), dtype=np.float64)
+        for start in range(0, nout_total, block):
+            nout = min(block, nout_total - start)
+            data = read_samples(obs, start, nout + overlap, downsamp=downsamp)
+            if zerodm:
+                mask = obs["chan_mask"]
+                data -= (mask.astype(np.float32) @ data / max(mask.sum(), 1))[None, :]
+                data[~mask] = 0.
+            subbands = form_subbands(data, chan_delays, nsub, nout + sub_overlap)
+            series = dedisperse_subbands(subbands, sub_delays, nout)
+            sums += series.sum(axis=1, dtype=np.float64)
+            for basename, s in zip(basenames, series):
+                with open(f"{basename}.dat", "ab") as f:
+                    s.astype("<f4").tofile(f)
+        nsamples = nout_total
+        if numout is not None and numout != nout_total:
+            # Pad with each series' mean (as prepsubband does) or truncate to numout samples
+            for basename, total in zip(basenames, sums):
+                if numout > nout_total:
+                    with open(f"{basename}.dat", "ab") as f:
+                        np.full(numout - nout_total, total / max(nout_total, 1), dtype="<f4").tofile(f)
+                else:
+                    os.truncate(f"{basename}.dat", numout * 4)
+            nsamples = numout
+        for basename, dm in zip(basenames, dms):
+            write_inf(basename, obs, dm, nsamples, tsamp)
+    finally:
+        close_observation(obs)
+    return basenames
+
+
+def dedisperse_plan_row(filenames, outbase, dd_plan_row, n_procs=1, dms_per_chunk=None, block=DEDISP_BLOCK,
+                        zerodm=False, numout=None):
+    """
+    Dedisperses PSRFITS search-mode files over the DM trials of a dd_plan() row with two-stage subband
+    dedispersion, writing a PRESTO .dat and .inf file per DM trial like prepsubband. The observation is streamed
+    in blocks of time samples (overlapping by the largest dispersion delay) and the DM trials are split into
+    chunks that are dedispersed in parallel. Each chunk forms its subbands at its own middle DM
+
+    Parameters:
+    -----------
+    filenames: list
+        The PSRFITS search-mode files, in any order
+    outbase: string
+        The start of the output names, which are outbase_DM<DM>.dat and .inf
+    dd_plan_row: list
+        [low_DM, high_DM, DM_step, nDM_step, timeres, downsample, nsub] from dispersion_tools.dd_plan()
+    n_procs: int
+        The number of processes. Default: 1
+    dms_per_chunk: int
+        The number of DM trials per chunk. Default: the trials split evenly over the processes
+    block: int
+        The number of output samples dedispersed at once. Default: DEDISP_BLOCK
+    zerodm: boolean
+        Subtract the mean over channels of each time sample, like prepsubband -zerodm. Default: False
+    numout: int
+        Pad (with the mean) or truncate the time series to this many samples. Default: only the samples that
+        have data in every channel at the highest DM
+
+    Returns:
+    --------
+    basenames: list
+        The output names, without suffix, in DM order
+    """
+    low_dm, _, dm_step, ndms, _, downsamp, nsub = dd_plan_row[:7]
+    downsamp, nsub, ndms = int(downsamp), int(nsub), int(ndms)
+    dms = np.round(low_dm + dm_step * np.arange(ndms), 6)
+    obs = open_observation(filenames)
+    try:
+        tsamp = obs["tbin"] * downsamp
+        overlap = max_delay(obs["freqs"], dms[-1], tsamp)
+        nout_total = obs["nsamples"] // downsamp - overlap
+    finally:
+        close_observation(obs)
+    if nout_total <= 0:
+        raise ValueError(f"The observation is shorter than the dispersion delay at DM {dms[-1]}")
+
+    if os.path.dirname(outbase):
+        os.makedirs(os.path.dirname(outbase), exist_ok=True)
+    if dms_per_chunk is None:
+        dms_per_chunk = int(math.ceil(ndms / max(n_procs, 1)))
+    chunks = [dms[i:i + dms_per_chunk] for i in range(0, ndms, dms_per_chunk)]
+    tasks = [(filenames, outbase, chunk, downsamp, nsub, nout_total, overlap, block, zerodm, numout)
+             for chunk in chunks]
+    logger.info(f"Dedispersing {ndms} DM trials from {dms[0]} in {len(chunks)} chunks of {nout_total} samples")
+    if n_procs > 1 and len(tasks) > 1:
+        from multiprocessing import get_context
+        with get_context("fork").Pool(min(n_procs, len(tasks))) as pool:
+            results = pool.map(_dedisperse_chunk, tasks, chunksize=1)
+    else:
+        results = [_dedisperse_chunk(task) for task in tasks]
+    return [basename for result in results for basename in result]
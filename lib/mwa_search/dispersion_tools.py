@@ -1,75 +1,132 @@
 import math
 import numpy as np
-from matplotlib import use
-use('Agg')
-import matplotlib.pyplot as plt
 
-def plot_sensitivity(DD_plan_array, time, centrefreq, freqres, bandwidth):
+# Default pulsar periods (ms) for the sensitivity curves
+SENSITIVITY_PERIODS = np.array([ 1., 0.1, 0.01, 0.001 ])*1000.
+
+
+def dm_trials(DD_plan_array):
+    """
+    Expands a dedispersion plan into its DM trials
+
+    Returns
+    -------
+    DMs: numpy.array
+        Every DM trial of the plan
+    DM_steps, timeres: numpy.arrays
+        The DM step and time resolution (ms) of the row each trial belongs to
+    """
+    rows = [np.arange(DM_start, D_DM, DM_step) for DM_start, D_DM, DM_step, _, _, _, _ in DD_plan_array]
+    counts = [len(row) for row in rows]
+    DMs = np.concatenate(rows) if rows else np.zeros(0)
+    DM_steps = np.repeat([float(row[2]) for row in DD_plan_array], counts)
+    timeres = np.repeat([float(row[4]) for row in DD_plan_array], counts)
+    return DMs, DM_steps, timeres
+
+
+def sensitivity_curve(DD_plan_array, time, centrefreq, freqres, bandwidth, periods=SENSITIVITY_PERIODS,
+                      duty_cycle=0.05):
+    """
+    Works out the detection sensitivity of each DM trial of a dedispersion plan for pulsars of several periods,
+    including the smearing within a frequency channel, from the DM step and from the time resolution
+
+    Parameters
+    ----------
+    DD_plan_array: list list
+        The dedispersion plan from dd_plan()
+    time: float
+        The observation duration in s
+    centrefreq: float
+        The center frequency of the observation in MHz
+    freqres: float
+        The frequency channel width in MHz
+    bandwidth: float
+        The bandwidth of the observation in MHz
+    periods: numpy.array
+        The pulsar periods in ms
+    duty_cycle: float
+        The intrinsic pulse width as a fraction of the period
+
+    Returns
+    -------
+    DMs: numpy.array
+        (ntrials) the DM trials
+    sensitivities: numpy.array
+        (nperiods, ntrials) the 10 sigma detection sensitivity in mJy, 1000 where the pulse is smeared over the
+        whole period
+    """
+    DMs, DM_steps, timeres = dm_trials(DD_plan_array)
+    return DMs, trial_sensitivity(DMs, DM_steps, timeres, time, centrefreq, freqres, bandwidth, periods=periods,
+                                  duty_cycle=duty_cycle)
+
+
+def trial_sensitivity(DMs, DM_steps, timeres, time, centrefreq, freqres, bandwidth, periods=SENSITIVITY_PERIODS,
+                      duty_cycle=0.05, extra_smear=0.):
+    """
+    The detection sensitivity of DM trials, see sensitivity_curve(). DM_steps, timeres and extra_smear (any other
+    smearing in ms, e.g. within subbands) are per trial or scalars
+
+    Returns
+    -------
+    sensitivities: numpy.array
+        (nperiods, ntrials) the 10 sigma detection sensitivity in mJy
+    """
     base_sensitivity = 3 #mJy. This could be done properly but this will for now
     # adjust for time
     base_sensitivity = base_sensitivity * math.sqrt(4800) / math.sqrt(time)
-    # adjust for unscattered pulsar
-    #base_sensitivity = base_sensitivity / math.sqrt( ( 1. - 0.05) / 0.05 )
 
-    # period to work with
-    periods = np.array([ 1., 0.1, 0.01, 0.001 ])*1000.
-    widths = periods*0.05
+    periods = np.asarray(periods, dtype=np.float64)[:, None]
+    widths = periods * duty_cycle
+    #Dm smear over a frequency channel
+    dm_smear = np.asarray(DMs) * freqres * 8.3 * 10.**6 / centrefreq**3
+    #Dm smear due to maximum incorrect DM
+    dm_step_smear = 8.3 * 10.**6 * np.asarray(DM_steps) / 2. * bandwidth / centrefreq**3
+    effective_width = np.sqrt(widths**2 + dm_smear**2 + dm_step_smear**2 + np.asarray(timeres)**2 +
+                              np.asarray(extra_smear)**2)
+    #sensitivity given new effective width
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sensitivities = base_sensitivity / np.sqrt((periods - effective_width) / effective_width) * \
+                        np.sqrt((periods - widths) / widths)
+    return np.where(effective_width >= periods, 1000., sensitivities)
+
 
-    #fig, ax = plt.subplots(1, 1)
+def plot_sensitivity(DD_plan_array, time, centrefreq, freqres, bandwidth):
+    from matplotlib import use
+    use('Agg')
+    import matplotlib.pyplot as plt
+
+    DMs, sensitivities = sensitivity_curve(DD_plan_array, time, centrefreq, freqres, bandwidth)
     plt.subplots(1, 1)
-    #ax.set_ylim(0, 100)
-    #plt.ylim(0, 100)
-
-    for period, width in zip(periods, widths):
-        sensitivties = []
-        DMs = []
-        for dm_row in DD_plan_array:
-            DM_start, D_DM, DM_step, _, timeres, _, _ = dm_row
-            for DM in np.arange(DM_start, D_DM, DM_step):
-                # For each DM you're going to search do a sensitivy cal based on how
-                # a pulse will get
-
-                #Dm smear over a frequency channel
-                dm_smear = DM * freqres * 8.3 * 10.**6 / centrefreq**3
-                #Dm smear due to maximum incorrect DM
-                dm_step_smear = 8.3 * 10.**6 * DM_step / 2. * bandwidth / centrefreq**3
-
-                effective_width = math.sqrt(width**2 + dm_smear**2 + dm_step_smear**2 + timeres**2)
-                #print(effective_width)
-                #sensitivity given new effectiv width
-                if effective_width >= period:
-                    sensitivties.append(1000.)
-                else:
-                    sensitivties.append(base_sensitivity /
-                                    math.sqrt( ( period - effective_width) / effective_width ) *
-                                    math.sqrt( ( period - width) / width ))
-                DMs.append(DM)
-        plt.plot(DMs, sensitivties, label="P={0} ms".format(period))
-    #plt.yscale('log')
+    for period, period_sensitivities in zip(SENSITIVITY_PERIODS, sensitivities):
+        plt.plot(DMs, period_sensitivities, label="P={0} ms".format(period))
     plt.legend()
     plt.yscale('log')
     plt.xscale('log')
     plt.ylabel(r"Detection Sensitivity, 10$\sigma$ (mJy)")
     plt.xlabel(r"Dispersion measure (pc cm$^{-3}$ ")
     plt.title("Sensitivy using a minimum DM step size of {0}".format(DD_plan_array[0][2]))
-    #plt.show()
     plt.savefig("DM_step_sens_mDMs_{0}.png".format(DD_plan_array[0][2]))
 
 
-def calc_nsub(centrefreq, dm):
+def subband_smear(centrefreq, dm, nsub):
+    """The smearing (ms) within a subband that calc_nsub() limits"""
+    return dm * 0.01 / nsub * 8.3 * 10.**6 / centrefreq**3
+
+
+def calc_nsub(centrefreq, dm, time_res=0.1):
     #work out how many subbands to use based on the dm smear over a subband
     nsub = 2
     #time_res and dm_smear are in ms
-    time_res = 0.1
-    dm_smear = dm * 0.01 / nsub * 8.3 * 10.**6 / centrefreq**3
+    dm_smear = subband_smear(centrefreq, dm, nsub)
     while dm_smear > time_res:
         nsub *= 2.
-        dm_smear = dm * 0.01 / nsub * 8.3 * 10.**6 / centrefreq**3
+        dm_smear = subband_smear(centrefreq, dm, nsub)
     return int(nsub)
 
 
 def dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM,
-            min_DM_step=0.02, max_DM_step=500.0, max_dms_per_job=5000):
+            min_DM_step=0.02, max_DM_step=500.0, max_dms_per_job=5000,
+            smear_fact=3., breakpoint_fact=None, nsub_time_res=0.1):
     """
     Work out the dedisperion plan
 
@@ -91,6 +148,13 @@ def dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM,
         Will overwrite the minimum DM step with this value
     max_dms_per_job: int
         If Nsteps is greater than this value split it into multiple lines
+    smear_fact: float
+        The number of time samples a pulse may be smeared over by the DM step
+    breakpoint_fact: float
+        The number of time samples a pulse may be smeared over within a frequency channel before the time
+        resolution is halved. Default: smear_fact
+    nsub_time_res: float
+        The largest smearing (ms) within a subband, see calc_nsub()
 
     Returns
     -------
@@ -104,7 +168,8 @@ def dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM,
     previous_DM = lowDM
 
     #number of time samples smeared over before moving to next D_dm
-    smear_fact = 3.
+    if breakpoint_fact is None:
+        breakpoint_fact = smear_fact
 
     #Loop until you've made a hit your range max
     D_DM = 0.
@@ -118,7 +183,7 @@ def dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM,
         total_smear = math.sqrt(timeres**2 + dm_smear**2)
 
 
-        D_DM = smear_fact * timeres * centrefreq**3 /\
+        D_DM = breakpoint_fact * timeres * centrefreq**3 /\
                (8.3 * 10.**6 * freqres)
 
         #difference in DM that will double the effective width (eq 6.4 of pulsar handbook)
@@ -145,7 +210,7 @@ def dd_plan(centrefreq, bandwidth, nfreqchan, timeres, lowDM, highDM,
         D_DM = round(D_DM, 2)
         nDM_step = int((D_DM - previous_DM) / DM_step)
         if D_DM > lowDM:
-            nsub = calc_nsub(centrefreq, D_DM)
+            nsub = calc_nsub(centrefreq, D_DM, time_res=nsub_time_res)
             if downsample > 16:
                 DD_plan_array.append([ previous_DM, D_DM, DM_step, nDM_step, timeres, 16, nsub ])
             else:
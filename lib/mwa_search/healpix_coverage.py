@@ -0,0 +1,354 @@
+import os
+import numpy as np
+from os.path import join, expanduser, exists
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Equal-area sky coverage maps on a HEALPix (RING ordering) pixelisation. Only the handful of HEALPix
+# functions the maps need are implemented here, so healpy is not required
+
+COVERAGE_STATE_DIR = os.environ.get("MWA_SEARCH_COVERAGE_STATE", join(expanduser("~"), ".cache", "mwa_search", "coverage"))
+
+
+def nside2npix(nside):
+    """The number of pixels of a HEALPix map"""
+    return 12 * nside**2
+
+
+def nside2resol(nside):
+    """The approximate pixel size (deg)"""
+    return np.degrees(np.sqrt(4 * np.pi / nside2npix(nside)))
+
+
+def pix2ang(nside, pix):
+    """
+    The centres of RING ordered HEALPix pixels
+
+    Returns:
+    --------
+    theta, phi: numpy.arrays
+        The colatitude and longitude (rad)
+    """
+    pix = np.asarray(pix, dtype=np.int64)
+    npix = nside2npix(nside)
+    ncap = 2 * nside * (nside - 1)
+    z = np.empty(pix.shape)
+    phi = np.empty(pix.shape)
+    # North polar cap
+    north = pix < ncap
+    iring = np.floor((1 + np.sqrt(1 + 2 * pix[north])) / 2).astype(np.int64)
+    iphi = pix[north] + 1 - 2 * iring * (iring - 1)
+    z[north] = 1 - iring**2 / (3. * nside**2)
+    phi[north] = (iphi - 0.5) * np.pi / (2 * iring)
+    # Equatorial belt
+    belt = (pix >= ncap) & (pix < npix - ncap)
+    ip = pix[belt] - ncap
+    iring = ip // (4 * nside) + nside
+    iphi = ip % (4 * nside) + 1
+    fodd = 0.5 * (1 + ((iring + nside) & 1))
+    z[belt] = (2 * nside - iring) * 2. / (3 * nside)
+    phi[belt] = (iphi - fodd) * np.pi / (2 * nside)
+    # South polar cap
+    south = pix >= npix - ncap
+    ip = npix - pix[south]
+    iring = np.floor((1 + np.sqrt(2 * ip - 1)) / 2).astype(np.int64)
+    iphi = 4 * iring + 1 - (ip - 2 * iring * (iring - 1))
+    z[south] = -1 + iring**2 / (3. * nside**2)
+    phi[south] = (iphi - 0.5) * np.pi / (2 * iring)
+    return np.arccos(z), phi
+
+
+def ang2pix(nside, theta, phi):
+    """The RING ordered HEALPix pixels containing the colatitudes theta and longitudes phi (rad)"""
+    theta, phi = np.broadcast_arrays(np.asarray(theta, dtype=np.float64), np.asarray(phi, dtype=np.float64))
+    npix = nside2npix(nside)
+    ncap = 2 * nside * (nside - 1)
+    z = np.cos(theta)
+    za = np.abs(z)
+    tt = np.mod(phi, 2 * np.pi) / (np.pi / 2) # in [0, 4)
+    pix = np.empty(z.shape, dtype=np.int64)
+    # Equatorial belt
+    belt = za <= 2. / 3
+    temp1 = nside * (0.5 + tt[belt])
+    temp2 = nside * z[belt] * 0.75
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ir = nside + 1 + jp - jm
+    kshift = 1 - (ir & 1)
+    ip = ((jp + jm - nside + kshift + 1) // 2) % (4 * nside)
+    pix[belt] = ncap + (ir - 1) * 4 * nside + ip
+    # Polar caps
+    cap = ~belt
+    tp = tt[cap] - np.floor(tt[cap])
+    tmp = nside * np.sqrt(3 * (1 - za[cap]))
+    jp = (tp * tmp).astype(np.int64)
+    jm = ((1 - tp) * tmp).astype(np.int64)
+    ir = jp + jm + 1
+    ip = (tt[cap] * ir).astype(np.int64) % (4 * ir)
+    pix[cap] = np.where(z[cap] > 0, 2 * ir * (ir - 1) + ip, npix - 2 * ir * (ir + 1) + ip)
+    return pix
+
+
+def radec2pix(nside, ra, dec):
+    """The pixels containing RAs and Decs (deg)"""
+    return ang2pix(nside, np.radians(90. - np.asarray(dec)), np.radians(ra))
+
+
+def pix2radec(nside, pix=None):
+    """The RA and Dec (deg) of pixel centres, or of every pixel if pix is None"""
+    if pix is None:
+        pix = np.arange(nside2npix(nside))
+    theta, phi = pix2ang(nside, pix)
+    return np.degrees(phi), 90. - np.degrees(theta)
+
+
+def grid_to_healpix(values, res, nside):
+    """
+    Samples values on the regular grid of sky_coverage.sky_grid(res) at the centre of every HEALPix pixel
+    (nearest grid point), e.g. for maps that were calculated on the old grid
+    """
+    ra, dec = pix2radec(nside)
+    n_ra = len(range(0, 361, res))
+    i_dec = np.clip(np.rint((dec + 90.) / res).astype(np.int64), 0, len(range(-90, 91, res)) - 1)
+    i_ra = np.clip(np.rint(ra / res).astype(np.int64), 0, n_ra - 1)
+    return np.asarray(values)[i_dec * n_ra + i_ra]
+
+
+def half_power_pixels(power, fraction=0.5):
+    """The (sparse) pixels where an observation's power is at least fraction of its maximum"""
+    power = np.asarray(power)
+    return np.flatnonzero(power >= fraction * power.max())
+
+
+def overlap_count(masks, npix):
+    """The number of observations that cover each pixel"""
+    if not masks:
+        return np.zeros(npix, dtype=np.int64)
+    return np.bincount(np.concatenate(masks), minlength=npix)
+
+
+def coverage(masks, npix):
+    """Whether each pixel is covered by at least one observation"""
+    return overlap_count(masks, npix) > 0
+
+
+def summed_power(masks, powers, npix):
+    """
+    The power of each observation within its mask, summed over observations. powers holds the power of each
+    observation at the pixels of its mask
+    """
+    if not masks:
+        return np.zeros(npix)
+    return np.bincount(np.concatenate(masks), weights=np.concatenate(powers), minlength=npix)
+
+
+def covered_fraction(masks, npix):
+    """The fraction of the sky covered by the observations (HEALPix pixels have equal areas)"""
+    return coverage(masks, npix).mean()
+
+
+def image_edges(width=1440, height=720):
+    """The (height + 1, width + 1) mollweide plot coordinates (rad) of the edges of an image's cells"""
+    return np.meshgrid(np.linspace(-np.pi, np.pi, width + 1), np.linspace(-np.pi / 2, np.pi / 2, height + 1))
+
+
+def image_pixels(nside, width=1440, height=720, ra_offset=False):
+    """
+    Maps a regular image over the mollweide plots' coordinates (x = -RA + 180 deg, or -RA with ra_offset)
+    to HEALPix pixels, so a map can be drawn with a single pcolormesh
+
+    Returns:
+    --------
+    pix: numpy.array
+        (height, width) the pixel at the centre of each cell
+    """
+    x = np.linspace(-np.pi, np.pi, width + 1)
+    y = np.linspace(-np.pi / 2, np.pi / 2, height + 1)
+    x_centres = (x[1:] + x[:-1]) / 2
+    y_centres = (y[1:] + y[:-1]) / 2
+    if ra_offset:
+        ra = np.mod(-np.degrees(x_centres), 360.)
+    else:
+        ra = 180. - np.degrees(x_centres)
+    dec = np.degrees(y_centres)
+    return radec2pix(nside, ra[None, :], dec[:, None])
+
+
+def mask_image(mask, image_pix, npix):
+    """Whether each cell of an image from image_pixels() is in a sparse pixel mask"""
+    in_mask = np.zeros(npix, dtype=bool)
+    in_mask[mask] = True
+    return in_mask[image_pix]
+
+
+def mask_outline(image):
+    """The edge cells of a boolean image (RA wraps around, Dec doesn't)"""
+    inner = image & np.roll(image, 1, axis=1) & np.roll(image, -1, axis=1)
+    inner[1:] &= image[:-1]
+    inner[:-1] &= image[1:]
+    return image & ~inner
+
+
+def mask_cells(mask, image_pix, npix, outline=False):
+    """The flat indices of the image cells of a mask, or of its edge if outline"""
+    image = mask_image(mask, image_pix, npix)
+    if outline:
+        image = mask_outline(image)
+    return np.flatnonzero(image)
+
+
+def render_cells(ax, layers, width=1440, height=720, zorder=0.5):
+    """
+    Draws layers of image cells onto a mollweide axis as one image, instead of a contour per observation
+
+    Parameters:
+    -----------
+    ax: matplotlib axis
+        A mollweide axis
+    layers: list
+        [[cells, colour, alpha]] of flat image cell indices from mask_cells(). Later layers are drawn over
+        earlier ones
+    width, height: int
+        The size of the image in cells. Default: 1440, 720
+
+    Returns:
+    --------
+    mesh: matplotlib.collections.QuadMesh
+    """
+    from matplotlib.colors import ListedColormap, to_rgba
+    codes = np.zeros(height * width, dtype=np.int64)
+    colours = []
+    for code, (cells, colour, alpha) in enumerate(layers, start=1):
+        codes[cells] = code
+        colours.append(to_rgba(colour, alpha))
+    x_edges, y_edges = image_edges(width=width, height=height)
+    return ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(codes.reshape(height, width), 0),
+                         cmap=ListedColormap(colours or ["none"]), vmin=0.5, vmax=len(layers) + 0.5,
+                         shading="flat", zorder=zorder, rasterized=True)
+
+
+def render_map(ax, values, image_pix, cmap="viridis", zorder=0.4):
+    """
+    Draws a HEALPix map onto a mollweide axis as one image. Pixels with a value of 0 are left blank
+
+    Parameters:
+    -----------
+    values: numpy.array
+        The value of every pixel
+    image_pix: numpy.array
+        (height, width) the image's pixels from image_pixels()
+
+    Returns:
+    --------
+    mesh: matplotlib.collections.QuadMesh
+    """
+    height, width = image_pix.shape
+    x_edges, y_edges = image_edges(width=width, height=height)
+    return ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(np.asarray(values)[image_pix], 0), cmap=cmap,
+                         shading="flat", zorder=zorder, rasterized=True)
+
+
+# A coverage state keeps the masks of many observations between runs, so that adding an observation only
+# costs that observation's mask and image cells. The state is a dictionary of
+#   nside, width, height, ra_offset: the pixelisation and image the state was made for
+#   sources: {key: a token for the data the mask was made from, e.g. beam_cache.map_token()}
+#   masks, fills, outlines: {key: the observation's pixels, image cells and edge image cells}
+#   powers: {key: the observation's relative power at the pixels of its mask, for summed_power()}
+#   counts: the number of observations that cover each pixel
+
+def state_path(name, nside, width=1440, height=720, ra_offset=False, state_dir=COVERAGE_STATE_DIR):
+    """The pathname of a coverage state"""
+    return join(state_dir, f"{name}_nside{nside}_{width}x{height}{'_offset' if ra_offset else ''}.npz")
+
+
+def new_state(nside, width=1440, height=720, ra_offset=False):
+    """An empty coverage state"""
+    return {"nside": nside, "width": width, "height": height, "ra_offset": ra_offset,
+            "sources": {}, "masks": {}, "fills": {}, "outlines": {}, "powers": {},
+            "counts": np.zeros(nside2npix(nside), dtype=np.int32)}
+
+
+def load_state(path, nside, width=1440, height=720, ra_offset=False):
+    """Loads a coverage state, or makes an empty one if there isn't one for this pixelisation and image"""
+    state = new_state(nside, width=width, height=height, ra_offset=ra_offset)
+    if not exists(path):
+        return state
+    with np.load(path) as data:
+        if (int(data["nside"]), int(data["width"]), int(data["height"]), bool(data["ra_offset"])) != \
+           (nside, width, height, ra_offset):
+            logger.warning(f"{path} was made for a different map so it will be remade")
+            return state
+        if "powers" not in data:
+            logger.warning(f"{path} was made without the observations' powers so it will be remade")
+            return state
+        keys = data["keys"].tolist()
+        state["sources"] = dict(zip(keys, data["sources"].tolist()))
+        for kind in ("masks", "fills", "outlines", "powers"):
+            state[kind] = dict(zip(keys, np.split(data[kind], data[f"{kind}_offsets"][1:-1])))
+        state["counts"] = data["counts"]
+    return state
+
+
+def save_state(state, path):
+    """Saves a coverage state through a temporary file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    keys = list(state["masks"])
+    arrays = {"keys": np.array(keys, dtype=str),
+              "sources": np.array([state["sources"][key] for key in keys], dtype=str),
+              "counts": state["counts"]}
+    for kind in ("masks", "fills", "outlines", "powers"):
+        parts = [state[kind][key] for key in keys]
+        arrays[kind] = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32 if kind == "powers" else np.int64)
+        arrays[f"{kind}_offsets"] = np.cumsum([0] + [len(part) for part in parts])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, nside=state["nside"], width=state["width"], height=state["height"],
+                 ra_offset=state["ra_offset"], **arrays)
+    os.replace(tmp_path, path)
+
+
+def is_current(state, key, source):
+    """Whether the state already has the mask of an observation made from source"""
+    return state["sources"].get(key) == source
+
+
+def remove_observation(state, key):
+    """Removes an observation from a coverage state"""
+    if key not in state["masks"]:
+        return
+    state["counts"][state["masks"][key]] -= 1
+    for kind in ("sources", "masks", "fills", "outlines", "powers"):
+        del state[kind][key]
+
+
+def add_observation(state, key, mask, source, image_pix=None, power=None):
+    """
+    Adds (or replaces) the mask of an observation in a coverage state. Only this observation's pixels of the
+    aggregate maps are updated
+
+    Parameters:
+    -----------
+    key: string
+        The name of the observation, e.g. its obsid
+    mask: numpy.array
+        The observation's pixels
+    source: string
+        A token for the data the mask was made from. See is_current()
+    image_pix: numpy.array
+        The image's pixels from image_pixels(), if already made
+    power: numpy.array
+        The observation's relative power at every pixel. Default: 1 within the mask
+    """
+    remove_observation(state, key)
+    if image_pix is None:
+        image_pix = image_pixels(state["nside"], width=state["width"], height=state["height"],
+                                 ra_offset=state["ra_offset"])
+    npix = nside2npix(state["nside"])
+    mask = np.asarray(mask, dtype=np.int64)
+    state["counts"][mask] += 1
+    state["sources"][key] = source
+    state["masks"][key] = mask
+    state["powers"][key] = (np.asarray(power)[mask] if power is not None else np.ones(len(mask))).astype(np.float32)
+    state["fills"][key] = mask_cells(mask, image_pix, npix)
+    state["outlines"][key] = mask_cells(mask, image_pix, npix, outline=True)
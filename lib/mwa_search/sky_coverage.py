@@ -0,0 +1,186 @@
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Sensitivity (mJy) of a 10 sigma detection for unit summed beam power
+SENS_CONST = 4.96
+
+
+def ra_to_plot_x(ra, ra_offset=False):
+    """
+    Converts RAs (deg) to the x values (rad) of the mollweide plots, where RA increases to the left.
+    With ra_offset, 0h is in the centre of the plot
+    """
+    ra = np.asarray(ra, dtype=np.float64)
+    if ra_offset:
+        return np.where(ra > 180, -ra/180.*np.pi + 2*np.pi, -ra/180.*np.pi)
+    return -ra/180.*np.pi + np.pi
+
+
+def sky_grid(res=1, ra_offset=False):
+    """
+    Makes the regular RA/Dec grid the coverage maps are calculated on, ordered by Dec then RA
+
+    Parameters:
+    -----------
+    res: int
+        The resolution of the grid (deg). Default: 1
+    ra_offset: boolean
+        Offsets the plot x values so that 0h is in the centre. Default: False
+
+    Returns:
+    --------
+    RA, Dec: numpy.arrays
+        The RA and Dec (deg) of each pixel
+    x, y: numpy.arrays
+        The plot coordinates (rad) of each pixel
+    """
+    Dec, RA = np.meshgrid(np.arange(-90, 91, res), np.arange(0, 361, res), indexing="ij")
+    RA = RA.ravel()
+    Dec = Dec.ravel()
+    return RA, Dec, ra_to_plot_x(RA, ra_offset=ra_offset), Dec/180.*np.pi
+
+
+def power_reductions(powout, dec):
+    """
+    Reduces the beam power of an observation over time
+
+    Parameters:
+    -----------
+    powout: numpy.array
+        (npixels, ntimes, nfreqs) beam power from get_beam_power_over_time(). Only the first frequency is used
+    dec: numpy.array
+        The declination (rad) of each pixel
+
+    Returns:
+    --------
+    max_power: numpy.array
+        The maximum power of each pixel over the observation (never less than 0)
+    sum_power: numpy.array
+        The power of each pixel summed over time
+    overlap: numpy.array
+        The summed power weighted by cos(dec), which is added up over observations for overlap maps
+    """
+    power = powout[:, :, 0]
+    max_power = np.maximum(power.max(axis=1), 0.)
+    sum_power = power.sum(axis=1)
+    return max_power, sum_power, sum_power * np.cos(dec)
+
+
+def obs_sensitivity(max_power, sum_power, min_power=0.001):
+    """The detection sensitivity (mJy) of each pixel of an observation. Pixels the beam barely reaches are NaN"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(max_power < min_power, np.nan, SENS_CONST / np.sqrt(sum_power))
+
+
+def combine_sensitivity(sens, obs_sens):
+    """Keeps the best (lowest) sensitivity of each pixel over observations. NaNs are ignored unless both are NaN"""
+    return np.fmin(sens, obs_sens)
+
+
+def overlap_sensitivity(overlap, min_power=0.5):
+    """The sensitivity (mJy) of each pixel from the summed power of all overlapping observations"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1.5 * SENS_CONST / np.sqrt(np.where(overlap < min_power, np.nan, overlap))
+
+
+def shade_mask(shade, power, level):
+    """Adds the pixels of an observation that are at least level to a shading map"""
+    return np.where(power >= level, power, shade)
+
+
+def dec_line(power, x, y, dec, res, ra_offset=False):
+    """
+    Picks out the power along the pointing's declination
+
+    Parameters:
+    -----------
+    power: numpy.array
+        The power of each pixel
+    x, y: numpy.arrays
+        The plot coordinates (rad) of each pixel from sky_grid()
+    dec: float
+        The declination (deg) of the pointing
+    res: int
+        The resolution of the grid (deg)
+
+    Returns:
+    --------
+    RA_line, power_line: numpy.arrays
+        The RAs (deg) and powers along the declination, in increasing RA
+    """
+    on_line = np.abs(y*180/np.pi + 0.001 - dec) < 0.5*float(res)
+    power_line = power[on_line].astype(np.float64)
+    if not ra_offset:
+        return 180. - x[on_line]*180/np.pi, power_line
+    RA_line = -x[on_line]*180/np.pi
+    RA_line[RA_line <= 0] += 360.
+    # The line starts at 180 so it is reordered by RA, which leaves two 360s at the end
+    order = np.lexsort((power_line, RA_line))
+    RA_line = RA_line[order]
+    power_line = power_line[order]
+    return np.concatenate(([0.], RA_line[:-1])), np.concatenate((power_line[-1:], power_line[:-1]))
+
+
+def _reduced_beam_map(args):
+    """Calculates (or reads) an observation's reduced map in a worker and returns where the parent can find it"""
+    from mwa_search.beam_cache import get_beam_map
+    obs_metadata, names_ra_dec, kwargs = args
+    beam_map = get_beam_map(obs_metadata, names_ra_dec, reduce=True, **kwargs)
+    if isinstance(beam_map, np.memmap):
+        # Only the cache pathname goes back through the pipe
+        return beam_map.filename
+    return np.asarray(beam_map)
+
+
+def _indexed_reduced_beam_map(indexed_task):
+    i, task = indexed_task
+    return i, _reduced_beam_map(task)
+
+
+def _load_reduced(result, task):
+    if isinstance(result, str):
+        try:
+            result = np.load(result, mmap_mode="r")
+        except FileNotFoundError:
+            # Evicted by another worker before it was read
+            return _load_reduced(_reduced_beam_map(task), task)
+    return result[0], result[1]
+
+
+def stream_reductions(obs_metadata_list, names_ra_dec, n_procs=1, ordered=True, **kwargs):
+    """
+    Calculates the max and summed beam power of many observations over a pool of processes, yielding each
+    observation as it is finished so that only one map at a time needs to be held. The maps go through the
+    beam map cache, so later calls only read them. The keyword arguments are passed to beam_cache.get_beam_map()
+
+    Parameters:
+    -----------
+    obs_metadata_list: list
+        [[obsid, ra, dec, duration, delays, centrefreq, channels]]
+    names_ra_dec: numpy.array
+        [[name, ra, dec]] of the positions
+    n_procs: int
+        The number of processes. Default: 1
+    ordered: boolean
+        Yield the observations in the order of obs_metadata_list, else in the order they finish. Default: True
+
+    Yields:
+    -------
+    obs_metadata: list
+        The observation's metadata
+    max_power, sum_power: numpy.arrays
+        The maximum and summed power over time of each position
+    """
+    tasks = [(obs_metadata, names_ra_dec, kwargs) for obs_metadata in obs_metadata_list]
+    if n_procs > 1 and len(tasks) > 1:
+        from multiprocessing import get_context
+        with get_context("fork").Pool(min(n_procs, len(tasks))) as pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            # Tag each result with its task so unordered results can be matched up
+            for i, result in imap(_indexed_reduced_beam_map, enumerate(tasks), chunksize=1):
+                yield (obs_metadata_list[i], *_load_reduced(result, tasks[i]))
+    else:
+        for obs_metadata, task in zip(obs_metadata_list, tasks):
+            yield (obs_metadata, *_load_reduced(_reduced_beam_map(task), task))
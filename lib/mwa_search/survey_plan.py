@@ -0,0 +1,214 @@
+import math
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The GLEAM declinations and the tile delays that point at them
+GLEAM_DEC_RANGE = [-72., -55., -40.5, -26.7, -13., +1.6, +18.3]
+GLEAM_DELAYS_RANGE = [[0,0,0,0,6,6,6,6,12,12,12,12,18,18,18,18],
+                      [0,0,0,0,4,4,4,4,8,8,8,8,12,12,12,12],
+                      [0,0,0,0,2,2,2,2,4,4,4,4,6,6,6,6],
+                      [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0],
+                      [6,6,6,6,4,4,4,4,2,2,2,2,0,0,0,0],
+                      [12,12,12,12,8,8,8,8,4,4,4,4,0,0,0,0],
+                      [18,18,18,18,12,12,12,12,6,6,6,6,0,0,0,0]]
+
+
+def beam_cut_power(obs_metadata, ras, decs, dt=600):
+    """The beam power of an observation at the first time step and frequency of each position (deg)"""
+    from vcstools.beam_calc import get_beam_power_over_time
+    names_ra_dec = np.column_stack((['source']*len(ras), ras, decs))
+    powout = get_beam_power_over_time(obs_metadata, names_ra_dec, dt=dt, degrees=True)
+    return np.asarray(powout).reshape(len(ras), -1)[:, 0].astype(np.float64)
+
+
+def _refine_peak(power_func, x, power, tol, n_refine):
+    """Narrows down the maximum of the power around the best sample. Returns the peak power and evaluations"""
+    i = int(np.argmax(power))
+    best_x, best_power = x[i], power[i]
+    half_width = x[1] - x[0] if len(x) > 1 else 0.
+    n_evaluated = 0
+    while half_width > tol:
+        xs = np.linspace(best_x - half_width, best_x + half_width, n_refine)
+        ps = power_func(xs)
+        n_evaluated += len(xs)
+        if ps.max() > best_power:
+            best_x, best_power = xs[np.argmax(ps)], ps.max()
+        half_width = 2 * half_width / (n_refine - 1)
+    return best_power, n_evaluated
+
+
+def half_power_roots(power_func, start, stop, step=2., level=0.5, relative=False, tol=0.01, n_refine=8):
+    """
+    Finds where the beam power along a 1D cut crosses a level. The cut is sampled coarsely, then only the
+    intervals that contain a crossing (and the peak, if relative) are refined, n_refine points at a time.
+    The crossings are interpolated linearly within the final intervals, where the old UnivariateSpline roots were
+    cubic, so the FWHMs can differ slightly from the old ones
+
+    Parameters:
+    -----------
+    power_func: function
+        Returns the power at an array of positions (deg) along the cut, e.g. a wrapped beam_cut_power()
+    start, stop: float
+        The range of the cut (deg)
+    step: float
+        The coarse sample spacing (deg). Default: 2
+    level: float
+        The power to find the crossings of. Default: 0.5
+    relative: boolean
+        If True, level is a fraction of the maximum power along the cut. Default: False
+    tol: float
+        The width (deg) the intervals are refined down to. Default: 0.01
+
+    Returns:
+    --------
+    roots: numpy.array
+        The positions (deg) of the crossings in increasing order
+    n_evaluated: int
+        The number of positions the beam was evaluated at
+    """
+    x = np.arange(start, stop + step/2., step)
+    power = power_func(x)
+    n_evaluated = len(x)
+    if relative:
+        peak, n_peak = _refine_peak(power_func, x, power, tol, n_refine)
+        n_evaluated += n_peak
+        level = level * peak
+
+    above = power >= level
+    crossings = np.flatnonzero(above[1:] != above[:-1])
+    lo = x[crossings]
+    hi = x[crossings + 1]
+    lo_above = above[crossings]
+    lo_power = power[crossings]
+    hi_power = power[crossings + 1]
+    # Refine every interval at once so each iteration is a single beam calculation
+    while len(lo) and np.max(hi - lo) > tol:
+        fractions = np.linspace(0., 1., n_refine + 2)[1:-1]
+        xs = lo[:, None] + (hi - lo)[:, None] * fractions[None, :]
+        ps = power_func(xs.ravel()).reshape(xs.shape)
+        n_evaluated += xs.size
+        # The first sample on the other side of the level from the interval's start
+        changed = (ps >= level) != lo_above[:, None]
+        first = np.where(changed.any(axis=1), changed.argmax(axis=1), n_refine)
+        rows = np.arange(len(lo))
+        xs_ext = np.column_stack((lo, xs, hi))
+        ps_ext = np.column_stack((lo_power, ps, hi_power))
+        lo, hi = xs_ext[rows, first], xs_ext[rows, first + 1]
+        lo_power, hi_power = ps_ext[rows, first], ps_ext[rows, first + 1]
+
+    # Interpolate linearly within the final intervals
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(hi_power != lo_power, (level - lo_power) / (hi_power - lo_power), 0.5)
+    return lo + (hi - lo) * np.clip(fraction, 0., 1.), n_evaluated
+
+
+def smart_plan(degree_overlap, manual_overlap=None, fwhm=False, dec_range=GLEAM_DEC_RANGE,
+               delays_range=GLEAM_DELAYS_RANGE, time=4800, step=2., tol=0.01, power_func=beam_cut_power):
+    """
+    Works out how many observations are required to cover the southern sky. The beam FWHM at each declination
+    is found from targeted 1D cuts through the beam (see half_power_roots()) instead of a full sky map
+
+    Parameters:
+    -----------
+    degree_overlap: float
+        The overlap (deg) between neighbouring observations at the equator
+    manual_overlap: list
+        The number of observations at each declination, to override the overlap. Default: None
+    fwhm: boolean
+        If True, the width is measured at half the maximum power along the cut instead of 0.5. Default: False
+    time: int
+        The observation duration (s). Default: 4800
+    power_func: function
+        power_func(obs_metadata, ras, decs) returns the beam power. Default: beam_cut_power
+
+    Returns:
+    --------
+    observations, dec_list, ra_list, delays_list: lists
+        The (fake) obsids, declinations, RAs and delays of the observations, sorted by RA
+    """
+    from vcstools.pointing_utils import deg2sex
+
+    channels = range(107,131)
+    minfreq = float(min(channels))
+    maxfreq = float(max(channels))
+    centrefreq = 1.28 * (minfreq + (maxfreq-minfreq)/2) #in MHz
+
+    start_obsid = '1117624530'
+    start_ra = 180.
+
+    observations = []
+    ra_list = []
+    dec_list = []
+    delays_list = []
+    FWHM = []
+    FWHM_Dec = []
+    n_evaluated = 0
+    for i, dec in enumerate(dec_range):
+        ra_sex, deg_sex = deg2sex(start_ra, dec)
+        cord = [start_obsid, str(ra_sex), str(deg_sex), 1, delays_range[i], centrefreq, channels]
+
+        # The RA cut is along int(dec), the pointing's declination truncated towards zero (e.g. -26 for -26.7),
+        # like the old sky map rows
+        def ra_cut(ras):
+            return power_func(cord, ras, np.full(len(ras), float(int(dec))))
+
+        def dec_cut(decs):
+            return power_func(cord, np.full(len(decs), start_ra), decs)
+
+        print("\nValues for Dec " + str(dec))
+        #work out RA FWHM (not including the drift scan, 0sec observation)
+        roots, n = half_power_roots(ra_cut, 0., 360., step=step, relative=fwhm, tol=tol)
+        n_evaluated += n
+        if len(roots) != 2:
+            print("No FWHM for " + str(dec) + " setting to 1000 to skip")
+            FWHM.append(1000.)
+        else:
+            FWHM.append(float(roots[1] - roots[0]))
+            print("FWHM along RA at dec "+ str(dec) + ": " + str(FWHM[i]))
+
+        #work out Dec FWHM
+        if fwhm:
+            roots, n = half_power_roots(dec_cut, -89., 88., step=step, relative=True, tol=tol)
+            n_evaluated += n
+            r1, r2 = roots
+            FWHM_Dec.append(float(r2 - r1))
+            print("FWHM along Dec at dec "+ str(dec) + ": " + str(FWHM_Dec[i]))
+
+        deg_move = FWHM[i] - degree_overlap*math.cos(math.radians(dec)) + \
+                   float(time)/3600.*15.*math.cos(math.radians(dec))
+        if manual_overlap is not None:
+            point_num_this_deg = manual_overlap[i]
+        else:
+            point_num_this_deg = int(360./deg_move) + 1
+        print("Number for this dec: " +str(point_num_this_deg))
+        deg_move = 360. / point_num_this_deg
+        overlap_true = FWHM[i] + float(time)/3600.*15.*math.cos(math.radians(dec)) -\
+                       360./point_num_this_deg
+        print("True overlap this dec: " + str(overlap_true))
+
+        # offset every second dec range by half a FWHM in RA
+        for x in range(point_num_this_deg):
+            if i % 2 == 0:
+                temp_ra = start_ra + x * deg_move
+                observations.append(str(int(start_obsid) + int(x*deg_move*240)))
+            else:
+                temp_ra = start_ra + x * deg_move +\
+                          deg_move / math.cos(math.radians(dec))
+                observations.append(str(int(start_obsid) + int(x*deg_move*240) +\
+                                        int(deg_move*120)))
+            if temp_ra > 360.:
+                temp_ra = temp_ra -360.
+            ra_list.append(temp_ra)
+            dec_list.append(dec)
+            delays_list.append(delays_range[i])
+    logger.debug(f"The beam was evaluated at {n_evaluated} positions")
+
+    #Sort by ra
+    dec_list =     [x for _,x in sorted(zip(ra_list,dec_list))]
+    delays_list =  [x for _,x in sorted(zip(ra_list,delays_list))]
+    observations = [x for _,x in sorted(zip(ra_list,observations))]
+    ra_list = sorted(ra_list)
+
+    return observations, dec_list, ra_list, delays_list
@@ -56,15 +56,20 @@ process classify {
 
     """
     REALPATH=`realpath ${fex_out}`
-    for i in {1..5}; do
-        java -jar `which LOTAASClassifier.jar` -m \${LOTAAS_MLC_MODEL_DIR}/V1.3.1model\${i}.model -p `realpath ${fex_out}` -a 1 -d
-        if [ -f "\${REALPATH%arff}positive" ]; then
-            mv \${REALPATH%arff}positive feature_extraction_m\${i}.positive
-        fi
-        if [ -f "\${REALPATH%arff}negative" ]; then
-            mv \${REALPATH%arff}negative feature_extraction_m\${i}.negative
-        fi
-    done
+    if command -v lotaas_classify.py > /dev/null; then
+        # Score all five models in one JVM
+        lotaas_classify.py -p \${REALPATH} --jar `which LOTAASClassifier.jar` --model_dir \${LOTAAS_MLC_MODEL_DIR}
+    else
+        for i in {1..5}; do
+            java -jar `which LOTAASClassifier.jar` -m \${LOTAAS_MLC_MODEL_DIR}/V1.3.1model\${i}.model -p `realpath ${fex_out}` -a 1 -d
+            if [ -f "\${REALPATH%arff}positive" ]; then
+                mv \${REALPATH%arff}positive feature_extraction_m\${i}.positive
+            fi
+            if [ -f "\${REALPATH%arff}negative" ]; then
+                mv \${REALPATH%arff}negative feature_extraction_m\${i}.negative
+            fi
+        done
+    fi
     """
 }
 
@@ -15,6 +15,10 @@ params.dm_max = 250
 params.dm_min_step = 0.02
 params.dm_max_step = 0.5
 params.max_dms_per_job = 5000
+// If greater than 0, the DD plan is split into at most this many jobs of roughly equal predicted CPU time.
+// The ddplan process fails if a plan needs more jobs (with at most max_dms_per_job DMs each), since each
+// candidate's results are grouped by this number
+params.dm_jobs = 0
 
 //Defaults for the accelsearch command
 params.nharm = 16 // number of harmonics to search
@@ -46,6 +50,9 @@ if ( params.zmax == 0 ) {
 else {
     total_dm_jobs = 24
 }
+if ( params.dm_jobs > 0 ) {
+    total_dm_jobs = params.dm_jobs
+}
 
 // Work out some estimated job times
 if ( "$HOSTNAME".startsWith("farnarkle") ) {
@@ -70,52 +77,18 @@ process ddplan {
     label 'ddplan'
 
     input:
-    tuple val(name), val(fits_files) //fits_files is actauly files but I assume this will save me link
+    val(names) // all the candidate name keys (candidateName_obsid_pointing) so they are planned in one task
 
     output:
     file 'DDplan.txt'
 
     """
-    #!/usr/bin/env python3
-
-    from vcstools.catalogue_utils import grab_source_alog
-    from mwa_search.dispersion_tools import dd_plan
-    import csv
-
-    #obsid_pointing = "${fits_files[0]}".split("/")[-1].split("_ch")[0]
-    #print(obsid_pointing)
-
-    if '$name'.startswith('Blind'):
-        output = dd_plan(150., 30.72, 3072, 0.1, $params.dm_min, $params.dm_max,
-                         min_DM_step=$params.dm_min_step, max_DM_step=$params.dm_max_step,
-                         max_dms_per_job=$params.max_dms_per_job)
-    else:
-        if '$name'.startswith('dm_'):
-            dm = float('$name'.split('dm_')[-1].split('_')[0])
-        elif '$name'.startswith('FRB'):
-            dm = grab_source_alog(source_type='FRB',
-                 pulsar_list=['$name'.split("_")[0]], include_dm=True)[0][-1]
-        else:
-            # Try RRAT first
-            rrat_temp = grab_source_alog(source_type='RRATs',
-                        pulsar_list=['$name'.split("_")[0]], include_dm=True)
-            if len(rrat_temp) == 0:
-                #No RRAT so must be pulsar
-                dm = grab_source_alog(source_type='Pulsar',
-                     pulsar_list=['$name'.split("_")[0]], include_dm=True)[0][-1]
-            else:
-                dm = rrat_temp[0][-1]
-        dm_min = float(dm) - 2.0
-        if dm_min < 1.0:
-            dm_min = 1.0
-        dm_max = float(dm) + 2.0
-        output = dd_plan(150., 30.72, 3072, 0.1, dm_min, dm_max,
-                         min_DM_step=$params.dm_min_step, max_DM_step=$params.dm_max_step,
-                         max_dms_per_job=$params.max_dms_per_job)
-    with open("DDplan.txt", "w") as outfile:
-        spamwriter = csv.writer(outfile, delimiter=',')
-        for o in output:
-            spamwriter.writerow(['${name}'] + o)
+    cat > names.txt << 'EOF'
+${names.join('\n')}
+EOF
+    batch_ddplan.py --names_file names.txt --dm_min ${params.dm_min} --dm_max ${params.dm_max} \
+--min_DM_step ${params.dm_min_step} --max_DM_step ${params.dm_max_step} --max_dms_per_job ${params.max_dms_per_job} \
+--dm_jobs ${params.dm_jobs} --obs_length ${obs_length} --zmax ${params.zmax}
     """
 }
 
@@ -367,7 +340,7 @@ workflow pulsar_search {
     take:
         name_fits_files // [val(candidateName_obsid_pointing), file(fits_files)]
     main:
-        ddplan( name_fits_files )
+        ddplan( name_fits_files.map{ it -> it[0] }.collect() )
         search_dd_fft_acc( // combine the fits files and ddplan with the matching name key (candidateName_obsid_pointing)
                            ddplan.out.splitCsv().map{ it -> [ it[0], [ it[1], it[2], it[3], it[4], it[5], it[6], it[7] ] ] }.\
                            concat(name_fits_files).groupTuple().\
@@ -403,7 +376,7 @@ workflow single_pulse_search {
     take:
         name_fits_files
     main:
-        ddplan( name_fits_files )
+        ddplan( name_fits_files.map{ it -> it[0] }.collect() )
         search_dd( // combine the fits files and ddplan witht he matching name key (candidateName_obsid_pointing)
                    ddplan.out.splitCsv().map{ it -> [ it[0], [ it[1], it[2], it[3], it[4], it[5], it[6], it[7] ] ] }.concat(name_fits_files).groupTuple().\
                    // Find for each ddplan match that with the fits files and the name key then change the format to [val(name), val(dm_values), file(fits_files)]
@@ -210,7 +210,7 @@ include { ddplan; prepfold } from './pulsar_search_module'
 include { classifier }   from './classifier_module'
 
 workflow {
-    ddplan( fits_files.map{ it -> [ params.cand + '_' + it.getBaseName().split("/")[-1].split("_ch")[0], it ] } )
+    ddplan( fits_files.map{ it -> params.cand + '_' + it.getBaseName().split("/")[-1].split("_ch")[0] }.collect() )
     search_dd_fft_acc( // combine the fits files and ddplan with the matching name key (candidateName_obsid_pointing)
                         ddplan.out.splitCsv().map{ it -> [ it[0], [ it[1], it[2], it[3], it[4], it[5], it[6], it[7] ] ] }.\
                         concat(fits_files.map{ it -> [ params.cand + '_' + it.getBaseName().split("/")[-1].split("_ch")[0], it ] }).groupTuple( size: 2 ).\
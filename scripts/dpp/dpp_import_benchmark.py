@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import sys
+import logging
+import argparse
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# The modules pulsar_processing_pipeline.py imports before it knows which stage it is running
+PPP_MODULES = ["dpp.helper_config", "dpp.helper_logging", "dpp.helper_terminate", "dpp.helper_files",
+               "dpp.helper_relaunch", "dpp.helper_checks", "dpp.helper_state_db"]
+# Slow modules that should only be imported by the stages that use them
+HEAVY_MODULES = ["matplotlib", "psrqpy", "rm_synthesis", "vcstools.beam_calc", "vcstools.sn_flux_utils"]
+
+
+def import_times(modules, python=sys.executable):
+    """
+    Imports the modules in a fresh interpreter with -X importtime
+
+    Returns:
+    --------
+    times: dictionary
+        module: (self, cumulative) import time in microseconds of every module that was imported
+    """
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().split("\n")[-1])
+    times = {}
+    for line in result.stderr.split("\n"):
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def benchmark(modules, repeats=5, python=sys.executable):
+    """
+    Times the import of the modules over several fresh interpreters, keeping the fastest time of each module
+
+    Returns:
+    --------
+    total: float
+        The fastest total import time (ms)
+    times: dictionary
+        module: (self, cumulative) fastest import times (us)
+    """
+    best = {}
+    totals = []
+    for _ in range(repeats):
+        times = import_times(modules, python=python)
+        totals.append(sum(self_us for self_us, _ in times.values()) / 1e3)
+        for name, (self_us, cumulative_us) in times.items():
+            if name not in best or cumulative_us < best[name][1]:
+                best[name] = (self_us, cumulative_us)
+    return min(totals), best
+
+
+def main(kwargs):
+    total, times = benchmark(kwargs["modules"], repeats=kwargs["repeats"])
+    logger.info(f"Import time of {', '.join(kwargs['modules'])}: {total:.1f} ms (budget {kwargs['budget']} ms)")
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:kwargs["top"]]
+    for name, (self_us, cumulative_us) in slowest:
+        logger.info(f"{self_us / 1e3:9.1f} ms self {cumulative_us / 1e3:9.1f} ms cumulative  {name}")
+    failed = False
+    heavy = [name for name in kwargs["heavy"] if name in times]
+    if heavy:
+        logger.error(f"Modules that should be imported lazily were imported: {', '.join(heavy)}")
+        failed = True
+    if total > kwargs["budget"]:
+        logger.error(f"Import time of {total:.1f} ms is over the budget of {kwargs['budget']} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    loglevels = dict(DEBUG=logging.DEBUG,
+                     INFO=logging.INFO,
+                     WARNING=logging.WARNING,
+                     ERROR=logging.ERROR)
+    parser = argparse.ArgumentParser(description="""Measures the start-up import time of the dpp entry points with
+                                     python -X importtime. Exits with 1 if the time is over budget or a slow module
+                                     that should be imported lazily was imported""",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-m", "--modules", type=str, nargs='+', default=PPP_MODULES,
+                        help="The modules to import")
+    parser.add_argument("-b", "--budget", type=float, default=1500.,
+                        help="The import time budget (ms)")
+    parser.add_argument("-r", "--repeats", type=int, default=5,
+                        help="The number of fresh interpreters to time. The fastest is used")
+    parser.add_argument("--heavy", type=str, nargs='*', default=HEAVY_MODULES,
+                        help="Modules that must not be imported")
+    parser.add_argument("--top", type=int, default=15,
+                        help="The number of slowest imports to list")
+    parser.add_argument("-L", "--loglvl", type=str, default="INFO",
+                        help="Logger verbosity level", choices=loglevels.keys())
+    args = parser.parse_args()
+
+    logger.setLevel(loglevels[args.loglvl])
+    ch = logging.StreamHandler()
+    ch.setLevel(loglevels[args.loglvl])
+    formatter = logging.Formatter('%(asctime)s  %(filename)s  %(name)s  %(lineno)-4d  %(levelname)-9s :: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    logger.propagate = False
+    kwargs = vars(args)
+    sys.exit(main(kwargs))
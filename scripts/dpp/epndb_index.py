@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import os
+import logging
+import argparse
+from dpp.epndb import update_cache, EPNDB_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def main(kwargs):
+    index = update_cache(kwargs["epndb_loc"], cache_dir=kwargs["cache_dir"])
+    logger.info(f"EPNDB cache of {len(index)} pulsars is up to date: {kwargs['cache_dir']}")
+
+
+if __name__ == '__main__':
+    loglevels = dict(DEBUG=logging.DEBUG,
+                     INFO=logging.INFO,
+                     WARNING=logging.WARNING,
+                     ERROR=logging.ERROR)
+    parser = argparse.ArgumentParser(description="""Builds or updates the binary cache of the EPN database.
+                                     Only pulsars with new or removed entries are converted again""",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--epndb_loc", type=str, default=os.environ.get("EPNDB_LOC"),
+                        help="The location of the EPN database")
+    parser.add_argument("--cache_dir", type=str, default=EPNDB_CACHE_DIR,
+                        help="The directory of the EPNDB cache")
+    parser.add_argument("-L", "--loglvl", type=str, default="INFO",
+                        help="Logger verbosity level", choices=loglevels.keys())
+    args = parser.parse_args()
+
+    logger.setLevel(loglevels[args.loglvl])
+    ch = logging.StreamHandler()
+    ch.setLevel(loglevels[args.loglvl])
+    formatter = logging.Formatter('%(asctime)s  %(filename)s  %(name)s  %(lineno)-4d  %(levelname)-9s :: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    logger.propagate = False
+    if not args.epndb_loc:
+        logger.error("The EPNDB location must be supplied with --epndb_loc or $EPNDB_LOC")
+        raise SystemExit(1)
+    kwargs = vars(args)
+    main(kwargs)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+from dpp.helper_lotaas import classify_arffs, parse_launch, LOTAAS_JAR, LOTAAS_MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def main(kwargs):
+    worker_cmd = parse_launch(kwargs["worker_cmd"])
+    outputs = classify_arffs(kwargs["arffs"], models=kwargs["models"], model_dir=kwargs["model_dir"], jar=kwargs["jar"],
+                             launch=parse_launch(kwargs["launch"]), worker_cmd=worker_cmd, out_dir=kwargs["out_dir"])
+    for output in outputs:
+        logger.info(f"Classifier output: {output}")
+
+
+if __name__ == '__main__':
+    loglevels = dict(DEBUG=logging.DEBUG,
+                     INFO=logging.INFO,
+                     WARNING=logging.WARNING,
+                     ERROR=logging.ERROR)
+    parser = argparse.ArgumentParser(description="""Scores .arff files with all of the LOTAAS classifier models using a single
+                                     persistent JVM, which traps the classifier's System.exit() calls on any Java version,
+                                     and writes <arff>_m<i>.positive/.negative files for each model""",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-p", "--arffs", type=str, nargs='+', required=True,
+                        help="The .arff files to classify")
+    parser.add_argument("-m", "--models", type=str, nargs='*', default=None,
+                        help="The pathnames of the models. Default: the five V1.3.1 models in --model_dir")
+    parser.add_argument("--model_dir", type=str, default=LOTAAS_MODEL_DIR,
+                        help="The directory containing the models")
+    parser.add_argument("-d", "--out_dir", type=str, default=".",
+                        help="The directory to move the classifier outputs to")
+    parser.add_argument("--jar", type=str, default=LOTAAS_JAR,
+                        help="The LOTAAS classifier jar, as seen by java (inside the --launch container)")
+    parser.add_argument("--launch", type=str, default=None,
+                        help="A command to prepend to the java commands, e.g. 'singularity exec -e <container>'")
+    parser.add_argument("--worker_cmd", type=str, default=None,
+                        help="A command that replaces the JVM worker (e.g. a local stand-in for testing)")
+    parser.add_argument("-L", "--loglvl", type=str, default="INFO",
+                        help="Logger verbosity level", choices=loglevels.keys())
+    args = parser.parse_args()
+
+    # The root logger, so the worker's summary from dpp.helper_lotaas is shown
+    logger = logging.getLogger()
+    logger.setLevel(loglevels[args.loglvl])
+    ch = logging.StreamHandler()
+    ch.setLevel(loglevels[args.loglvl])
+    formatter = logging.Formatter('%(asctime)s  %(filename)s  %(name)s  %(lineno)-4d  %(levelname)-9s :: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    kwargs = vars(args)
+    main(kwargs)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+from dpp.helper_ephemeris import write_ephemerides, EPH_CACHE_DIR, PSRCAT
+
+logger = logging.getLogger(__name__)
+
+
+def main(kwargs):
+    eph_files = write_ephemerides(kwargs["pulsars"], out_dir=kwargs["out_dir"], exclude=kwargs["exclude"],
+                                  eph_type=kwargs["eph_type"], psrcat=kwargs["psrcat"], cache_dir=kwargs["cache_dir"],
+                                  use_cache=not kwargs["no_cache"])
+    for eph_file in eph_files:
+        logger.info(f"Ephemeris written: {eph_file}")
+
+
+if __name__ == '__main__':
+    loglevels = dict(DEBUG=logging.DEBUG,
+                     INFO=logging.INFO,
+                     WARNING=logging.WARNING,
+                     ERROR=logging.ERROR)
+    parser = argparse.ArgumentParser(description="""Writes <pulsar>.eph files for many pulsars with a single psrcat call""",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-p", "--pulsars", type=str, nargs='+', required=True,
+                        help="The J or B names of the pulsars. e.g. J2241-5236 J0437-4715")
+    parser.add_argument("-d", "--out_dir", type=str, default=".",
+                        help="The directory to write the ephemerides to")
+    parser.add_argument("-e", "--eph_type", type=str, default="-e", choices=["-e", "-e2"],
+                        help="The psrcat ephemeris option")
+    parser.add_argument("--exclude", type=str, nargs='*', default=["TCB"],
+                        help="Lines containing any of these strings are removed from the ephemerides")
+    parser.add_argument("--psrcat", type=str, default=PSRCAT,
+                        help="The psrcat executable")
+    parser.add_argument("--cache_dir", type=str, default=EPH_CACHE_DIR,
+                        help="The directory of the ephemeris cache")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Don't read from or write to the ephemeris cache")
+    parser.add_argument("-L", "--loglvl", type=str, default="INFO",
+                        help="Logger verbosity level", choices=loglevels.keys())
+    args = parser.parse_args()
+
+    logger.setLevel(loglevels[args.loglvl])
+    ch = logging.StreamHandler()
+    ch.setLevel(loglevels[args.loglvl])
+    formatter = logging.Formatter('%(asctime)s  %(filename)s  %(name)s  %(lineno)-4d  %(levelname)-9s :: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    logger.propagate = False
+    kwargs = vars(args)
+    main(kwargs)
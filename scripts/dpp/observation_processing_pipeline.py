@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import logging
 import argparse
+from multiprocessing.pool import ThreadPool
 
 from vcstools.config import load_config_file
 from vcstools.progress_bar import progress_bar
@@ -8,16 +9,30 @@ from dpp.helper_obs_info import find_pulsars_in_fov, reformat_psrs_pointings
 from dpp.helper_files import setup_cfg_dirs, clean_cfg, find_config_files, create_dpp_dir
 from dpp.helper_config import create_cfgs_main, dump_to_yaml, from_yaml
 from dpp.helper_relaunch import relaunch_ppp
+from dpp.helper_state_db import log_progress
 import pulsar_processing_pipeline as ppp
 
 comp_config = load_config_file()
 logger = logging.getLogger(__name__)
 
 
+def layout_cfg(cfg):
+    """Sets up the directories of a cfg and dumps it. Returns the cfg's pathname or None if it has no valid pointings"""
+    setup_cfg_dirs(cfg)
+    clean_cfg(cfg)
+    if cfg: # If there are valid pointing directories
+        return dump_to_yaml(cfg)
+    return None
+
+
 def main(kwargs):
     """Initialises the pipeline and begins the run"""
+    if kwargs["progress"]:
+        log_progress(kwargs["obsid"], label=kwargs["label"])
+        return
+
     if kwargs["relaunch"]:
-        cfg_names = find_config_files(kwargs["obsid"], kwargs["label"])
+        cfg_names = find_config_files(kwargs["obsid"], kwargs["label"], state_db=kwargs["state_db"])
 
     else:
         # Create dpp dir
@@ -30,13 +45,13 @@ def main(kwargs):
         logger.info("Initialising config files...")
         cfgs = create_cfgs_main(kwargs, psrs_pointing_dict)
 
-        cfg_names = []
-        for cfg in progress_bar(cfgs, "Setting up config directories: "):
-            setup_cfg_dirs(cfg)
-            clean_cfg(cfg)
-            if cfg: # If there are valid pointing directories
-                dump_to_yaml(cfg)
-                cfg_names.append(cfg["files"]["my_name"])
+        if kwargs["n_procs"] > 1:
+            # Directory set up is mostly waiting on the filesystem so threads are enough
+            with ThreadPool(kwargs["n_procs"]) as pool:
+                cfg_names = pool.map(layout_cfg, cfgs)
+        else:
+            cfg_names = [layout_cfg(cfg) for cfg in progress_bar(cfgs, "Setting up config directories: ")]
+        cfg_names = [name for name in cfg_names if name]
 
     # Launch ppp for each pulsar
     for name in progress_bar(cfg_names, "Launching processing for pulsars: "):
@@ -68,6 +83,14 @@ if __name__ == '__main__':
     otherop.add_argument("--force_rerun", action="store_true", help="Use this tag to force a fresh run of each pulsar processing pipeline\
                          by overwriting the config files. Else, will continue from any found config files.")
     otherop.add_argument("--label", type=str, default="", help="A label to use to identify the results from this run")
+    otherop.add_argument("--state_db", action="store_true", help="Keep track of the pipeline's progress and results in an SQLite\
+                         database in the obsid/dpp directory. Relaunches and progress reports will read from it instead of the config files")
+    otherop.add_argument("--native_rvm", action="store_true", help="Fit the RVM in the pipeline's own jobs instead of PSRSALSA\
+                         ppolFit slurm jobs. Not yet checked against ppolFit on real profiles")
+    otherop.add_argument("--native_rm", action="store_true", help="Find the RM with the pipeline's own RM synthesis instead of\
+                         vcstools' rm_synth_pipe. Not yet checked against rm_synth_pipe on real archives")
+    otherop.add_argument("--n_procs", type=int, default=1, help="The number of processes used to initialise and set up the config files")
+    otherop.add_argument("--progress", action="store_true", help="Report the stage each pulsar is up to using the state database and exit")
     otherop.add_argument("-L", "--loglvl", type=str, default="INFO", help="Logger verbosity level", choices=loglevels.keys())
     otherop.add_argument("--mwa_search", type=str, default="master", help="The version of mwa_search to use")
     otherop.add_argument("--vcstools", type=str, default="master", help="The version of vcs_tools to use")
@@ -79,5 +102,6 @@ if __name__ == '__main__':
     formatter = logging.Formatter(
         '%(asctime)s  %(filename)s  %(name)s  %(lineno)-4d  %(levelname)-9s :: %(message)s')
     ch.setFormatter(formatter)
+    logger.addHandler(ch)
     kwargs = vars(args)
     main(kwargs)
\ No newline at end of file
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+from dpp.features import features_main
+
+logger = logging.getLogger(__name__)
+
+
+def main(kwargs):
+    features_main(kwargs["pfd_dir"], kwargs["arff"], cache_dir=kwargs["cache_dir"])
+
+
+if __name__ == '__main__':
+    loglevels = dict(DEBUG=logging.DEBUG,
+                     INFO=logging.INFO,
+                     WARNING=logging.WARNING,
+                     ERROR=logging.ERROR)
+    parser = argparse.ArgumentParser(description="""Computes the PulsarFeatureLab type 6 features of all of the .pfd files
+                                     in a directory and writes them to an .arff file. Not used by the pipeline until
+                                     tests/test_features_pfl.py passes against PulsarFeatureLab on real pfds""",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-d", "--pfd_dir", type=str, default=".",
+                        help="The directory containing the .pfd files")
+    parser.add_argument("-f", "--arff", type=str, default="feature_extraction.arff",
+                        help="The name of the output .arff file")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="A directory to cache the features of each pfd in")
+    parser.add_argument("-L", "--loglvl", type=str, default="INFO",
+                        help="Logger verbosity level", choices=loglevels.keys())
+    args = parser.parse_args()
+
+    logger.setLevel(loglevels[args.loglvl])
+    ch = logging.StreamHandler()
+    ch.setLevel(loglevels[args.loglvl])
+    formatter = logging.Formatter('%(asctime)s  %(filename)s  %(name)s  %(lineno)-4d  %(levelname)-9s :: %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    logger.propagate = False
+    kwargs = vars(args)
+    main(kwargs)
@@ -3,21 +3,15 @@ import logging
 import argparse
 import sys
 import os
+import time
 
-from vcstools.prof_utils import ProfileLengthError, NoFitError
 from dpp.helper_config import from_yaml, reset_cfg
-from dpp.helper_prepfold import ppp_prepfold
-from dpp.helper_classify import classify_main, read_classifications
-from dpp.helper_bestprof import find_best_pointing, NoUsableFolds, populate_post_folds, best_post_fold
 from dpp.helper_logging import initiate_logs
 from dpp.helper_terminate import finish_unsuccessful, finish_successful
 from dpp.helper_files import remove_old_results
-from dpp.helper_database import submit_prepfold_products_db
-from dpp.helper_archive import ppp_archive_creation, ppp_baseline_removal
 from dpp.helper_relaunch import relaunch_ppp
-from dpp.helper_RM import RM_synth, RM_cor
-from dpp.helper_RVMfit import RVM_fit, RVM_file_to_cfg
 from dpp.helper_checks import check_pipe_integrity
+from dpp.helper_state_db import current_stage, record_dispatch
 
 logger = logging.getLogger(__name__)
 
@@ -41,16 +35,34 @@ def main(kwargs):
     # Run cfg through the checks pipeline
     check_pipe_integrity(cfg)
 
-    # Do the next step in the pipeline
+    # Do the next step in the pipeline. Most stages only submit jobs here, so this times the dispatch of the stage
+    stage = current_stage(cfg)
+    start = time.time()
+    try:
+        next_stage(cfg)
+    finally:
+        record_dispatch(cfg, stage, start, time.time())
+
+
+def next_stage(cfg):
+    """
+    Runs the next stage of the pipeline based on what has been completed.
+    Each stage imports only what it needs, as this runs in a fresh job for every stage
+    """
     if cfg["completed"]["init_folds"] == False:
         # Do the initial folds
+        from dpp.helper_prepfold import ppp_prepfold
         dep_jids = ppp_prepfold(cfg)
         relaunch_ppp(cfg, depends_on=dep_jids)
     elif cfg["completed"]["classify"] == False:
         # Classify the intial folds
+        from dpp.helper_classify import classify_main
         dep_jid = classify_main(cfg)
         relaunch_ppp(cfg, depends_on=dep_jid)
     elif cfg["completed"]["post_folds"] == False:
+        from dpp.helper_classify import read_classifications
+        from dpp.helper_bestprof import find_best_pointing, NoUsableFolds
+        from dpp.helper_prepfold import ppp_prepfold
         # Read the output of the classifier
         read_classifications(cfg)
         # Decide on next folds
@@ -62,6 +74,9 @@ def main(kwargs):
         dep_jids = ppp_prepfold(cfg)
         relaunch_ppp(cfg, depends_on=dep_jids)
     elif cfg["completed"]["upload"] == False:
+        from dpp.helper_bestprof import populate_post_folds, best_post_fold
+        from dpp.helper_database import submit_prepfold_products_db
+        from dpp.helper_archive import ppp_archive_creation
         # Update cfg with fold info
         populate_post_folds(cfg)
         # Find the best post-fold
@@ -72,6 +87,8 @@ def main(kwargs):
         dep_jid, _ = ppp_archive_creation(cfg)
         relaunch_ppp(cfg, depends_on=dep_jid)
     elif cfg["completed"]["debase"] == False:
+        from vcstools.prof_utils import ProfileLengthError, NoFitError
+        from dpp.helper_archive import ppp_baseline_removal
         # Baseline RFI removal
         try:
             dep_jid, _ = ppp_baseline_removal(cfg)
@@ -79,22 +96,27 @@ def main(kwargs):
             finish_unsuccessful(cfg, e)
         relaunch_ppp(cfg, depends_on=dep_jid, time="02:00:00") # RM synth might take a while - give it more time
     elif cfg["completed"]["RM"] == False:
+        from dpp.helper_RM import RM_synth, RM_cor
+        from dpp.helper_RVMfit import rvm_job_resources
         # Perform RM synthesis
         RM_synth(cfg)
         # Correct for RM
         dep_jid, _ = RM_cor(cfg)
-        relaunch_ppp(cfg, depends_on=dep_jid)
+        relaunch_ppp(cfg, depends_on=dep_jid, **rvm_job_resources(cfg))
     elif cfg["completed"]["RVM_initial"] == False:
+        from dpp.helper_RVMfit import RVM_fit, rvm_job_resources
         # Initial RVM fit
         dep_jid = RVM_fit(cfg)
-        relaunch_ppp(cfg, depends_on=dep_jid)
+        relaunch_ppp(cfg, depends_on=dep_jid, **rvm_job_resources(cfg))
     elif cfg["completed"]["RVM_final"] == False:
+        from dpp.helper_RVMfit import RVM_fit, RVM_file_to_cfg
         # Read Initial RVM
         RVM_file_to_cfg(cfg)
         # Final RVM fit
         dep_jid = RVM_fit(cfg)
         relaunch_ppp(cfg, depends_on=dep_jid)
     else:
+        from dpp.helper_RVMfit import RVM_file_to_cfg
         # Read Initial RVM
         RVM_file_to_cfg(cfg)
         finish_successful(cfg)
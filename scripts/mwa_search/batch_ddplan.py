@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+
+import csv
+import argparse
+from mwa_search.ddplan_service import batch_dd_plans, DD_PLAN_CACHE_DIR, PIPELINE_TIMERES, PIPELINE_NFREQCHAN
+from mwa_search.ddplan_cost import partition_dd_plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="""
+    Makes the dedispersion plans of many search candidates in one process and writes them to a single DDplan.txt
+    in the search pipeline's format. Plans are cached on disk so candidates with the same DM range are only planned once.
+    """)
+    parser.add_argument('names', type=str, nargs='*',
+                        help='The candidate name keys (candidateName_obsid_pointing). Blind* names are searched from '
+                             '--dm_min to --dm_max, dm_<DM>_* names and catalogue sources around their DM.')
+    parser.add_argument('--names_file', type=str,
+                        help='A file of candidate name keys, one per line, to use in addition to the names')
+    parser.add_argument('--dm_min', type=float, default=1.,
+                        help='Lowest DM of blind searches, default 1')
+    parser.add_argument('--dm_max', type=float, default=250.,
+                        help='Highest DM of blind searches, default 250')
+    parser.add_argument('-m', '--min_DM_step', type=float, default=0.02,
+                        help='The minimun DM step size, default 0.02')
+    parser.add_argument('--max_DM_step', type=float, default=500.0,
+                        help='The maximum DM step size, default 500.0')
+    parser.add_argument('--max_dms_per_job', type=int, default=5000,
+                        help='If Nsteps is greater than this value split it into multiple lines. '
+                             'This will cause the search pipeline to submit fewer DMs per job')
+    parser.add_argument('--dm_jobs', type=int, default=0,
+                        help='If greater than 0, splits and merges each plan into at most this many jobs of roughly '
+                             'equal predicted CPU time, each with at most --max_dms_per_job DM trials. Fails if a plan '
+                             'needs more jobs, as the search pipeline groups each candidate\'s jobs by this number')
+    parser.add_argument('--obs_length', type=float, default=4800,
+                        help='The observation length in seconds used to predict the CPU time of --dm_jobs')
+    parser.add_argument('--zmax', type=int, default=0,
+                        help='The accelsearch zmax used to predict the CPU time of --dm_jobs, default 0')
+    parser.add_argument('--cache_dir', type=str, default=DD_PLAN_CACHE_DIR,
+                        help='The directory of the cached plans. Default: {}'.format(DD_PLAN_CACHE_DIR))
+    parser.add_argument('--out', type=str, default='DDplan.txt',
+                        help='The output file. Default: DDplan.txt')
+    args=parser.parse_args()
+
+    names = list(args.names)
+    if args.names_file:
+        with open(args.names_file) as f:
+            names += [line.strip() for line in f if line.strip()]
+    # Keep the first of any repeated names so each plan is only written once
+    names = list(dict.fromkeys(names))
+    if not names:
+        parser.error("No candidate names given")
+
+    plans = batch_dd_plans(names, args.dm_min, args.dm_max, cache_dir=args.cache_dir,
+                           min_DM_step=args.min_DM_step, max_DM_step=args.max_DM_step,
+                           max_dms_per_job=args.max_dms_per_job)
+    # Candidates with the same DM range share a plan, so only partition each distinct plan once
+    partitions = {}
+    with open(args.out, "w") as outfile:
+        spamwriter = csv.writer(outfile, delimiter=',')
+        for name in names:
+            plan = plans[name]
+            if args.dm_jobs > 0:
+                plan_key = tuple(map(tuple, plan))
+                if plan_key not in partitions:
+                    partitions[plan_key], _ = partition_dd_plan(plan, args.obs_length, PIPELINE_TIMERES,
+                                                                PIPELINE_NFREQCHAN, zmax=args.zmax,
+                                                                n_jobs=args.dm_jobs,
+                                                                max_dms_per_job=args.max_dms_per_job)
+                plan = partitions[plan_key]
+            for row in plan:
+                spamwriter.writerow([name] + list(row))
+    print("Wrote the DD plans of {0} candidates to {1}".format(len(names), args.out))
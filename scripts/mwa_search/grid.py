@@ -17,11 +17,11 @@ from mwa_pb.mwa_tile import h2e
 import vcstools.metadb_utils as meta
 from vcstools.catalogue_utils import get_psrcat_ra_dec
 from vcstools.pointing_utils import sex2deg, format_ra_dec
-from vcstools.beam_calc import get_beam_power_over_time
 
 # mwa_search imports
 from mwa_search.obs_tools import getTargetAZZA
 from mwa_search.grid_tools import get_grid
+from mwa_search.beam_cache import get_beam_map
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="""
@@ -40,6 +40,7 @@ if __name__ == "__main__":
     parser.add_argument('-a','--all_pointings',action="store_true",help='Will calculate all the pointings within the FWHM of the observations tile beam.')
     parser.add_argument('-b', '--begin',type=int,help='Begin time of the obs for the --all_pointings options')
     parser.add_argument('-e', '--end',type=int,help='End time of the obs for the --all_pointings options')
+    parser.add_argument('--beam_lut',action="store_true",help='Interpolates the tile beam for --all_pointings from a lookup table instead of the analytic model')
     parser.add_argument('--dec_range',type=float,nargs='+',help='Dec limits: "decmin decmax". Default -90 90', default=[-90,90])
     parser.add_argument('--ra_range',type=float,nargs='+',help='RA limits: "ramin ramax". Default 0 360', default=[0,360])
     parser.add_argument('-v','--verbose_file',action="store_true",help='Creates a more verbose output file with more information than make_beam.c can handle.')
@@ -155,8 +156,7 @@ if __name__ == "__main__":
                 continue
             names_ra_dec.append(["name", rads[ni], decds[ni]])
         names_ra_dec = np.array(names_ra_dec)
-        power = get_beam_power_over_time(obs_metadata,
-                                         names_ra_dec, degrees=True)
+        power = get_beam_map(obs_metadata, names_ra_dec, dt=None, degrees=True, lut=args.beam_lut)
 
         #check each pointing is within the tile beam
         radls = []
@@ -1,7 +1,9 @@
 #! /usr/bin/env python3
 
+import csv
 import argparse
 from mwa_search.dispersion_tools import plot_sensitivity, dd_plan
+from mwa_search.ddplan_cost import optimise_dd_plan, plan_cost, partition_dd_plan, makespan
 
 
 if __name__ == "__main__":
@@ -33,6 +35,23 @@ if __name__ == "__main__":
     parser.add_argument('--max_dms_per_job', type=int, default=5000,
                         help='If Nsteps is greater than this value split it into multiple lines. '
                              'This will cause the search pipeline to submit fewer DMs per job')
+    parser.add_argument('--optimise', action='store_true',
+                        help='Search the smear factor, downsample breakpoints and number of subbands for the plan with '
+                             'the lowest predicted CPU time within the sensitivity loss budget')
+    parser.add_argument('--max_loss', type=float, nargs='+',
+                        help='The sensitivity loss budget of --optimise, either one fractional loss for all periods or one '
+                             'per period (1000, 100, 10, 1 ms). Default: the loss of the default plan')
+    parser.add_argument('--zmax', type=int, default=0,
+                        help='The accelsearch zmax used to predict the CPU time, default 0')
+    parser.add_argument('--n_jobs', type=int,
+                        help='Splits and merges the plan into at most this many jobs of roughly equal predicted CPU time, '
+                             'each with at most --max_dms_per_job DM trials')
+    parser.add_argument('--max_job_hours', type=float,
+                        help='Splits the plan into jobs predicted to take at most this many CPU hours')
+    parser.add_argument('--n_workers', type=int,
+                        help='The number of jobs that can run at once, used for the expected makespan. Default: all')
+    parser.add_argument('--csv_name', type=str,
+                        help='Writes the plan to DDplan.txt in the format of the search pipeline with this name in the first column')
     #parser.add_argument()
     args=parser.parse_args()
 
@@ -44,9 +63,27 @@ if __name__ == "__main__":
         args.centrefreq = channels
 
 
-    DD_plan_array = dd_plan( args.centrefreq, args.bandwidth, args.nfreqchan, args.timeres, args.lowDM, args.highDM,
-                             min_DM_step=args.min_DM_step, max_DM_step=args.max_DM_step,
-                             max_dms_per_job=args.max_dms_per_job)
+    if args.optimise:
+        max_loss = args.max_loss[0] if args.max_loss and len(args.max_loss) == 1 else args.max_loss
+        result = optimise_dd_plan(args.centrefreq, args.bandwidth, args.nfreqchan, args.timeres, args.lowDM, args.highDM,
+                                  obs_length=args.time, zmax=args.zmax, max_loss=max_loss,
+                                  min_DM_step=args.min_DM_step, max_DM_step=args.max_DM_step,
+                                  max_dms_per_job=args.max_dms_per_job)
+        DD_plan_array = result["plan"]
+        print("Optimised with smear factor {0}, breakpoint factor {1} and subband smearing {2} ms".format(
+              result["smear_fact"], result["breakpoint_fact"], result["nsub_time_res"]))
+        print("Sensitivity loss per period (1000, 100, 10, 1 ms): {0} (default plan: {1})".format(
+              ", ".join("{:.3f}".format(l) for l in result["loss"]),
+              ", ".join("{:.3f}".format(l) for l in result["default_loss"])))
+        print("Default plan predicted CPU hours: {:.1f}".format(result["default_cpu_hours"]))
+    else:
+        DD_plan_array = dd_plan( args.centrefreq, args.bandwidth, args.nfreqchan, args.timeres, args.lowDM, args.highDM,
+                                 min_DM_step=args.min_DM_step, max_DM_step=args.max_DM_step,
+                                 max_dms_per_job=args.max_dms_per_job)
+    if args.n_jobs or args.max_job_hours:
+        DD_plan_array, _ = partition_dd_plan(DD_plan_array, args.time, args.timeres, args.nfreqchan, zmax=args.zmax,
+                                             n_jobs=args.n_jobs, max_job_hours=args.max_job_hours,
+                                             max_dms_per_job=args.max_dms_per_job)
     print(" low DM | high DM | DeltaDM | Nsteps | Downsamp | nsub | Effective time resolution (ms) ")
     total_steps = 0
     for d in DD_plan_array:
@@ -54,6 +91,15 @@ if __name__ == "__main__":
                format(d[0], d[1], d[2], d[3], d[5], d[6], d[4]))
         total_steps += d[3]
     print("Total DM steps required: {}".format(total_steps))
+    job_hours = plan_cost(DD_plan_array, args.time, args.timeres, args.nfreqchan, zmax=args.zmax) / 3600.
+    print("Predicted CPU hours: {:.1f}".format(job_hours.sum()))
+    print("Expected makespan of the {0} jobs: {1:.1f} hours".format(len(job_hours), makespan(job_hours, args.n_workers)))
+
+    if args.csv_name:
+        with open("DDplan.txt", "w") as outfile:
+            spamwriter = csv.writer(outfile, delimiter=',')
+            for d in DD_plan_array:
+                spamwriter.writerow([args.csv_name] + list(d))
 
     if args.plot:
         #work out time to use
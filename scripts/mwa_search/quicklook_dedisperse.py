@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+
+import csv
+import argparse
+import logging
+from mwa_search.dedisperse import dedisperse_plan_row, DEDISP_BLOCK
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="""
+    Dedisperses PSRFITS search-mode files into PRESTO .dat and .inf time series with NumPy subband dedispersion,
+    for quick-look and targeted low DM searches without a PRESTO container. Either give a single set of DM trials
+    (like prepsubband) or a DDplan.txt made by the search pipeline or lfDDplan.py --csv_name.
+    quicklook_dedisperse.py -o J0437 -lodm 1 -dmstep 0.02 -numdms 200 -nsub 32 1234567890_*.fits
+    """)
+    parser.add_argument('fits_files', type=str, nargs='+',
+                        help='The PSRFITS search-mode files of the observation')
+    parser.add_argument('-o', '--outbase', type=str, required=True,
+                        help='The start of the output names, which are <outbase>_DM<DM>.dat and .inf')
+    parser.add_argument('-lodm', '--lowDM', type=float, default=0.,
+                        help='The lowest DM trial, default 0')
+    parser.add_argument('-dmstep', '--DM_step', type=float, default=1.,
+                        help='The DM step, default 1')
+    parser.add_argument('-numdms', '--nDMs', type=int, default=10,
+                        help='The number of DM trials, default 10')
+    parser.add_argument('-downsamp', '--downsamp', type=int, default=1,
+                        help='The number of time samples to average together, default 1')
+    parser.add_argument('-nsub', '--nsub', type=int, default=32,
+                        help='The number of subbands, which must divide the number of channels, default 32')
+    parser.add_argument('--ddplan', type=str,
+                        help='Dedisperse every row of this DDplan.txt (name,low_DM,high_DM,DM_step,nDM_step,timeres,'
+                             'downsample,nsub) instead of the single set of DM trials')
+    parser.add_argument('--name', type=str,
+                        help='Only use the --ddplan rows with this name')
+    parser.add_argument('-zerodm', '--zerodm', action='store_true',
+                        help='Subtract the mean over channels of each time sample')
+    parser.add_argument('-numout', '--numout', type=int,
+                        help='Pad or truncate the time series to this many samples')
+    parser.add_argument('-n', '--n_procs', type=int, default=1,
+                        help='The number of processes to dedisperse DM trial chunks with, default 1')
+    parser.add_argument('--block', type=int, default=DEDISP_BLOCK,
+                        help='The number of output samples dedispersed at once, default {}'.format(DEDISP_BLOCK))
+    parser.add_argument("-L", "--loglvl", type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Logger verbosity level. Default: INFO")
+    args=parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.loglvl), format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    if args.ddplan:
+        with open(args.ddplan) as f:
+            rows = [[float(v) for v in row[1:]] for row in csv.reader(f)
+                    if row and (args.name is None or row[0] == args.name)]
+        if not rows:
+            parser.error("No rows found in {}".format(args.ddplan))
+    else:
+        highDM = args.lowDM + args.DM_step * args.nDMs
+        rows = [[args.lowDM, highDM, args.DM_step, args.nDMs, None, args.downsamp, args.nsub]]
+
+    n_series = 0
+    for row in rows:
+        basenames = dedisperse_plan_row(args.fits_files, args.outbase, row, n_procs=args.n_procs, block=args.block,
+                                        zerodm=args.zerodm, numout=args.numout)
+        n_series += len(basenames)
+    print("Wrote {} dedispersed time series".format(n_series))
@@ -1,5 +1,6 @@
 #! /usr/bin/env python3
 
+import os
 import argparse
 import numpy as np
 import math
@@ -8,12 +9,18 @@ import math
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
 #astropy
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 
+#mwa_search
+from mwa_search.sky_coverage import sky_grid
+from mwa_search.beam_cache import find_beam_map, grid_tag, map_token
+from mwa_search.healpix_coverage import nside2npix, grid_to_healpix, half_power_pixels, covered_fraction,\
+                                        summed_power, image_pixels, render_cells, render_map, state_path,\
+                                        new_state, load_state, save_state, is_current, add_observation
+
 def sex2deg(ra, dec):
     """
     Convert sexagesimal coordinates to degrees.
@@ -61,7 +68,8 @@ def get_psrcat_ra_dec(pulsar_list=None, max_dm=1000., include_dm=False, query=No
     return pulsar_ra_dec
 
 
-def main(shade, shade_light, pulsar, pulsar_cand, res=1, plot_type='svg', ra_offset=False):
+def main(shade, shade_light, pulsar, pulsar_cand, res=1, plot_type='svg', ra_offset=False, nside=64, rebuild=False,
+         sensitivity=False):
     
     #Setting up some of the plots
     fig = plt.figure(figsize=(12, 8))
@@ -153,44 +161,66 @@ def main(shade, shade_light, pulsar, pulsar_cand, res=1, plot_type='svg', ra_off
                       [69, "B10", 1227009976, 10.6, -72.0]]
 
 
-    map_dec_range = range(-90, 91, res)
-    map_ra_range = range(0, 361, res)
-    RA=[]; Dec=[]; x = []; y = []
-    for i in map_dec_range:
-        for j in map_ra_range:
-            Dec.append(i)
-            RA.append(j)
-    for c in range(len(RA)):
-        if ra_offset:
-            if RA[c] > 180:
-                x.append(-RA[c]/180.*np.pi+2*np.pi)
-            else:
-                x.append(-RA[c]/180.*np.pi)
+    # The masks and image cells of each observation are kept in a coverage state between runs, so only
+    # observations whose beam maps have changed are resampled
+    npix = nside2npix(nside)
+    path = state_path("SMART", nside, ra_offset=ra_offset)
+    if rebuild:
+        state = new_state(nside, ra_offset=ra_offset)
+    else:
+        state = load_state(path, nside, ra_offset=ra_offset)
+
+    # Maps of observations that have been through plot_obs_pulsar.py are read from the beam map cache.
+    # The rest (including the planned observations) come from SMART_obs_data.npy, which is only read if needed
+    _, _, nx, _ = sky_grid(res, ra_offset=ra_offset)
+    smart_nz = {}
+    sources = {}
+    smart_data_mtime = os.path.getmtime("SMART_obs_data.npy") if os.path.exists("SMART_obs_data.npy") else None
+    for sid, sname, sobsid, sra, sdec in SMART_metadata:
+        beam_map = find_beam_map(sobsid, sra, sdec, grid_tag(res))
+        if beam_map is not None and beam_map.shape[1] == len(nx):
+            smart_nz[sid] = beam_map[0]
+            sources[sid] = map_token(beam_map.filename)
         else:
-            x.append(-RA[c]/180.*np.pi +np.pi)
-        y.append(Dec[c]/180.*np.pi)
-    ny = np.array(y)
-    nx = np.array(x)
-    smart_nz = []
+            sources[sid] = "SMART_obs_data.npy:{}:{}:res{}".format(smart_data_mtime, sid, res)
+    changed = [sobs for sobs in SMART_metadata if not is_current(state, sobs[1], sources[sobs[0]])]
+    if any(sid not in smart_nz for sid, _, _, _, _ in changed):
+        with open("SMART_obs_data.npy", 'rb') as f:
+            for i in range(70):
+                obs_data = np.load(f)
+                if i not in smart_nz:
+                    smart_nz[i] = obs_data
+    image_pix = image_pixels(nside, ra_offset=ra_offset)
+    if changed:
+        for sid, sname, _, _, _ in changed:
+            print("Updating the coverage of {}".format(sname))
+            power = grid_to_healpix(smart_nz[sid], res, nside)
+            power = power / power.max()
+            add_observation(state, sname, half_power_pixels(power), sources[sid], image_pix=image_pix, power=power)
+        save_state(state, path)
 
-    with open("SMART_obs_data.npy", 'rb') as f:
-        for i in range(70):
-            smart_nz.append(np.load(f))
+    # The summed sensitivity is the relative power of every observation within its half-power mask, added up
+    if sensitivity:
+        sensitivity_map = summed_power([state["masks"][sname] for _, sname, _, _, _ in SMART_metadata],
+                                       [state["powers"][sname] for _, sname, _, _, _ in SMART_metadata], npix)
+        mesh = render_map(ax, sensitivity_map, image_pix, cmap="Greys", zorder=0.4)
+        plt.colorbar(mesh, ax=ax, orientation="horizontal", shrink=0.6, pad=0.08, label="Summed relative power")
+        print("Mean summed relative power of the covered sky: {:.2f}".format(
+              sensitivity_map[sensitivity_map > 0].mean()))
 
     links_ras = []
     links_decs = []
     links_colors = []
     links_links = []
+    outline_layers = []
+    light_layers = []
+    dark_layers = []
     for sobs in SMART_metadata:
         print(sobs)
         sid, sname, sobsid, sra, sdec = sobs
-        nz = np.array(smart_nz[sid])
-        
-        # plot the contour
-        s = plt.tricontour(nx, ny, nz, levels=[max(nz)/2], alpha = 0.6,
-                        colors=smart_colours[sname[0]]['dark'],
-                        linewidths=linewidths, zorder=0.25)
-        
+        colour = smart_colours[sname[0]]['dark']
+        outline_layers.append([state["outlines"][sname], colour, 0.6])
+
         # Set up links scatter plot
         if ra_offset:
             if sra > 180:
@@ -200,29 +230,25 @@ def main(shade, shade_light, pulsar, pulsar_cand, res=1, plot_type='svg', ra_off
         else:
             links_ras.append(-sra/180.*np.pi+np.pi)
         links_decs.append(sdec/180.*np.pi)
-        links_colors.append(smart_colours[sname[0]]['dark'])
+        links_colors.append(colour)
         links_links.append('http://www.google.com')
-        
+
         #Shade selected obs
-        if shade_light:
-            if sobsid in shade_light:
-                cs = plt.tricontour(nx, ny, nz, levels=max(nz)/2, alpha=0.0)
-                cs0 = cs.collections[0]
-                cspaths = cs0.get_paths()
-                for cspath in cspaths:
-                    spch_0 = patches.PathPatch(cspath, facecolor=smart_colours[sname[0]]['dark'],
-                                                edgecolor='gray', lw=0.5, alpha=0.3, zorder=0.5)
-                    ax.add_patch(spch_0)
-
-        if shade:
-            if sobsid in shade:
-                cs = plt.tricontour(nx, ny, nz, levels=max(nz)/2, alpha=0.0)
-                cs0 = cs.collections[0]
-                cspaths = cs0.get_paths()
-                for cspath in cspaths:
-                    spch_0 = patches.PathPatch(cspath, facecolor=smart_colours[sname[0]]['dark'],
-                                                edgecolor=smart_colours[sname[0]]['dark'], lw=0.5, alpha=0.85, zorder=0.5)
-                    ax.add_patch(spch_0)
+        if shade_light and sobsid in shade_light:
+            light_layers += [[state["fills"][sname], colour, 0.3], [state["outlines"][sname], 'gray', 1.]]
+        if shade and sobsid in shade:
+            dark_layers += [[state["fills"][sname], colour, 0.85], [state["outlines"][sname], colour, 1.]]
+
+    # All the outlines and shading are drawn as a single image
+    render_cells(ax, outline_layers + light_layers + dark_layers, zorder=0.5)
+
+    counts = state["counts"]
+    print("Sky covered by the survey: {:.1f}% ({:.1f}% by more than one observation)".format(
+          100. * np.mean(counts > 0), 100. * np.mean(counts > 1)))
+    if shade:
+        print("Sky covered by the shaded observations: {:.1f}%".format(
+              100. * covered_fraction([state["masks"][sname] for _, sname, sobsid, _, _ in SMART_metadata
+                                       if sobsid in shade], npix)))
 
     # Plot the scatter links
     s = plt.scatter(links_ras, links_decs, c=links_colors, s=50)
@@ -295,10 +321,17 @@ if __name__ == "__main__":
                            help='A list of pulsar cands in the format "HH:MM:SS +DD:MM:SS HH:MM:SS +DD:MM:SS".')
     parser.add_argument('-r', '--resolution', type=int, default=1,
                             help='The resolution in degrees of the final plot (must be an integer). Default = 1')
+    parser.add_argument('--nside', type=int, default=64,
+                            help='The HEALPix nside of the coverage maps (a power of 2). Default = 64 (~0.9 deg pixels)')
+    parser.add_argument('--rebuild', action='store_true',
+                            help='Remakes the saved coverage of every observation instead of only the changed ones')
+    parser.add_argument('--sensitivity', action='store_true',
+                            help='Shades the sky by the summed relative power of the observations that cover it')
     parser.add_argument('-p', '--plot_type', type=str,
                             help='Determines the output plot type, Default="png".',default='png')
     parser.add_argument('--ra_offset', action='store_true',
                             help='Offsets the RA by 180 so that 0h is in the centre')
     args=parser.parse_args()
 
-    main(args.shade, args.shade_light, args.pulsar, args.pulsar_cand, res=args.resolution, plot_type=args.plot_type, ra_offset=args.ra_offset)
+    main(args.shade, args.shade_light, args.pulsar, args.pulsar_cand, res=args.resolution, plot_type=args.plot_type, ra_offset=args.ra_offset,
+         nside=args.nside, rebuild=args.rebuild, sensitivity=args.sensitivity)
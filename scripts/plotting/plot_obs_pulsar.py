@@ -1,18 +1,22 @@
 #! /usr/bin/env python
 
 import os
-import math
 import argparse
 import numpy as np
 import csv
 from scipy.interpolate import UnivariateSpline
 
 #vcstools
-from vcstools.beam_calc import get_beam_power_over_time
 from vcstools.catalogue_utils import get_psrcat_ra_dec
-from vcstools.pointing_utils import sex2deg, deg2sex
+from vcstools.pointing_utils import sex2deg
 from vcstools.metadb_utils import find_obsids_meta_pages, get_common_obs_metadata
 
+#mwa_search
+from mwa_search.sky_coverage import sky_grid, obs_sensitivity, combine_sensitivity,\
+                                    overlap_sensitivity, shade_mask, dec_line, stream_reductions
+from mwa_search.beam_cache import grid_tag
+from mwa_search.survey_plan import smart_plan, GLEAM_DEC_RANGE
+
 #matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
@@ -23,150 +27,8 @@ def SMART_obs_calc(degree_overlap, manual_overlap):
     """
     Work out how many observations are required to cover the southern sky
     """
-
-    #setting up the dec ranges
-    dec_range = [-72., -55., -40.5, -26.7, -13., +1.6, +18.3] #Gleam pointings
-    delays_range = [[0,0,0,0,6,6,6,6,12,12,12,12,18,18,18,18],\
-                    [0,0,0,0,4,4,4,4,8,8,8,8,12,12,12,12],\
-                    [0,0,0,0,2,2,2,2,4,4,4,4,6,6,6,6],\
-                    [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0],\
-                    [6,6,6,6,4,4,4,4,2,2,2,2,0,0,0,0],\
-                    [12,12,12,12,8,8,8,8,4,4,4,4,0,0,0,0],\
-                    [18,18,18,18,12,12,12,12,6,6,6,6,0,0,0,0]]
-
-    print("Using GLEAM dec range: {}".format(dec_range))
-    """
-    sweet_dec_range = [-82.8,-71.4,-63.1,-55.,-47.5,-40.4,-33.5,-26.7,-19.9,-13.,-5.9,1.6,9.7,18.6,29.4,44.8]
-    sweet_delays_range= [[0,0,0,0,7,7,7,7,14,14,14,14,21,21,21,21],\
-                         [0,0,0,0,6,6,6,6,12,12,12,12,18,18,18,18],\
-                         [0,0,0,0,5,5,5,5,10,10,10,10,15,15,15,15],\
-                         [0,0,0,0,4,4,4,4,8,8,8,8,12,12,12,12],\
-                         [0,0,0,0,3,3,3,3,6,6,6,6,9,9,9,9],\
-                         [0,0,0,0,2,2,2,2,4,4,4,4,6,6,6,6],\
-                         [0,0,0,0,1,1,1,1,2,2,2,2,3,3,3,3],\
-                         [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0],\
-                         [3,3,3,3,2,2,2,2,1,1,1,1,0,0,0,0],\
-                         [6,6,6,6,4,4,4,4,2,2,2,2,0,0,0,0],\
-                         [9,9,9,9,6,6,6,6,3,3,3,3,0,0,0,0],\
-                         [12,12,12,12,8,8,8,8,4,4,4,4,0,0,0,0],\
-                         [15,15,15,15,10,10,10,10,5,5,5,5,0,0,0,0],\
-                         [18,18,18,18,12,12,12,12,6,6,6,6,0,0,0,0],\
-                         [21,21,21,21,14,14,14,14,7,7,7,7,0,0,0,0],\
-                         [24,24,24,24,16,16,16,16,8,8,8,8,0,0,0,0]]
-
-    dec_range = []
-    delays_range =[]
-    sweet_spots_range = [0,2,4,7,10,12,14]
-    for i in sweet_spots_range:
-      dec_range.append(sweet_dec_range[i])
-      delays_range.append(sweet_delays_range[i])
-    print dec_range
-    """
-
-    #Going to work out how many pointings are needed
-    #setting up some metadata requirements
-    time = 4800 #one hour 20 min
-    channels = range(107,131)
-    minfreq = float(min(channels))
-    maxfreq = float(max(channels))
-    centrefreq = 1.28 * (minfreq + (maxfreq-minfreq)/2) #in MHz
-
-    start_obsid = '1117624530'
-    start_ra = 180.
-    Dec_FWHM_calc = []
-    RA_FWHM_calc = []
-    for i in range(-89,89,1):
-        for j in range(0,361,1):
-            Dec_FWHM_calc.append(i)
-            RA_FWHM_calc.append(j)
-
-    observations = []
-    ra_list =[]
-    dec_list =[]
-    delays_list = []
-    FWHM = []
-    FWHM_Dec = []
-    pointing_count = 0
-    for i in range(len(dec_range)):
-        #calculating the FWHM at this dec
-        ra_sex, deg_sex = deg2sex(start_ra, dec_range[i])
-        cord = [start_obsid, str(ra_sex), str(deg_sex), 1, delays_range[i],centrefreq, channels]
-        #powout=get_beam_power(cord, zip(RA_FWHM_calc,Dec_FWHM_calc), dt=600)
-        names_ra_dec = np.column_stack((['source']*len(RA_FWHM_calc), RA_FWHM_calc, Dec_FWHM_calc))
-        powout = get_beam_power_over_time(cord, names_ra_dec, dt=600, degrees = True)
-        powout_RA_line = []
-        powout_Dec_line = []
-        RA_line = []
-        Dec_line = []
-        for p in range(len(powout)):
-            #print(int(y[i]/np.pi*180.), int(dec) )
-            if int(Dec_FWHM_calc[p]) == int(dec_range[i]):
-                powout_RA_line.append(float(powout[p]))
-                RA_line.append(float(RA_FWHM_calc[p]))
-            if int (RA_FWHM_calc[p]) == int(start_ra):
-                powout_Dec_line.append(float(powout[p]))
-                Dec_line.append(float(Dec_FWHM_calc[p]))
-
-        print("\nValues for Dec " + str(dec_range[i]))
-        #work out RA FWHM (not including the drift scan, 0sec observation)
-        if args.fwhm:
-            spline = UnivariateSpline(RA_line, powout_RA_line-np.max(powout_RA_line)/2., s=0)
-        else:
-            spline = UnivariateSpline(RA_line, powout_RA_line-np.full(len(powout_RA_line),0.5), s=0)
-        try:
-            r1, r2 = spline.roots()
-        except ValueError:
-            print("No FWHM for " + str(dec_range[i]) + " setting to 1000 to skip")
-            FWHM.append(1000.)
-            pointing_count -=1
-        else:
-            FWHM.append(float(r2-r1))
-            print("FWHM along RA at dec "+ str(dec_range[i]) + ": " + str(FWHM[i]))
-
-        #work out Dec FWHM
-        if args.fwhm:
-            spline = UnivariateSpline(Dec_line, powout_Dec_line-np.max(powout_Dec_line)/2., s=0)
-            r1, r2 = spline.roots()
-            FWHM_Dec.append(float(r2-r1))
-            print("FWHM along Dec at dec "+ str(dec_range[i]) + ": " + str(FWHM_Dec[i]))
-
-        deg_move = total_angle = FWHM[i] - degree_overlap*math.cos(math.radians(dec_range[i])) + \
-                    float(time)/3600.*15.*math.cos(math.radians(dec_range[i]))
-        if manual_overlap is not None:
-            point_num_this_deg = manual_overlap[i]
-        else:
-            point_num_this_deg = int(360./deg_move) + 1
-        print("Number for this dec: " +str(point_num_this_deg))
-        deg_move = 360. / point_num_this_deg
-        overlap_true = FWHM[i] + float(time)/3600.*15.*math.cos(math.radians(dec_range[i])) -\
-                       360./point_num_this_deg
-        print("True overlap this dec: " + str(overlap_true))
-
-        # offset every second dec range by half a FWHM in RA
-        for x in range(point_num_this_deg):
-            if i % 2 == 0:
-                temp_ra = start_ra + x * deg_move
-                observations.append(str(int(start_obsid) + int(x*deg_move*240)))
-            else:
-                temp_ra = start_ra + x * deg_move +\
-                          deg_move / math.cos(math.radians(dec_range[i]))
-                observations.append(str(int(start_obsid) + int(x*deg_move*240) +\
-                                        int(deg_move*120)))
-            if temp_ra > 360.:
-               temp_ra = temp_ra -360.
-            ra_list.append(temp_ra)
-            dec_list.append(dec_range[i])
-            delays_list.append(delays_range[i])
-            total_angle += deg_move
-            pointing_count+=1
-
-    #Sort by ra
-    dec_list =     [x for _,x in sorted(zip(ra_list,dec_list))]
-    delays_list =  [x for _,x in sorted(zip(ra_list,delays_list))]
-    observations = [x for _,x in sorted(zip(ra_list,observations))]
-    ra_list = sorted(ra_list)
-
-    return observations, dec_list, ra_list, delays_list
+    print("Using GLEAM dec range: {}".format(GLEAM_DEC_RANGE))
+    return smart_plan(degree_overlap, manual_overlap, fwhm=args.fwhm)
 
 
 
@@ -231,6 +93,10 @@ if __name__ == "__main__":
                             help='Determines the output plot type, Default="png".',default='png')
     plot_group.add_argument('--ra_offset', action='store_true',
                             help='Offsets the RA by 180 so that 0h is in the centre')
+    plot_group.add_argument('--n_procs', type=int, default=1,
+                            help='The number of processes used to calculate the beam maps that are not already cached')
+    plot_group.add_argument('--beam_lut', action='store_true',
+                            help='Interpolates the tile beam from a lookup table, which is much faster for many observations')
     args=parser.parse_args()
 
     #Setting up some of the plots
@@ -261,22 +127,7 @@ if __name__ == "__main__":
     res = args.resolution
     map_dec_range = range(-90,91,res)
     map_ra_range = range(0,361,res)
-    RA=[]; Dec=[]; x = []; y = []
-    for i in map_dec_range:
-        for j in map_ra_range:
-            Dec.append(i)
-            RA.append(j)
-    for c in range(len(RA)):
-        if args.ra_offset:
-            if RA[c] > 180:
-                x.append(-RA[c]/180.*np.pi+2*np.pi)
-            else:
-                x.append(-RA[c]/180.*np.pi)
-        else:
-            x.append(-RA[c]/180.*np.pi +np.pi)
-        y.append(Dec[c]/180.*np.pi)
-    ny = np.array(y)
-    nx = np.array(x)
+    RA, Dec, nx, ny = sky_grid(res, ra_offset=args.ra_offset)
 
     #Working out the observations required -----------------------------------------------
     if args.all_obsids:
@@ -358,50 +209,22 @@ if __name__ == "__main__":
             delays_list.append(delays)
 
     #Loop over observations and calc beam power
-    for i, ob in enumerate(observations):
+    time_intervals = 600 # seconds
+    names_ra_dec = np.column_stack((['source']*len(RA), RA, Dec))
+    cords = [[ob, ra_list[i], dec_list[i], time, delays_list[i], centrefreq, channels] for i, ob in enumerate(observations)]
+    # max and summed power over time, calculated over a pool of processes through the beam map cache
+    reductions = stream_reductions(cords, names_ra_dec, n_procs=args.n_procs, dt=time_intervals, tag=grid_tag(res),
+                                   lut=args.beam_lut)
+    for i, (cord, nz, z_sens) in enumerate(reductions):
         print("Calculating obs {0}/{1}".format(i + 1, len(observations)))
         ra = ra_list[i]
         dec = dec_list[i]
         delays = delays_list[i]
 
-        cord = [ob, ra, dec, time, delays, centrefreq, channels]
-        z=[] ; z_sens =[]
-
-        #print(max(Dec), min(RA), Dec.dtype)
-        time_intervals = 600 # seconds
-        names_ra_dec = np.column_stack((['source']*len(RA), RA, Dec))
-        powout = get_beam_power_over_time(cord, names_ra_dec, dt=time_intervals, degrees = True)
-        #grab a line of beam power for the pointing declination
-        #if i == 0:
-        #    print("len powers list: " + str(powout.shape))
-        for c in range(len(RA)):
-            temppower = 0.
-            temppower_sense = 0.
-            for t in range(powout.shape[1]):
-                power_ra = powout[c,t,0]
-                temppower_sense += power_ra #average power kinds
-                nz_sens_overlap[c] += power_ra * math.cos(ny[c])
-                if power_ra > temppower:
-                    temppower = power_ra
-            z_sens.append(temppower_sense)
-            z.append(temppower)
-
-        nz=np.array(z)
+        nz_sens_overlap += z_sens * np.cos(ny)
 
         #calculates sensitiviy and removes zeros -------------------------
-        nz_sense_obs = []
-        for zsi in range(len(z_sens)):
-            if nz[zsi] < 0.001:
-                nz_sense_obs.append(np.nan)
-            else:
-                nz_sense_obs.append(4.96/np.sqrt(z_sens[zsi]))
-
-        for zi, zs in enumerate(nz_sense_obs):
-            if math.isnan(nz_sens[zi]):
-                nz_sens[zi] = zs
-            elif nz_sens[zi] > zs:
-                #append if larger
-                nz_sens[zi] = zs
+        nz_sens = combine_sensitivity(nz_sens, obs_sensitivity(nz, z_sens))
 
         if args.fwhm:
             levels = np.arange(0.5*max(nz), max(nz), 0.5/6.)
@@ -411,29 +234,7 @@ if __name__ == "__main__":
         # Fill group files ------------------------------------------
         if args.smart:
             #find middle ra for each pointing
-            powout_RA_line = []
-            RA_line = []
-            for p in range(len(nz)):
-                if args.ra_offset:
-                    if abs(ny[p]*180/np.pi + 0.001 - dec) < 0.5*float(res):
-                        powout_RA_line.append(float(nz[p]))
-                        temp_ra_line = - float(nx[p])*180/np.pi
-                        if temp_ra_line <= 0:
-                            temp_ra_line += 360.
-                        RA_line.append(temp_ra_line)
-
-                else:
-                    if abs(ny[p]*180/np.pi + 0.001 - dec) < 0.5*float(res):
-                        powout_RA_line.append(float(nz[p]))
-                        RA_line.append(180. - float(nx[p])*180/np.pi)
-
-            #if ra_offset it needs to be restarted because it'll start at 180 not 0
-            if args.ra_offset:
-                powout_RA_line = [x for _,x in sorted(zip(RA_line,powout_RA_line))]
-                RA_line = sorted(RA_line)
-                #janky fix because there's two 360 values at the end
-                RA_line = [0.] + RA_line[:-1]
-                powout_RA_line = [powout_RA_line[-1]] + powout_RA_line[:-1]
+            RA_line, powout_RA_line = dec_line(nz, nx, ny, dec, res, ra_offset=args.ra_offset)
 
             spline = UnivariateSpline(RA_line, powout_RA_line-np.max(powout_RA_line)/2., s=0)
             if len(spline.roots()) != 2:
@@ -500,17 +301,11 @@ if __name__ == "__main__":
                             if colour_groups[c] in args.shade or \
                                ("blue" in args.shade and i in [0, 69]):
                                 #sum powers for this colour to be shaded when plotting
-                                for zi in range(len(nz)):
-                                    if nz[zi] >= levels[0]:
-                                        nz_shade_colour[colour_groups[c]][zi] = nz[zi]
+                                nz_shade_colour[colour_groups[c]] = shade_mask(nz_shade_colour[colour_groups[c]], nz, levels[0])
 
                         # This is a temp feature that I'll delete to shade certain obs
                         if args.shade_temp and str(i) in args.shade_temp[1:]:
-                            #print(i, args.shade_temp[1:])
-                            for zi in range(len(nz)):
-                                if nz[zi] >= levels[0]:
-                                    #print(nz_shade_colour_temp[zi], nz[zi])
-                                    nz_shade_colour_temp[zi] = nz[zi]
+                            nz_shade_colour_temp = shade_mask(nz_shade_colour_temp, nz, levels[0])
 
         # plot contours ---------------------------------------
         if args.contour:
@@ -522,10 +317,7 @@ if __name__ == "__main__":
     # plot sens -------------------------------------------------------
     if args.sens:
         if args.overlap:
-            for zi in range(len(nz)):
-                if nz_sens_overlap[zi] < 0.5:
-                    nz_sens_overlap[zi] = np.nan
-            nz = 1.5*4.96/np.sqrt(nz_sens_overlap)
+            nz = overlap_sensitivity(nz_sens_overlap)
             #nz = nz_sens_overlap
         else:
             if args.incoh:
@@ -536,19 +328,9 @@ if __name__ == "__main__":
         with open('obs_plot_data.csv', 'w') as csvfile:
             spamwriter = csv.writer(csvfile, delimiter=',')
             spamwriter.writerow(['RA','Dec','Sens mJy'])
-            for ni in range(len(nx)):
-                if args.ra_offset:
-                    if RA[c] > 180:
-                        x.append(-RA[c]/180.*np.pi+2*np.pi)
-                    else:
-                        x.append(-RA[c]/180.*np.pi)
-                else:
-                    x.append(-RA[c]/180.*np.pi +np.pi)
-                y.append(Dec[c]/180.*np.pi)
-                ra_temp = -math.degrees(nx[ni])
-                if ra_temp < 0.:
-                    ra_temp = ra_temp + 360.
-                spamwriter.writerow([ra_temp, math.degrees(ny[ni]), nz[ni]])
+            ra_temp = -np.degrees(nx)
+            ra_temp[ra_temp < 0.] += 360.
+            spamwriter.writerows(zip(ra_temp.tolist(), np.degrees(ny).tolist(), nz.tolist()))
 
         nx.shape = (len(map_dec_range),len(map_ra_range))
         ny.shape = (len(map_dec_range),len(map_ra_range))
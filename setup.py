@@ -59,7 +59,8 @@ setup(name="mwa_search",
       scripts=['version.py',
                # mwa_search
                'scripts/mwa_search/cold_storage_mover.py',
-               'scripts/mwa_search/grid.py', 'scripts/mwa_search/lfDDplan.py',
+               'scripts/mwa_search/grid.py', 'scripts/mwa_search/lfDDplan.py', 'scripts/mwa_search/batch_ddplan.py',
+               'scripts/mwa_search/quicklook_dedisperse.py',
                'scripts/mwa_search/LOTAAS_wrapper.py',
                'scripts/mwa_search/search_launch_loop.sh', 'scripts/mwa_search/rsync_rm_loop.sh',
                'scripts/mwa_search/bestgridpos.py',
@@ -68,6 +69,8 @@ setup(name="mwa_search",
                'scripts/dpp/pulsars_in_fov.py', 'scripts/dpp/prepfold_cmd_make.py',
                'scripts/dpp/post_fold_filter.py', 'scripts/dpp/pulsar_polarimetry.py',
                'scripts/dpp/pulsar_processing_pipeline.py', 'scripts/dpp/observation_processing_pipeline.py',
+               'scripts/dpp/make_ephemerides.py', 'scripts/dpp/pfd_features.py', 'scripts/dpp/lotaas_classify.py',
+               'scripts/dpp/epndb_index.py', 'scripts/dpp/dpp_import_benchmark.py',
                # plotting
                'scripts/plotting/plot_obs_pulsar.py',
                'scripts/plotting/position_sn_heatmap_fwhm.py',
@@ -0,0 +1,33 @@
+"""
+Checks that partition_dd_plan() keeps to max_dms_per_job and never makes more jobs than the search pipeline
+groups each candidate's results by
+"""
+import pytest
+
+from mwa_search.dispersion_tools import dd_plan
+from mwa_search.ddplan_cost import partition_dd_plan
+
+PIPELINE_OBS = (150., 30.72, 3072, 0.1)
+
+
+@pytest.mark.parametrize("n_jobs", [25, 30, 60])
+def test_n_jobs_keeps_max_dms_per_job(n_jobs):
+    plan = dd_plan(*PIPELINE_OBS, 1, 2000, max_dms_per_job=200)
+    jobs, job_hours = partition_dd_plan(plan, 4800, 0.1, 3072, n_jobs=n_jobs, max_dms_per_job=200)
+    assert len(jobs) <= n_jobs
+    assert len(job_hours) == len(jobs)
+    assert max(job[3] for job in jobs) <= 200
+    assert sum(job[3] for job in jobs) == sum(row[3] for row in plan)
+
+
+def test_max_job_hours_keeps_max_dms_per_job():
+    plan = dd_plan(*PIPELINE_OBS, 1, 2000, max_dms_per_job=200)
+    jobs, _ = partition_dd_plan(plan, 4800, 0.1, 3072, max_job_hours=1000., max_dms_per_job=200)
+    assert max(job[3] for job in jobs) <= 200
+
+
+@pytest.mark.parametrize("max_dms_per_job", [None, 1000])
+def test_too_few_jobs_raises(max_dms_per_job):
+    plan = dd_plan(*PIPELINE_OBS, 1, 2000, max_dms_per_job=1000)
+    with pytest.raises(ValueError):
+        partition_dd_plan(plan, 4800, 0.1, 3072, n_jobs=6, max_dms_per_job=max_dms_per_job)
@@ -0,0 +1,130 @@
+"""
+Checks the PSRFITS search-mode reader and subband dedispersion of mwa_search.dedisperse with synthetic files
+"""
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from mwa_search.dedisperse import _unpack, open_observation, close_observation, read_samples, dedisperse_plan_row,\
+                                  DM_CONST
+
+NCHAN, NSBLK, TBIN = 32, 256, 1e-3
+FREQS = np.linspace(140., 170., NCHAN)
+
+
+def pack(samples, nbits):
+    """Packs samples into bytes, the first sample in the most significant bits"""
+    samples = np.asarray(samples, dtype=np.uint8).reshape(-1, 8 // nbits)
+    shifts = np.arange(8 - nbits, -1, -nbits, dtype=np.uint8)
+    return (samples << shifts).sum(axis=1).astype(np.uint8)
+
+
+def write_search_fits(path, data, freqs=FREQS, nbits=8, start_sec=0.):
+    """Writes (nsamples, nchan) samples as a single polarisation PSRFITS search-mode file"""
+    nrows = len(data) // NSBLK
+    nchan = data.shape[1]
+    rows = data[:nrows * NSBLK].reshape(nrows, NSBLK * nchan)
+    if nbits < 8:
+        rows = np.array([pack(row, nbits) for row in rows])
+    primary = fits.PrimaryHDU()
+    primary.header["STT_IMJD"] = 60000
+    primary.header["STT_SMJD"] = int(start_sec)
+    primary.header["STT_OFFS"] = start_sec - int(start_sec)
+    columns = [fits.Column(name="OFFS_SUB", format="D", array=(np.arange(nrows) + 0.5) * NSBLK * TBIN),
+               fits.Column(name="DAT_FREQ", format=f"{nchan}D", array=np.tile(freqs, (nrows, 1))),
+               fits.Column(name="DAT_WTS", format=f"{nchan}E", array=np.ones((nrows, nchan))),
+               fits.Column(name="DAT_OFFS", format=f"{nchan}E", array=np.zeros((nrows, nchan))),
+               fits.Column(name="DAT_SCL", format=f"{nchan}E", array=np.ones((nrows, nchan))),
+               fits.Column(name="DATA", format=f"{rows.shape[1]}B", array=rows.astype(np.uint8))]
+    subint = fits.BinTableHDU.from_columns(columns, name="SUBINT")
+    for key, value in (("NCHAN", nchan), ("NPOL", 1), ("NSBLK", NSBLK), ("TBIN", TBIN), ("NBITS", nbits),
+                       ("POL_TYPE", "AA+BB")):
+        subint.header[key] = value
+    fits.HDUList([primary, subint]).writeto(path)
+    return str(path)
+
+
+def noise(nsamples, nbits=8, seed=1):
+    return np.random.default_rng(seed).integers(0, 2**nbits, (nsamples, NCHAN)).astype(np.uint8)
+
+
+@pytest.mark.parametrize("nbits", [1, 2, 4])
+def test_unpack(nbits):
+    samples = np.random.default_rng(nbits).integers(0, 2**nbits, (3, 64)).astype(np.uint8)
+    packed = np.array([pack(row, nbits) for row in samples])
+    assert np.array_equal(_unpack(packed, nbits), samples)
+
+
+@pytest.mark.parametrize("nbits", [1, 2, 4, 8])
+def test_read_samples(tmp_path, nbits):
+    data = noise(4 * NSBLK, nbits=nbits)
+    obs = open_observation(write_search_fits(tmp_path / "obs.fits", data, nbits=nbits))
+    try:
+        assert obs["nsamples"] == len(data)
+        # Starts and ends part way through subints
+        assert np.array_equal(read_samples(obs, 100, 600), data[100:700].T)
+        assert np.allclose(read_samples(obs, 10, 50, downsamp=4), data[40:240].T.reshape(NCHAN, 50, 4).mean(axis=2))
+    finally:
+        close_observation(obs)
+
+
+def test_flipped_band(tmp_path):
+    data = noise(2 * NSBLK)
+    obs = open_observation(write_search_fits(tmp_path / "obs.fits", data, freqs=FREQS[::-1]))
+    try:
+        assert obs["flip"]
+        assert np.array_equal(obs["freqs"], FREQS)
+        assert np.array_equal(read_samples(obs, 0, 2 * NSBLK), data.T[::-1])
+    finally:
+        close_observation(obs)
+
+
+def test_files_joined_in_time_order(tmp_path):
+    data = noise(6 * NSBLK)
+    # Given out of order, the files are read in order of their start times
+    filenames = [write_search_fits(tmp_path / "b.fits", data[2 * NSBLK:], start_sec=2 * NSBLK * TBIN),
+                 write_search_fits(tmp_path / "a.fits", data[:2 * NSBLK])]
+    obs = open_observation(filenames)
+    try:
+        assert obs["nsamples"] == len(data)
+        assert np.array_equal(read_samples(obs, NSBLK, 3 * NSBLK), data[NSBLK:4 * NSBLK].T)
+    finally:
+        close_observation(obs)
+
+
+def dispersed_pulse(tmp_path, dm, t0, nsamples=16 * NSBLK):
+    """Noise with a pulse that arrives at the top of the band at sample t0, split over two files"""
+    data = noise(nsamples, nbits=4)
+    delays = np.rint(DM_CONST * dm * (1. / FREQS**2 - 1. / FREQS[-1]**2) / TBIN).astype(int)
+    data[t0 + delays, np.arange(NCHAN)] = 15
+    half = nsamples // 2
+    return [write_search_fits(tmp_path / "a.fits", data[:half], nbits=4),
+            write_search_fits(tmp_path / "b.fits", data[half:], nbits=4, start_sec=half * TBIN)]
+
+
+def test_finds_dispersed_pulse(tmp_path):
+    filenames = dispersed_pulse(tmp_path, 30., 1000)
+    basenames = dedisperse_plan_row(filenames, str(tmp_path / "out" / "test"), [26., 34., 2., 5, 1., 1, 8], block=512)
+    series = [np.fromfile(f"{basename}.dat", dtype="<f4") for basename in basenames]
+    snrs = [(s.max() - np.median(s)) / s.std() for s in series]
+    assert basenames[int(np.argmax(snrs))].endswith("_DM30.00")
+    assert abs(int(np.argmax(series[2])) - 1000) <= 1
+
+
+@pytest.mark.parametrize("extra", [500, -500])
+def test_numout(tmp_path, extra):
+    filenames = dispersed_pulse(tmp_path, 30., 1000)
+    row = [30., 32., 2., 1, 1., 1, 8]
+    basename, = dedisperse_plan_row(filenames, str(tmp_path / "full"), row)
+    full = np.fromfile(f"{basename}.dat", dtype="<f4")
+    basename, = dedisperse_plan_row(filenames, str(tmp_path / "numout"), row, numout=len(full) + extra)
+    series = np.fromfile(f"{basename}.dat", dtype="<f4")
+    assert len(series) == len(full) + extra
+    with open(f"{basename}.inf") as f:
+        assert f"Number of bins in the time series      =  {len(full) + extra}" in f.read()
+    if extra > 0:
+        # Padded with the mean, as prepsubband does
+        assert np.array_equal(series[:len(full)], full)
+        assert np.allclose(series[len(full):], full.mean(dtype=np.float64))
+    else:
+        assert np.array_equal(series, full[:len(series)])
@@ -0,0 +1,88 @@
+"""
+Checks the EPNDB cache of dpp.epndb against a small fake EPNDB json tree
+"""
+import os
+import json
+import numpy as np
+import pytest
+
+from dpp import epndb
+from dpp.epndb import load_pulsar, update_cache
+
+
+def add_entry(epndb_loc, author, pulsar, name, freq, npoints=8):
+    psr_dir = os.path.join(epndb_loc, "json", author, pulsar)
+    os.makedirs(psr_dir, exist_ok=True)
+    x = np.arange(npoints, dtype=float)
+    series = {"I": np.column_stack([x, freq + x]).tolist(), "V": np.column_stack([x, -x]).tolist()}
+    with open(os.path.join(psr_dir, f"{name}.json"), "w") as f:
+        json.dump({"hdr": {"freq": freq, "dm": 10., "rm": 1., "site": "MWA"}, "series": series}, f)
+
+
+def bump_mtime(path):
+    """Directory times only have to differ for the cache to notice, and some filesystems are coarse"""
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    epndb_loc = str(tmp_path / "epndb")
+    add_entry(epndb_loc, "smith", "J0437-4715", "a", 1400.)
+    add_entry(epndb_loc, "jones", "J0437-4715", "b", 150.)
+    add_entry(epndb_loc, "jones", "J2241-5236", "c", 150.)
+    return epndb_loc, str(tmp_path / "cache")
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Counts the walks of the whole tree"""
+    calls = []
+    scan_epndb = epndb.scan_epndb
+
+    def counting_scan(epndb_loc):
+        calls.append(epndb_loc)
+        return scan_epndb(epndb_loc)
+    monkeypatch.setattr(epndb, "scan_epndb", counting_scan)
+    return calls
+
+
+def test_entries_sorted_with_series(tree):
+    epndb_loc, cache_dir = tree
+    entries = load_pulsar("J0437-4715", epndb_loc, cache_dir=cache_dir)
+    assert [entry["freq"] for entry in entries] == [150., 1400.]
+    assert np.array_equal(entries[1]["I"][:, 1], 1400. + np.arange(8))
+    assert "Q" not in entries[0]
+    # One file per pulsar, so the series and entries are always replaced together
+    assert sorted(os.listdir(cache_dir)) == ["J0437-4715.npz", "J2241-5236.npz", "index.json"]
+
+
+def test_changed_pulsar_rebuilt(tree):
+    epndb_loc, cache_dir = tree
+    update_cache(epndb_loc, cache_dir=cache_dir)
+    add_entry(epndb_loc, "jones", "J2241-5236", "d", 300.)
+    bump_mtime(os.path.join(epndb_loc, "json", "jones", "J2241-5236"))
+    assert [entry["freq"] for entry in load_pulsar("J2241-5236", epndb_loc, cache_dir=cache_dir)] == [150., 300.]
+
+
+def test_unknown_pulsar_not_rescanned(tree, scans):
+    epndb_loc, cache_dir = tree
+    update_cache(epndb_loc, cache_dir=cache_dir)
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            load_pulsar("J0000+0000", epndb_loc, cache_dir=cache_dir)
+    assert len(scans) == 1
+
+    # Until a pulsar is added
+    add_entry(epndb_loc, "smith", "J0000+0000", "e", 150.)
+    bump_mtime(os.path.join(epndb_loc, "json", "smith"))
+    assert len(load_pulsar("J0000+0000", epndb_loc, cache_dir=cache_dir)) == 1
+    assert len(scans) == 2
+
+
+def test_without_epndb_location(tree):
+    epndb_loc, cache_dir = tree
+    with pytest.raises(KeyError):
+        load_pulsar("J0437-4715", None, cache_dir=cache_dir)
+    update_cache(epndb_loc, cache_dir=cache_dir)
+    assert len(load_pulsar("J0437-4715", None, cache_dir=cache_dir)) == 2
@@ -0,0 +1,57 @@
+"""
+Checks that dpp.features reproduces PulsarFeatureLab's type 6 features, which the LOTAAS classifier models are
+trained on. The parity test needs real .pfd files and PulsarFeatureLab, so it is skipped unless these are set:
+
+    DPP_TEST_PFD_DIR   a directory of PRESTO .pfd files
+    PFL_SCRIPT         the pathname of PulsarFeatureLab.py (V1.3.2)
+    PFL_PYTHON         the python that runs PulsarFeatureLab. Default: python2
+"""
+import os
+import glob
+import subprocess
+import numpy as np
+import pytest
+
+from dpp.features import extract_features, moments, FEATURE_NAMES
+
+PFD_DIR = os.environ.get("DPP_TEST_PFD_DIR")
+PFL_SCRIPT = os.environ.get("PFL_SCRIPT")
+PFL_PYTHON = os.environ.get("PFL_PYTHON", "python2")
+
+
+def read_pfl_arff(filename):
+    """Reads a PulsarFeatureLab --arff --meta file into {pfd basename: features}"""
+    features = {}
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("@"):
+                continue
+            values, _, pfd_file = line.partition("%")
+            features[os.path.basename(pfd_file.strip())] = np.array([float(v) for v in values.split(",")[:-1]])
+    return features
+
+
+def test_moments_match_scipy():
+    stats = pytest.importorskip("scipy.stats")
+    data = np.random.default_rng(0).gamma(2., size=(5, 200))
+    mean, std, kurtosis, skewness = moments(data)
+    assert np.allclose(mean, data.mean(axis=1))
+    assert np.allclose(std, data.std(axis=1))
+    assert np.allclose(kurtosis, stats.kurtosis(data, axis=1))
+    assert np.allclose(skewness, stats.skew(data, axis=1))
+
+
+@pytest.mark.skipif(not (PFD_DIR and PFL_SCRIPT), reason="DPP_TEST_PFD_DIR and PFL_SCRIPT are not set")
+def test_features_match_pulsarfeaturelab(tmp_path):
+    pfd_files = sorted(glob.glob(os.path.join(PFD_DIR, "*.pfd")))
+    assert pfd_files, f"No pfds found in {PFD_DIR}"
+    arff = tmp_path / "pfl.arff"
+    subprocess.run([PFL_PYTHON, PFL_SCRIPT, "-d", PFD_DIR, "-f", str(arff), "-t", "6", "-c", "3", "--meta", "--arff"],
+                   check=True)
+    expected = read_pfl_arff(arff)
+    native = extract_features(pfd_files)
+    for pfd_file, row in zip(pfd_files, native):
+        pfl_row = expected[os.path.basename(pfd_file)]
+        assert len(pfl_row) == len(FEATURE_NAMES)
+        np.testing.assert_allclose(row, pfl_row, rtol=1e-4, atol=1e-6, err_msg=pfd_file)
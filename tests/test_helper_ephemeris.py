@@ -0,0 +1,116 @@
+"""
+Checks that the batched psrcat call of dpp.helper_ephemeris gives every pulsar the same text as calling psrcat on it
+alone, using a fake psrcat that reads its version and pulsars from $PSRCAT_FILE
+"""
+import os
+import sys
+import json
+import stat
+import subprocess
+import pytest
+
+from dpp.helper_ephemeris import get_ephemerides, write_ephemerides
+
+# Like psrcat: ends each pulsar's ephemeris with an '@' line, warns about unknown pulsars and logs every call
+FAKE_PSRCAT = """#!{python}
+import os, sys, json
+with open(os.environ["PSRCAT_FILE"]) as f:
+    catalogue = json.load(f)
+with open(os.environ["FAKE_PSRCAT_LOG"], "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "-v":
+    print("Software version: 1.68")
+    print("Catalogue version number = " + catalogue["version"])
+    sys.exit()
+for name in sys.argv[2:]:
+    for psr in catalogue["pulsars"]:
+        if name in (psr["PSRJ"], psr.get("PSRB")):
+            for key in ("PSRJ", "PSRB", "RAJ", "DECJ", "F0", "DM", "PEPOCH"):
+                if key in psr:
+                    print("{{:<15}} {{}}".format(key, psr[key]))
+            print("@-----------------------------------------------------------------")
+            break
+    else:
+        print("WARNING: PSR " + name + " not in catalogue")
+"""
+
+PULSARS = [
+    {"PSRJ": "J0534+2200", "PSRB": "B0531+21", "RAJ": "05:34:31.9", "DECJ": "+22:00:52.1", "F0": "29.946923",
+     "DM": "56.77118", "PEPOCH": "48442.5"},
+    {"PSRJ": "J0437-4715", "RAJ": "04:37:15.8", "DECJ": "-47:15:09.1", "F0": "173.687946", "DM": "2.64498",
+     "PEPOCH": "55000"},
+    {"PSRJ": "J2241-5236", "RAJ": "22:41:42.0", "DECJ": "-52:36:36.2", "F0": "457.310149", "DM": "11.41085",
+     "PEPOCH": "55044"},
+]
+NAMES = ["B0531+21", "J0437-4715", "J9999+9999", "J2241-5236"]
+
+
+def write_catalogue(path, version, pulsars=PULSARS):
+    with open(path, "w") as f:
+        json.dump({"version": version, "pulsars": pulsars}, f)
+
+
+@pytest.fixture
+def psrcat(tmp_path, monkeypatch):
+    """Returns the fake psrcat and the file it logs its calls to"""
+    psrcat = tmp_path / "psrcat"
+    psrcat.write_text(FAKE_PSRCAT.format(python=sys.executable))
+    psrcat.chmod(psrcat.stat().st_mode | stat.S_IEXEC)
+    catalogue = tmp_path / "psrcat.db"
+    write_catalogue(catalogue, "1.70")
+    log = tmp_path / "psrcat.log"
+    monkeypatch.setenv("PSRCAT_FILE", str(catalogue))
+    monkeypatch.setenv("FAKE_PSRCAT_LOG", str(log))
+    return str(psrcat), log
+
+
+def eph_calls(log):
+    return [line for line in log.read_text().splitlines() if not line.startswith("-v")]
+
+
+@pytest.mark.parametrize("eph_type", ["-e", "-e2"])
+def test_batched_matches_single(psrcat, tmp_path, eph_type):
+    psrcat, log = psrcat
+    ephs = get_ephemerides(NAMES, eph_type=eph_type, psrcat=psrcat, cache_dir=str(tmp_path / "cache"))
+    assert list(ephs) == NAMES
+    for name in NAMES:
+        assert ephs[name] == subprocess.check_output([psrcat, eph_type, name]).decode("utf-8"), name
+    assert ["PSRB", "B0531+21"] in [line.split() for line in ephs["B0531+21"].splitlines()]
+    assert "WARNING" in ephs["J9999+9999"]
+
+
+def test_eph_files_match_single(psrcat, tmp_path):
+    psrcat, _ = psrcat
+    out_dir = tmp_path / "eph"
+    out_dir.mkdir()
+    eph_files = write_ephemerides(NAMES, out_dir=str(out_dir), exclude=["PEPOCH"], psrcat=psrcat,
+                                  cache_dir=str(tmp_path / "cache"))
+    assert sorted(eph_files) == sorted(str(out_dir / f"{name}.eph") for name in NAMES)
+    for name in NAMES:
+        # Like 'psrcat -e2 <pulsar> | grep -v PEPOCH'
+        single = subprocess.check_output([psrcat, "-e2", name]).decode("utf-8")
+        expected = "".join(line for line in single.splitlines(keepends=True) if "PEPOCH" not in line)
+        assert (out_dir / f"{name}.eph").read_text() == expected, name
+
+
+def test_cache_keyed_on_catalogue_version(psrcat, tmp_path):
+    psrcat, log = psrcat
+    cache_dir = str(tmp_path / "cache")
+    first = get_ephemerides(NAMES, psrcat=psrcat, cache_dir=cache_dir)
+    # One batched call, plus one call for the pulsar that isn't in the catalogue
+    assert len(eph_calls(log)) == 2
+
+    # Cached pulsars are not fetched again. Unknown pulsars are never cached
+    assert get_ephemerides(NAMES, psrcat=psrcat, cache_dir=cache_dir) == first
+    assert eph_calls(log)[2:] == ["-e2 J9999+9999", "-e2 J9999+9999"]
+
+    # A new catalogue has its own cache
+    updated = [dict(PULSARS[0], DM="56.7"), *PULSARS[1:]]
+    write_catalogue(os.environ["PSRCAT_FILE"], "1.71", updated)
+    mtime = os.path.getmtime(os.environ["PSRCAT_FILE"]) + 10
+    os.utime(os.environ["PSRCAT_FILE"], (mtime, mtime))
+    second = get_ephemerides(NAMES, psrcat=psrcat, cache_dir=cache_dir)
+    assert "56.7\n" in second["B0531+21"]
+    assert second["J0437-4715"] == first["J0437-4715"]
+    assert len(os.listdir(cache_dir)) == 2
+    assert any(version.startswith("1.71") for version in os.listdir(cache_dir))
@@ -0,0 +1,163 @@
+"""
+Checks that classify_arffs() scores every model with one persistent worker process, using a Python stand-in for the
+JVM worker, and that the worker is built and run inside singularity launches with its directory bound.
+Where javac is installed, also checks that the real worker writes what one JVM per model would, in any order
+"""
+import os
+import sys
+import stat
+import glob
+import shutil
+import zipfile
+import subprocess
+from os.path import basename
+import pytest
+
+from dpp import helper_lotaas
+from dpp.helper_lotaas import classify_arff, classify_arffs, build_worker, container_binds, LOTAAS_MODELS, DONE
+
+# Speaks the worker's protocol: writes <arff stem>.positive for each request and logs its pid
+STAND_IN = """
+import os, sys
+for line in sys.stdin:
+    args = line.rstrip("\\n").split("\\t")
+    arff = args[args.index("-p") + 1]
+    with open(os.path.splitext(arff)[0] + ".positive", "w") as f:
+        f.write(args[args.index("-m") + 1])
+    with open(sys.argv[1], "a") as f:
+        f.write(f"{os.getpid()}\\n")
+    print("%s 0", flush=True)
+""" % DONE
+
+# Stands in for 'singularity exec [-B path] ... <image> <command>': records the binds and fakes javac
+FAKE_SINGULARITY = """#!{python}
+import os, sys
+args = sys.argv[2:]
+binds = []
+while args[0].startswith("-"):
+    if args[0] == "-B":
+        binds.append(args[1])
+        args = args[1:]
+    args = args[1:]
+command = args[1:]
+with open(os.environ["FAKE_SINGULARITY_LOG"], "a") as f:
+    f.write(" ".join(binds) + "|" + " ".join(command) + "\\n")
+if command[0] == "javac":
+    open(os.path.join(command[2], "ClassifierWorker.class"), "w").close()
+"""
+
+
+def test_one_worker_scores_every_model(tmp_path):
+    stand_in = tmp_path / "stand_in.py"
+    stand_in.write_text(STAND_IN)
+    pid_log = tmp_path / "pids.txt"
+    arffs = []
+    for name in ("a", "b"):
+        arffs.append(str(tmp_path / f"{name}.arff"))
+        open(arffs[-1], "w").close()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    outputs = classify_arffs(arffs, model_dir="/models", worker_cmd=[sys.executable, str(stand_in), str(pid_log)],
+                             out_dir=str(out_dir))
+
+    assert len(outputs) == 2 * len(LOTAAS_MODELS)
+    for name in ("a", "b"):
+        for i, model in enumerate(LOTAAS_MODELS, 1):
+            with open(out_dir / f"{name}_m{i}.positive") as f:
+                assert f.read() == os.path.join("/models", model)
+    pids = pid_log.read_text().split()
+    assert len(pids) == 2 * len(LOTAAS_MODELS)
+    assert len(set(pids)) == 1
+
+
+def test_container_binds():
+    assert container_binds(["singularity", "exec", "-e", "img.sif"], ["/w"]) == \
+        ["singularity", "exec", "-B", "/w", "-e", "img.sif"]
+    assert container_binds(["nice"], ["/w"]) == ["nice"]
+    assert container_binds(None, ["/w"]) == []
+
+
+def test_worker_built_and_run_in_container(tmp_path, monkeypatch):
+    singularity = tmp_path / "singularity"
+    singularity.write_text(FAKE_SINGULARITY.format(python=sys.executable))
+    singularity.chmod(singularity.stat().st_mode | stat.S_IEXEC)
+    log = tmp_path / "singularity.log"
+    monkeypatch.setenv("FAKE_SINGULARITY_LOG", str(log))
+    worker_dir = str(tmp_path / "worker")
+    launch = [str(singularity), "exec", "-e", "img.sif"]
+
+    worker_cmd = build_worker(jar="/jar/in/container.jar", launch=launch, worker_dir=worker_dir)
+    # The second build reuses the compiled worker
+    assert build_worker(jar="/jar/in/container.jar", launch=launch, worker_dir=worker_dir) == worker_cmd
+
+    class_dir, = glob.glob(os.path.join(worker_dir, "*", "ClassifierWorker.class"))
+    assert worker_cmd == container_binds(launch, [worker_dir]) + \
+        ["java", "-cp", os.path.dirname(class_dir), "ClassifierWorker", "/jar/in/container.jar"]
+    calls = log.read_text().splitlines()
+    assert len(calls) == 1
+    binds, command = calls[0].split("|")
+    assert binds == worker_dir
+    assert command.startswith("javac -d ")
+    assert not glob.glob(os.path.join(worker_dir, "*.tmp"))
+
+
+# Keeps static state between calls, like the LOTAAS classifier's options and loaded models would
+STUB_CLASSIFIER = """
+import java.io.PrintWriter;
+
+public class StubClassifier {
+    static int calls = 0;
+    static String firstModel = null;
+
+    public static void main(String[] args) throws Exception {
+        calls++;
+        String model = null, arff = null;
+        for (int i = 0; i < args.length - 1; i++) {
+            if (args[i].equals("-m")) model = args[i + 1];
+            if (args[i].equals("-p")) arff = args[i + 1];
+        }
+        if (firstModel == null) firstModel = model;
+        try (PrintWriter out = new PrintWriter(arff.substring(0, arff.lastIndexOf('.')) + ".positive")) {
+            out.println(model + " " + firstModel + " " + calls);
+        }
+        System.exit(0);
+    }
+}
+"""
+
+
+@pytest.mark.skipif(shutil.which("javac") is None, reason="javac is not installed")
+def test_worker_matches_one_jvm_per_model_in_any_order(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "StubClassifier.java").write_text(STUB_CLASSIFIER)
+    subprocess.run(["javac", "-d", str(src), str(src / "StubClassifier.java")], check=True)
+    jar = str(tmp_path / "stub.jar")
+    with zipfile.ZipFile(jar, "w") as z:
+        z.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\nMain-Class: StubClassifier\n")
+        z.write(src / "StubClassifier.class", "StubClassifier.class")
+    arffs = []
+    for name in ("a", "b"):
+        arffs.append(str(tmp_path / f"{name}.arff"))
+        open(arffs[-1], "w").close()
+    models = [f"/models/model{i}" for i in range(1, 4)]
+
+    # The old loop: a new JVM for every model
+    expected = tmp_path / "expected"
+    expected.mkdir()
+    for arff in arffs:
+        classify_arff(arff, models=models, jar=jar, out_dir=str(expected))
+
+    # The worker must answer every request itself
+    def no_fallback(*args, **kwargs):
+        raise AssertionError("Fell back to a new JVM")
+    monkeypatch.setattr(helper_lotaas, "run_classifier_once", no_fallback)
+    worker_cmd = build_worker(jar=jar, worker_dir=str(tmp_path / "worker"))
+    for order in (arffs, arffs[::-1]):
+        out_dir = tmp_path / basename(order[0])
+        out_dir.mkdir()
+        classify_arffs(order, models=models, jar=jar, worker_cmd=worker_cmd, out_dir=str(out_dir))
+        assert sorted(os.listdir(out_dir)) == sorted(os.listdir(expected))
+        for output in os.listdir(expected):
+            assert (out_dir / output).read_text() == (expected / output).read_text(), output
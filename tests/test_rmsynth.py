@@ -0,0 +1,119 @@
+"""
+Checks the native RM synthesis of dpp.rmsynth. The pdv/psredit reader is checked against a synthetic dispersed,
+Faraday rotated pulse. The comparison with vcstools' rm_synth_pipe needs real archives and vcstools, so it is
+skipped unless this is set:
+
+    DPP_TEST_RM_LIST   a file of '<archive> <nbin> <on-pulse first bin> <on-pulse last bin> <period (s)>' lines
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+from dpp import rmsynth
+from dpp.rmsynth import load_stokes, rm_synth_coarse_fine, lambda_sq
+from dpp.psrfits import coherence_to_stokes
+
+RM_LIST = os.environ.get("DPP_TEST_RM_LIST")
+
+NCHAN, NBIN = 32, 128
+FREQ, BW, DM, PERIOD, RM = 150., 30.72, 10., 0.5, 25.
+# psredit -Q -c freq,bw,nchan,state,dm,dmc,rcvr:basis,rcvr:hand
+PSREDIT = f"fake.ar {FREQ} {BW} {NCHAN} Coherence {DM} 0 {{basis}} +1\n"
+
+
+def fake_pulsar(dispersed):
+    """AA, BB, CR, CI of a linearly polarised, Faraday rotated pulse and its channel frequencies"""
+    freqs = FREQ - BW / 2 + (np.arange(NCHAN) + 0.5) * BW / NCHAN
+    phases = np.arange(NBIN) / NBIN
+    delays = DM / 2.41e-4 * (1. / freqs ** 2 - 1. / FREQ ** 2) / PERIOD if dispersed else np.zeros(NCHAN)
+    pulse = np.exp(-0.5 * (((phases[None, :] - delays[:, None]) % 1 - 0.5) / 0.02) ** 2)
+    angle = 2 * RM * lambda_sq(freqs)
+    I, Q, U = pulse, 0.8 * pulse * np.cos(angle)[:, None], 0.8 * pulse * np.sin(angle)[:, None]
+    return freqs, np.stack([(I + Q) / 2, (I - Q) / 2, U / 2, np.zeros_like(I)])
+
+
+def pdv_output(coherence):
+    lines = ["File: fake.ar Src: J0000+0000 Nsub: 1 Nch: 32 Npol: 4 Nbin: 128"]
+    for ichan in range(NCHAN):
+        for ibin in range(NBIN):
+            lines.append(" ".join(["0", str(ichan), str(ibin)] + [f"{v:.10e}" for v in coherence[:, ichan, ibin]]))
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture
+def fake_pdv(monkeypatch):
+    """Makes load_stokes() read a dispersed Coherence archive of a linear feed with pdv and psredit"""
+    freqs, coherence = fake_pulsar(dispersed=True)
+
+    def check_output(cmd):
+        if cmd[0] == "psredit":
+            return PSREDIT.format(basis="lin").encode("utf-8")
+        assert cmd[:2] == ["pdv", "-Tt"]
+        return pdv_output(coherence).encode("utf-8")
+
+    monkeypatch.setattr(rmsynth.subprocess, "check_output", check_output)
+    # Force the pdv reader even where the psrchive python interface is installed
+    monkeypatch.setitem(sys.modules, "psrchive", None)
+    return freqs
+
+
+def test_pdv_reader_dedisperses_and_converts(fake_pdv):
+    freqs, stokes, weights = load_stokes("fake.ar", period=PERIOD)
+    _, coherence = fake_pulsar(dispersed=False)
+    aa, bb, cr, ci = coherence
+    assert np.allclose(freqs, fake_pdv)
+    assert stokes.shape == (4, NCHAN, NBIN)
+    assert np.all(weights == 1)
+    assert np.allclose(stokes, np.stack([aa + bb, aa - bb, 2 * cr, 2 * ci]), atol=1e-6)
+
+
+def test_pdv_reader_needs_period(fake_pdv):
+    with pytest.raises(ValueError):
+        load_stokes("fake.ar")
+
+
+def test_pdv_reader_rejects_circular_feeds(fake_pdv, monkeypatch):
+    check_output = rmsynth.subprocess.check_output
+    monkeypatch.setattr(rmsynth.subprocess, "check_output",
+                        lambda cmd: PSREDIT.format(basis="circ").encode("utf-8") if cmd[0] == "psredit" else check_output(cmd))
+    with pytest.raises(ValueError):
+        load_stokes("fake.ar", period=PERIOD)
+
+
+def test_coherence_to_stokes_needs_linear_right_handed_feed():
+    aa, bb, cr, ci = fake_pulsar(dispersed=False)[1]
+    assert np.allclose(coherence_to_stokes(aa, bb, cr, ci, basis="LIN", hand=1)[1], aa - bb)
+    for basis, hand in (("CIRC", 1), ("LIN", -1)):
+        with pytest.raises(ValueError):
+            coherence_to_stokes(aa, bb, cr, ci, basis=basis, hand=hand)
+
+
+def test_coarse_fine_finds_rm(fake_pdv):
+    result = rm_synth_coarse_fine("fake.ar", (0.4, 0.6), phi_steps=2000, period=PERIOD)
+    assert abs(result["rm"] - RM) < 0.1
+
+
+def read_rm_list():
+    with open(RM_LIST) as f:
+        return [line.split() for line in f if line.strip() and not line.startswith("#")]
+
+
+@pytest.mark.skipif(not RM_LIST, reason="DPP_TEST_RM_LIST is not set")
+def test_native_matches_rm_synth_pipe(tmp_path):
+    pytest.importorskip("rm_synthesis")
+    from dpp.helper_RM import RM_synth_native, RM_synth_pipe
+    for archive, nbin, on_min, on_max, period in read_rm_list():
+        cfgs = []
+        for run in ("native", "pipe"):
+            cfg = {"source": {"my_component": 0, "my_P": float(period),
+                              "gfit": {"comp_idx": {0: [int(on_min), int(on_max)]}, "profile": [0.] * int(nbin)}},
+                   "files": {"psr_dir": str(tmp_path), "archive": archive, "converted_fits": archive,
+                             "file_precursor": run},
+                   "pol": {}, "run_ops": {}}
+            cfgs.append(cfg)
+        RM_synth_native(cfgs[0])
+        RM_synth_pipe(cfgs[1])
+        native, pipe = cfgs[0]["pol"], cfgs[1]["pol"]
+        assert abs(native["RM"] - pipe["RM"]) <= pipe["RM_e"], archive
+        assert native["RM_e"] == pytest.approx(pipe["RM_e"], rel=0.2), archive
@@ -0,0 +1,70 @@
+"""
+Checks the native RVM fit of dpp.rvmfit. The comparison with PSRSALSA's ppolFit needs real profiles and ppolFit,
+so it is skipped unless this is set:
+
+    DPP_TEST_PASWING_LIST   a file of '<.paswing file> <l0 min (deg)> <l0 max (deg)>' lines
+"""
+import os
+import shutil
+import subprocess
+import numpy as np
+import pytest
+
+from dpp import rvmfit
+from dpp.rvmfit import rvm_grid, rvm_fit, rvm_pa, _wrap
+
+PASWING_LIST = os.environ.get("DPP_TEST_PASWING_LIST")
+
+
+def fake_swing(alpha=40., beta=5., l0=180., pa0=30., npoints=80):
+    lon = np.linspace(150, 210, npoints)
+    pa = _wrap(rvm_pa(alpha, beta, lon, l0) + pa0 + np.random.default_rng(1).normal(0, 1, npoints))
+    return lon, pa, np.ones(npoints)
+
+
+def test_l0_blocks_match_one_block(monkeypatch):
+    lon, pa, pa_err = fake_swing()
+    alphas, betas, l0s = np.linspace(0, 180, 13), np.linspace(-30, 30, 11), np.arange(150, 211, 1.)
+    whole = rvm_grid(lon, pa, pa_err, alphas, betas, l0s)
+    # Small enough that each alpha is split into several l0 blocks
+    monkeypatch.setattr(rvmfit, "GRID_BLOCK", len(betas) * len(lon) * 7)
+    blocked = rvm_grid(lon, pa, pa_err, alphas, betas, l0s)
+    for a, b in zip(whole, blocked):
+        assert np.array_equal(a, b)
+
+
+def test_recovers_fake_swing(tmp_path):
+    lon, pa, pa_err = fake_swing()
+    paswing = tmp_path / "fake.paswing"
+    np.savetxt(paswing, np.column_stack([np.arange(len(lon)), lon, pa, pa_err]))
+    fit = rvm_fit(str(paswing), l0_range=(150, 210), trials=61, n_procs=1)
+    assert abs(fit["l0"] - 180.) < 2.
+    assert abs(_wrap(fit["pa0"] - 30.)) < 2.
+
+
+def read_paswing_list():
+    with open(PASWING_LIST) as f:
+        return [line.split() for line in f if line.strip() and not line.startswith("#")]
+
+
+@pytest.mark.skipif(not PASWING_LIST, reason="DPP_TEST_PASWING_LIST is not set")
+@pytest.mark.skipif(shutil.which("ppolFit") is None, reason="ppolFit is not installed")
+def test_native_matches_ppolfit(tmp_path):
+    pytest.importorskip("vcstools")
+    from dpp.helper_RVMfit import read_RVM_fit, INITIAL_TRIALS
+    step = 180. / (INITIAL_TRIALS - 1)
+    for paswing, l0_min, l0_max in read_paswing_list():
+        l0_min, l0_max = float(l0_min), float(l0_max)
+        # The initial fit of RVM_fit()
+        outfile = tmp_path / "ppolfit.out"
+        with open(outfile, "w") as f:
+            subprocess.run(["ppolFit", "-g", f"{INITIAL_TRIALS} {INITIAL_TRIALS}", "-A", "0 180", "-B", "-30 30",
+                            "-l", f"{l0_min} 1", "-maxdl", str(l0_max - l0_min), "-best",
+                            "-device1", "/null", "-device2", "/null", paswing], stdout=f, check=True, cwd=tmp_path)
+        alpha, beta, l0, pa0, _ = read_RVM_fit(str(outfile))
+        fit = rvm_fit(paswing, alpha_range=(0, 180), beta_range=(-30, 30), l0_range=(l0_min, l0_max),
+                      trials=INITIAL_TRIALS)
+        assert abs(fit["alpha"] - alpha) <= 2 * step, paswing
+        assert abs(fit["beta"] - beta) <= 2 * 60. / (INITIAL_TRIALS - 1), paswing
+        assert abs(fit["l0"] - l0) <= 1., paswing
+        assert abs(_wrap(fit["pa0"] - pa0)) <= 2., paswing